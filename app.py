@@ -1,18 +1,34 @@
-from flask import Flask, request, jsonify, render_template, send_file
+from flask import Flask, request, jsonify, render_template, send_file, Response, stream_with_context, url_for
 from werkzeug.utils import secure_filename
 import os
+import hmac
 import json
 import logging
+import math
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Callable
 
 from url_processor import URLProcessor
-from vectorizer import OllamaAPI
+from vectorizer import OllamaAPI, OllamaEmbedder
+from context_packer import pack_context
+from retrieval import SemanticAnswerCache, question_guard
+from jobs import FINISHED_STATUSES, IngestionJob, IngestionQueue
+from http_client import get_http_stats
 from database import (
     ensure_database_exists,
     save_to_database,
     get_saved_data,
-    get_relevant_chunks
+    get_document_info,
+    get_job,
+    get_relevant_chunks,
+    get_relevant_chunks_batch,
+    get_retrieval_cache_stats,
+    get_corpus_generation,
+    normalize_filters,
+    delete_document
 )
 
 # Configuração de logging
@@ -30,15 +46,41 @@ app.config['UPLOAD_FOLDER'] = 'uploads'
 # Criar pasta de uploads se não existir
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+# Chunks candidatos recuperados por pergunta, antes do empacotamento do contexto
+CONTEXT_CANDIDATES = int(os.getenv('CONTEXT_CANDIDATES', 8))
+
+# Chamadas simultâneas ao modelo na rota /ask_batch
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', 4))
+
+# Respostas reaproveitadas para perguntas parecidas (mesmo modelo, filtros e versão do corpus).
+# Desativado por padrão: uma resposta reaproveitada por engano é servida sem aviso
+semantic_cache = SemanticAnswerCache(
+    max_entries=int(os.getenv('SEMANTIC_CACHE_SIZE', 0)),
+    threshold=float(os.getenv('SEMANTIC_CACHE_THRESHOLD', 0.9))
+)
+
 # Inicialização das APIs e processadores
 url_processor = URLProcessor()
 ollama_api = OllamaAPI()
 
+# O cache semântico compara perguntas por embeddings (vetores de palavras não captam paráfrases)
+semantic_embedder = None
+if semantic_cache.max_entries > 0:
+    semantic_embedder = url_processor.embedder or OllamaEmbedder()
+
 # Garantir que o banco de dados existe
 ensure_database_exists()
 
-def process_file(file_path: str, file_type: str) -> Optional[str]:
-    """Processa diferentes tipos de arquivos."""
+# Aquece o modelo padrão para que a primeira pergunta não pague o carregamento
+if os.getenv('PRELOAD_MODEL', 'false').lower() == 'true':
+    ollama_api.preload_model_async(os.getenv('MODEL_NAME', 'mistral'))
+
+# Token exigido (cabeçalho X-Admin-Token) nas rotas /admin; sem token configurado elas ficam bloqueadas
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '').strip()
+
+def process_file(file_path: str, file_type: str,
+                 progress: Optional[Callable[[float], None]] = None) -> Optional[str]:
+    """Processa diferentes tipos de arquivos (progress recebe a fração de páginas processadas)."""
     try:
         if file_type == 'application/pdf' or file_path.lower().endswith('.pdf'):
             import PyPDF2
@@ -53,6 +95,8 @@ def process_file(file_path: str, file_type: str) -> Optional[str]:
                     if text.strip():  # Só adiciona se tiver texto
                         content.append(text)
                     logger.info(f"Página {i+1}/{total_pages} processada")
+                    if progress:
+                        progress((i + 1) / total_pages)
                 
                 full_content = "\n\n".join(content)
                 logger.info(f"PDF processado: {len(full_content)} caracteres")
@@ -118,47 +162,30 @@ def upload_file():
                 return jsonify({'error': 'Nome do arquivo inválido'}), 400
                 
             filename = secure_filename(file.filename)
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+            # Prefixo único: uploads simultâneos com o mesmo nome não se sobrescrevem
+            file_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid.uuid4().hex}_{filename}")
             file.save(file_path)
             
             try:
-                content = process_file(file_path, file.content_type or 'text/plain')
-                if content:
-                    # Log do form data recebido
-                    logger.info("Form data recebido:")
-                    for key in request.form:
-                        logger.info(f"- {key}: {request.form[key]}")
-                    
-                    # Processa o conteúdo
-                    chunks_data = process_content(content, url_processor)
-                    logger.info(f"Chunks criados: {len(chunks_data)}")
-                    
-                    # Obtém o model_name do form
-                    model_name = request.form.get('model_name')
-                    logger.info(f"Model name recebido: {model_name}")
-                    
-                    # Salva no banco de dados
-                    save_to_database(
-                        content=content,
-                        model_name=model_name if model_name else 'mistral',
-                        source_type='file',
-                        source_path=filename,
-                        chunks_data=chunks_data
-                    )
-                    
-                    logger.info("Documento salvo no banco de dados")
-                    
-                    return jsonify({'message': 'Arquivo processado com sucesso!'})
-                else:
-                    return jsonify({'error': 'Erro ao processar arquivo'}), 400
-                    
+                # Log do form data recebido
+                logger.info("Form data recebido:")
+                for key in request.form:
+                    logger.info(f"- {key}: {request.form[key]}")
+                
+                # O processamento roda na fila de ingestão; o arquivo é removido ao final do job
+                job_id = ingestion_queue.submit('file', {
+                    'file_path': file_path,
+                    'filename': filename,
+                    'content_type': file.content_type or 'text/plain',
+                    'model_name': request.form.get('model_name') or 'mistral'
+                })
+                return job_accepted(job_id, 'Arquivo recebido; processamento em segundo plano')
+                
             except Exception as e:
-                logger.error(f"Erro no processamento do arquivo: {str(e)}")
-                return jsonify({'error': str(e)}), 500
-            finally:
-                # Limpa o arquivo após processamento
+                logger.error(f"Erro ao enfileirar o arquivo: {str(e)}")
                 if os.path.exists(file_path):
                     os.remove(file_path)
+                return jsonify({'error': str(e)}), 500
     
     # Se chegou aqui com POST, retorna com os modelos
     models = ollama_api.list_models()
@@ -180,37 +207,116 @@ def upload_data():
             content = data['content']
             model_name = data.get('model_name', 'mistral')
             
-            # Se o conteúdo é uma URL, processa ela primeiro
-            if content.startswith('http://') or content.startswith('https://'):
-                logger.info(f"Processando URL: {content}")
-                content = url_processor.extract_content_from_url(content)
-                if not content:
-                    return jsonify({'error': 'Não foi possível extrair conteúdo da URL'}), 400
-                source_type = 'url'
-                source_path = data['content']  # URL original
-            else:
-                source_type = 'text'
-                source_path = None
-            
-            # Processa o conteúdo
-            chunks_data = process_content(content, url_processor)
-            logger.info(f"Chunks criados: {len(chunks_data)}")
-            
-            # Salva no banco de dados
-            save_to_database(
-                content=content,
-                model_name=model_name,
-                source_type=source_type,
-                source_path=source_path,
-                chunks_data=chunks_data
-            )
-            
-            return jsonify({'message': 'Dados processados com sucesso!'})
+            # URLs são baixadas pelo próprio job
+            kind = 'url' if content.startswith('http://') or content.startswith('https://') else 'text'
+            job_id = ingestion_queue.submit(kind, {'content': content, 'model_name': model_name})
+            return job_accepted(job_id, 'Dados recebidos; processamento em segundo plano')
             
         except Exception as e:
-            logger.error(f"Erro no processamento dos dados: {str(e)}")
+            logger.error(f"Erro ao enfileirar os dados: {str(e)}")
             return jsonify({'error': str(e)}), 500
 
+def job_accepted(job_id: str, message: str):
+    """Resposta 202 de um upload enfileirado, com o endereço para acompanhar o job."""
+    return jsonify({
+        'message': message,
+        'job_id': job_id,
+        'status_url': url_for('job_status', job_id=job_id)
+    }), 202
+
+def ingest_content(job: IngestionJob, content: str, model_name: str, source_type: str,
+                   source_path: Optional[str]) -> Dict[str, Any]:
+    """Etapas comuns dos jobs de ingestão: chunking, vetorização e gravação no banco."""
+    chunks_data = process_content(content, url_processor, job)
+    logger.info(f"Chunks criados: {len(chunks_data)}")
+    
+    job.stage('saving')
+    document_id = save_to_database(
+        content=content,
+        model_name=model_name,
+        source_type=source_type,
+        source_path=source_path,
+        chunks_data=chunks_data,
+        job_id=job.id
+    )
+    logger.info("Documento salvo no banco de dados")
+    return {'document_id': document_id, 'chunks': len(chunks_data), 'characters': len(content)}
+
+def saved_document(job: IngestionJob) -> Optional[Dict[str, Any]]:
+    """
+    Resultado de um job retomado cujo documento já foi gravado antes de o
+    processo anterior parar (None se ainda não foi).
+    """
+    stored = get_job(job.id)
+    if not stored or stored.get('document_id') is None:
+        return None
+    logger.info(f"Job {job.id}: documento {stored['document_id']} já gravado; não será gravado de novo")
+    return get_document_info(stored['document_id'])
+
+def ingest_file_job(job: IngestionJob, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Job de upload de arquivo: extrai o texto e o ingere."""
+    try:
+        saved = saved_document(job)
+        if saved is not None:
+            return saved
+        job.stage('extracting')
+        content = process_file(payload['file_path'], payload['content_type'], progress=job.progress)
+        if not content:
+            raise ValueError('Erro ao processar arquivo')
+        return ingest_content(job, content, payload['model_name'], 'file', payload['filename'])
+    finally:
+        # Limpa o arquivo após processamento
+        if os.path.exists(payload['file_path']):
+            os.remove(payload['file_path'])
+
+def ingest_url_job(job: IngestionJob, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Job de upload de URL: baixa a página e ingere o conteúdo extraído."""
+    saved = saved_document(job)
+    if saved is not None:
+        return saved
+    job.stage('downloading')
+    logger.info(f"Processando URL: {payload['content']}")
+    content = url_processor.extract_content_from_url(payload['content'])
+    if not content:
+        raise ValueError('Não foi possível extrair conteúdo da URL')
+    return ingest_content(job, content, payload['model_name'], 'url', payload['content'])
+
+def ingest_text_job(job: IngestionJob, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Job de upload de texto."""
+    saved = saved_document(job)
+    if saved is not None:
+        return saved
+    return ingest_content(job, payload['content'], payload['model_name'], 'text', None)
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """
+    Estado de um job de ingestão: status, etapa, progresso (0 a 1), tempos
+    por etapa em ms e resultado ou erro.
+    
+    Com ?stream=true, envia o estado como Server-Sent Events ('progress') a
+    cada mudança, até o job terminar.
+    """
+    job = ingestion_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job não encontrado'}), 404
+    if request.args.get('stream', 'false').lower() not in ('true', '1'):
+        return jsonify(job)
+    
+    def generate():
+        state = job
+        while True:
+            yield sse_event('progress', state)
+            if state['status'] in FINISHED_STATUSES:
+                return
+            # Jobs de outro processo (sem notificação em memória) são consultados no banco
+            if not ingestion_queue.wait_for_change(job_id, state.get('version', -1), timeout=15):
+                time.sleep(1)
+            state = ingestion_queue.get(job_id) or state
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/files')
 def list_files():
     """Lista todos os documentos salvos."""
@@ -222,6 +328,23 @@ def list_files():
         logger.error(f"Erro ao listar arquivos: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/files/<int:document_id>', methods=['DELETE'])
+def remove_file(document_id):
+    """
+    Remove um documento, seus chunks e suas entradas nos índices de busca.
+    
+    A versão do corpus é incrementada, invalidando as respostas em cache e
+    as sessões de treino que o incluíam.
+    """
+    try:
+        if not delete_document(document_id):
+            return jsonify({'error': 'Documento não encontrado'}), 404
+        logger.info(f"Documento #{document_id} removido")
+        return jsonify({'message': f'Documento #{document_id} removido com sucesso!'})
+    except Exception as e:
+        logger.error(f"Erro ao remover documento {document_id}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/train', methods=['POST'])
 def train_model():
     """Treina o modelo com os documentos salvos."""
@@ -238,7 +361,11 @@ def train_model():
         doc_contents = [doc['content'] for doc in documents]
         
         # Treina o modelo
-        response = ollama_api.train_model(doc_contents, model_name)
+        response = ollama_api.train_model(
+            doc_contents, model_name,
+            corpus_version=get_corpus_generation(),
+            map_reduce=data.get('map_reduce')
+        )
         
         return jsonify({
             'message': 'Modelo treinado com sucesso!',
@@ -251,38 +378,318 @@ def train_model():
 
 @app.route('/ask', methods=['POST'])
 def ask_question():
-    """Processa perguntas usando o modelo treinado."""
+    """
+    Processa perguntas usando o modelo treinado.
+    
+    Com "stream": true no corpo, a resposta é enviada como Server-Sent Events
+    à medida que o modelo gera os tokens (ver ask_question_stream). Com
+    "models": [...], a pergunta é enviada a todos os modelos ao mesmo tempo
+    e a resposta vem do vencedor da corrida (ver ask_question_race).
+    
+    Com "semantic_cache": true (e SEMANTIC_CACHE_SIZE > 0), se uma pergunta
+    suficientemente parecida, com os mesmos números e nomes, já foi
+    respondida pelo mesmo modelo, com os mesmos filtros e a mesma versão do
+    corpus, a resposta guardada é devolvida sem recuperação nem geração.
+    """
     try:
         data = request.get_json()
         question = data.get('question')
         model_name = data.get('model_name', 'mistral')
+        retrieval_mode = data.get('retrieval_mode')
         
         if not question:
             return jsonify({'error': 'Pergunta não fornecida'}), 400
+        try:
+            # Validados antes do cache semântico, cujo escopo inclui os filtros
+            filters = normalize_filters(data.get('filters'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        race_models = data.get('models')
+        if race_models is not None and (not isinstance(race_models, list) or not race_models):
+            return jsonify({'error': 'models deve ser uma lista não vazia de modelos'}), 400
+        if race_models:
+            if data.get('preferred_model') is not None and data['preferred_model'] not in race_models:
+                return jsonify({'error': 'preferred_model deve estar em models'}), 400
+            if data.get('stream'):
+                return jsonify({'error': 'stream não é suportado com models (a resposta vem do vencedor)'}), 400
+            deadline_ms = data.get('race_deadline_ms')
+            if deadline_ms is not None and (isinstance(deadline_ms, bool) or not isinstance(deadline_ms, (int, float))
+                                            or not math.isfinite(deadline_ms) or deadline_ms < 0):
+                return jsonify({'error': 'race_deadline_ms deve ser um número não negativo'}), 400
+        
+        # Cache semântico: a pergunta mais parecida já respondida neste escopo
+        remember = None
+        if data.get('semantic_cache', False) and not race_models and semantic_embedder is not None:
+            try:
+                question_vector = semantic_embedder.embed([question])[0]
+            except Exception as e:
+                logger.warning(f"Cache semântico ignorado: erro ao gerar embedding da pergunta: {str(e)}")
+                question_vector = None
+            if question_vector is not None:
+                guard = question_guard(question)
+                scope = (model_name, json.dumps(filters or {}, sort_keys=True, default=str),
+                         retrieval_mode, data.get('context_token_budget'))
+                generation = get_corpus_generation()
+                cached = semantic_cache.get(scope, generation, question_vector, guard)
+                if cached is not None:
+                    entry, similarity = cached
+                    cache_info = {'similarity': similarity, 'question': entry['question']}
+                    logger.info(f"Resposta do cache semântico (similaridade {similarity:.3f}): {entry['question']}")
+                    if data.get('stream'):
+                        return Response(
+                            stream_with_context(stream_cached_answer(entry['answer'], cache_info)),
+                            mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+                        )
+                    return jsonify({'answer': entry['answer'], 'semantic_cache': cache_info})
+                
+                def remember(answer: str):
+                    if not ollama_api.is_error_response(answer):
+                        semantic_cache.put(scope, generation, question_vector, {'answer': answer, 'question': question},
+                                           guard)
         
         # Recupera chunks relevantes
-        relevant_chunks = get_relevant_chunks(question)
-        context = "\n".join([chunk[0] for chunk in relevant_chunks]) if relevant_chunks else None
+        retrieval_timings = {}
+        try:
+            relevant_chunks = get_relevant_chunks(
+                question,
+                top_k=CONTEXT_CANDIDATES,
+                url_processor=url_processor,
+                mode=retrieval_mode,
+                timings=retrieval_timings,
+                filters=filters
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # Monta o contexto: diversidade (MMR), sem sobreposição e dentro do orçamento de tokens
+        vectors = url_processor.vectorize_texts([chunk[0] for chunk in relevant_chunks]) if relevant_chunks else None
+        packed = pack_context(relevant_chunks, token_budget=data.get('context_token_budget'), vectors=vectors)
+        context = packed['text'] or None
+        context_stats = {key: value for key, value in packed.items() if key != 'text'}
+        
+        if data.get('stream'):
+            return Response(
+                stream_with_context(stream_answer(question, model_name, context, {
+                    'retrieval_timings': retrieval_timings,
+                    'context': context_stats
+                }, remember)),
+                mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
+        
+        if race_models:
+            race = ollama_api.ask_question_race(
+                question, race_models, context,
+                preferred=data.get('preferred_model'),
+                deadline_ms=data.get('race_deadline_ms')
+            )
+            return jsonify({
+                'answer': race['answer'],
+                'model': race['model'],
+                'race': {'reason': race['reason'], 'latency_ms': race['latency_ms']},
+                'retrieval_timings': retrieval_timings,
+                'context': context_stats
+            })
         
         # Processa a pergunta
-        answer = ollama_api.ask_question(question, model_name, context)
+        answer = ollama_api.ask_question(
+            question, model_name, context,
+            speculative=data.get('speculative'),
+            corpus_version=get_corpus_generation() if data.get('use_session', False) else None
+        )
+        if remember is not None:
+            remember(answer)
         
-        return jsonify({'answer': answer})
+        return jsonify({
+            'answer': answer,
+            'retrieval_timings': retrieval_timings,
+            'context': context_stats
+        })
         
     except Exception as e:
         logger.error(f"Erro ao processar pergunta: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-def process_content(content: str, processor: URLProcessor) -> List[Dict[str, Any]]:
-    """Processa o conteúdo usando o URLProcessor."""
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Formata um evento Server-Sent Events com dados em JSON."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def stream_answer(question: str, model_name: str, context: Optional[str], metadata: Dict[str, Any],
+                  remember: Optional[Callable[[str], None]] = None):
+    """
+    Gera os eventos SSE da resposta: metadados da recuperação, tokens e conclusão.
+    
+    Se remember for dado, recebe a resposta completa (no mesmo formato de
+    ask_question) quando o streaming termina.
+    """
+    yield sse_event('retrieval', metadata)
+    try:
+        stages = {}
+        for item in ollama_api.ask_question_stream(question, model_name, context):
+            event = item.pop('event')
+            if event == 'token':
+                stages.setdefault(item['stage'], []).append(item['text'])
+            elif event == 'done' and remember is not None:
+                answers = {stage: "".join(pieces) for stage, pieces in stages.items()}
+                if 'context' in answers and 'general' in answers:
+                    remember(OllamaAPI._combine_answers(answers['context'], answers['general']))
+                elif answers:
+                    remember(next(iter(answers.values())))
+            yield sse_event(event, item)
+    except Exception as e:
+        logger.error(f"Erro durante o streaming da resposta: {str(e)}")
+        yield sse_event('error', {'error': str(e)})
+
+def stream_cached_answer(answer: str, cache_info: Dict[str, Any]):
+    """Envia uma resposta do cache semântico com os mesmos eventos SSE de stream_answer."""
+    start_time = time.time()
+    yield sse_event('retrieval', {'semantic_cache': cache_info})
+    yield sse_event('stage', {'stage': 'cached'})
+    yield sse_event('token', {'stage': 'cached', 'text': answer})
+    elapsed_ms = (time.time() - start_time) * 1000
+    yield sse_event('done', {'first_token_ms': elapsed_ms, 'total_ms': elapsed_ms})
+
+@app.route('/ask_batch', methods=['POST'])
+def ask_batch():
+    """
+    Processa várias perguntas de uma vez.
+    
+    A recuperação é feita em lote (uma vetorização e um produto
+    matriz-matriz para todas as perguntas) e as chamadas ao modelo rodam com
+    no máximo BATCH_CONCURRENCY simultâneas. As respostas são enviadas como
+    NDJSON, uma linha por pergunta, na ordem de entrada.
+    """
+    data = request.get_json() or {}
+    questions = data.get('questions')
+    model_name = data.get('model_name', 'mistral')
+    
+    if not isinstance(questions, list) or not questions or not all(isinstance(q, str) and q for q in questions):
+        return jsonify({'error': 'Lista de perguntas não fornecida'}), 400
+    
+    try:
+        batch_chunks = get_relevant_chunks_batch(
+            questions,
+            top_k=CONTEXT_CANDIDATES,
+            url_processor=url_processor,
+            mode=data.get('retrieval_mode'),
+            filters=data.get('filters')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Vetoriza de uma vez os chunks distintos de todas as perguntas (similaridade do MMR)
+    texts = list(dict.fromkeys(chunk[0] for chunks in batch_chunks for chunk in chunks))
+    text_vectors = url_processor.vectorize_texts(texts) if texts else None
+    rows = {text: i for i, text in enumerate(texts)}
+    
+    def answer(question, relevant_chunks):
+        vectors = None
+        if text_vectors is not None and relevant_chunks:
+            vectors = text_vectors[[rows[chunk[0]] for chunk in relevant_chunks]]
+        packed = pack_context(relevant_chunks, token_budget=data.get('context_token_budget'), vectors=vectors)
+        # Perguntas do lote cedem a vez às interativas na fila do Ollama
+        with ollama_api.priority('batch'):
+            answer = ollama_api.ask_question(question, model_name, packed['text'] or None)
+        return {
+            'answer': answer,
+            'context': {key: value for key, value in packed.items() if key != 'text'}
+        }
+    
+    def generate():
+        executor = ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY)
+        futures = [executor.submit(answer, question, chunks) for question, chunks in zip(questions, batch_chunks)]
+        try:
+            for i, (question, future) in enumerate(zip(questions, futures)):
+                try:
+                    item = {'index': i, 'question': question, **future.result()}
+                except Exception as e:
+                    logger.error(f"Erro ao processar pergunta {i}: {str(e)}")
+                    item = {'index': i, 'question': question, 'error': str(e)}
+                yield json.dumps(item, ensure_ascii=False) + "\n"
+        finally:
+            # Cliente desconectado: descarta as perguntas ainda não iniciadas
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    logger.info(f"Lote de {len(questions)} perguntas recebido (concorrência {BATCH_CONCURRENCY})")
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/admin/models', methods=['GET', 'POST'])
+def admin_models():
+    """
+    Gerencia os modelos carregados no Ollama.
+    
+    GET lista os modelos carregados e os fixados; POST com model_name e
+    action ('preload', 'pin', 'unpin' ou 'unload') carrega, mantém
+    carregado indefinidamente, volta ao keep_alive padrão ou descarrega.
+    """
+    if not ADMIN_TOKEN:
+        return jsonify({'error': 'Rotas de administração desativadas: defina ADMIN_TOKEN'}), 403
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', '').encode(), ADMIN_TOKEN.encode()):
+        return jsonify({'error': 'Não autorizado'}), 401
+    
+    try:
+        if request.method == 'GET':
+            return jsonify({
+                'loaded': ollama_api.loaded_models(),
+                'pinned': sorted(ollama_api.pinned_models),
+                'keep_alive': ollama_api.keep_alive
+            })
+        
+        data = request.get_json() or {}
+        model_name = data.get('model_name')
+        actions = {
+            'preload': ollama_api.preload_model,
+            'pin': ollama_api.pin_model,
+            'unpin': ollama_api.unpin_model,
+            'unload': ollama_api.unload_model
+        }
+        if not model_name or data.get('action') not in actions:
+            return jsonify({'error': f"Informe model_name e action ({', '.join(actions)})"}), 400
+        
+        return jsonify(actions[data['action']](model_name))
+        
+    except Exception as e:
+        logger.error(f"Erro ao gerenciar modelo: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/metrics')
+def metrics():
+    """Métricas de desempenho da aplicação."""
+    return jsonify({
+        'retrieval_cache': get_retrieval_cache_stats(),
+        'http': get_http_stats(),
+        'speculation': ollama_api.get_speculation_stats(),
+        'response_cache': ollama_api.response_cache.get_stats() if ollama_api.response_cache else None,
+        'models_cache': ollama_api.get_models_cache_stats(),
+        'sessions': ollama_api.sessions.get_stats(),
+        'scheduler': ollama_api.get_scheduler_stats(),
+        'summary_cache': ollama_api.summary_cache.get_stats(),
+        'model_lifecycle': ollama_api.get_lifecycle_stats(),
+        'model_race': ollama_api.get_race_stats(),
+        'semantic_cache': semantic_cache.stats(),
+        'ingestion': ingestion_queue.get_stats()
+    })
+
+def process_content(content: str, processor: URLProcessor,
+                    job: Optional[IngestionJob] = None) -> List[Dict[str, Any]]:
+    """
+    Processa o conteúdo usando o URLProcessor (informando as etapas ao job, se houver).
+    
+    No modo hashing cada vetor é uma linha CSR (1, dim), que segue esparsa até o banco.
+    """
+    if job:
+        job.stage('chunking')
     chunks = processor.create_chunks(content)
+    if job:
+        job.stage('vectorizing')
     vectors, scores = processor.vectorize_chunks(chunks)
     
     chunks_data = []
     for i, (chunk, vector, score) in enumerate(zip(chunks, vectors, scores)):
         chunks_data.append({
             'content': chunk,
-            'vector': vector.tolist(),
+            'vector': vector,
             'score': float(score),
             'chunk_size': processor.chunk_size,
             'overlap': processor.overlap,
@@ -291,5 +698,24 @@ def process_content(content: str, processor: URLProcessor) -> List[Dict[str, Any
     
     return chunks_data
 
+# Fila de ingestão: uploads viram jobs registrados no banco e retomados após reinício
+ingestion_queue = IngestionQueue()
+ingestion_queue.register('file', ingest_file_job,
+                         [('extracting', 0.4), ('chunking', 0.1), ('vectorizing', 0.3), ('saving', 0.2)])
+ingestion_queue.register('url', ingest_url_job,
+                         [('downloading', 0.3), ('chunking', 0.1), ('vectorizing', 0.4), ('saving', 0.2)])
+ingestion_queue.register('text', ingest_text_job,
+                         [('chunking', 0.2), ('vectorizing', 0.5), ('saving', 0.3)])
+
+@app.before_request
+def start_ingestion_queue():
+    """
+    Retoma jobs interrompidos e renova leases a partir da primeira requisição.
+    
+    Iniciar no import faria o processo observador do reloader do Flask (que
+    não atende requisições) também assumir jobs de outros processos.
+    """
+    ingestion_queue.start()
+
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
@@ -0,0 +1,198 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from vectorizer import OllamaAPI
+
+try:
+    import aiohttp
+except ImportError:  # dependência opcional: só necessária para o cliente assíncrono
+    aiohttp = None
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+
+class AsyncOllamaAPI:
+    """
+    Contraparte assíncrona de OllamaAPI, sobre aiohttp.
+
+    Usa os mesmos prompts e o mesmo processo de duas etapas de OllamaAPI, mas
+    as gerações são corrotinas: um único processo (e uma única thread) pode
+    manter muitas gerações simultâneas. Um semáforo limita quantas chegam ao
+    Ollama ao mesmo tempo; as demais aguardam na fila. Cancelar a task de uma
+    chamada (task.cancel() ou asyncio.wait_for) encerra a requisição HTTP e
+    libera a vaga do semáforo.
+
+    Uso:
+        async with AsyncOllamaAPI() as api:
+            answers = await asyncio.gather(*(api.ask_question(q, 'mistral') for q in questions))
+    """
+
+    def __init__(self, base_url: Optional[str] = None, max_concurrency: Optional[int] = None,
+                 connect_timeout: Optional[float] = None, generation_timeout: Optional[float] = None):
+        if aiohttp is None:
+            raise RuntimeError("AsyncOllamaAPI requer o pacote aiohttp (pip install aiohttp)")
+        self.base_url = base_url or os.getenv('OLLAMA_BASE_URL', 'http://localhost:11434')
+        self.max_concurrency = max_concurrency or int(os.getenv('ASYNC_MAX_CONCURRENCY', 8))
+        self.connect_timeout = connect_timeout or float(os.getenv('CONNECT_TIMEOUT', 5))
+        self.generation_timeout = generation_timeout or float(os.getenv('GENERATION_TIMEOUT', 300))
+        self._session: Optional['aiohttp.ClientSession'] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.stats = {'requests': 0, 'active': 0, 'waiting': 0, 'peak_active': 0,
+                      'completed': 0, 'cancelled': 0, 'errors': 0}
+        logger.info(f"Inicializando API assíncrona do Ollama em {self.base_url} "
+                    f"(concorrência máxima: {self.max_concurrency})")
+
+    async def __aenter__(self) -> 'AsyncOllamaAPI':
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _get_session(self) -> 'aiohttp.ClientSession':
+        """Cria a sessão e o semáforo no primeiro uso, dentro do event loop em execução."""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+                timeout=aiohttp.ClientTimeout(total=None, connect=self.connect_timeout,
+                                              sock_read=self.generation_timeout)
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    async def close(self):
+        """Fecha a sessão HTTP e suas conexões."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def _acquire(self):
+        """Aguarda uma vaga no semáforo, contabilizando a fila."""
+        self._get_session()
+        self.stats['waiting'] += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.stats['waiting'] -= 1
+        self.stats['active'] += 1
+        self.stats['peak_active'] = max(self.stats['peak_active'], self.stats['active'])
+
+    def _release(self):
+        self.stats['active'] -= 1
+        self._semaphore.release()
+
+    async def list_models(self) -> List[str]:
+        """Lista os modelos disponíveis no Ollama."""
+        try:
+            async with self._get_session().get(f"{self.base_url}/api/tags") as response:
+                if response.status == 200:
+                    body = await response.json()
+                    return [model['name'] for model in body.get('models', [])]
+                logger.warning("Não foi possível obter lista de modelos, usando modelo padrão 'mistral'")
+                return ['mistral']
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Erro ao buscar modelos: {str(e)}")
+            return ['mistral']
+
+    async def stream_with_model(self, text: str, model_name: str,
+                                system_prompt: Optional[str] = None) -> AsyncIterator[str]:
+        """
+        Gera os trechos da resposta à medida que chegam do NDJSON de /api/generate.
+
+        A vaga do semáforo fica ocupada até o fim do streaming (ou até o
+        consumidor abandonar o gerador).
+        """
+        payload = {
+            "model": model_name,
+            "prompt": text,
+            "system": system_prompt if system_prompt else "",
+            "stream": True
+        }
+
+        await self._acquire()
+        self.stats['requests'] += 1
+        start_time = time.time()
+        try:
+            async with self._get_session().post(f"{self.base_url}/api/generate", json=payload) as response:
+                if response.status != 200:
+                    error_msg = f"Erro na API do Ollama: {response.status} - {await response.text()}"
+                    logger.error(error_msg)
+                    self.stats['errors'] += 1
+                    yield error_msg
+                    return
+
+                async for line in response.content:
+                    if not line.strip():
+                        continue
+                    body = json.loads(line)
+                    if 'error' in body:
+                        error_msg = f"Erro na API do Ollama: {body['error']}"
+                        logger.error(error_msg)
+                        self.stats['errors'] += 1
+                        yield error_msg
+                        return
+                    if body.get('response'):
+                        yield body['response']
+                    if body.get('done'):
+                        break
+            self.stats['completed'] += 1
+            logger.info(f"Geração assíncrona concluída em {time.time() - start_time:.2f} segundos")
+        except (asyncio.CancelledError, GeneratorExit):
+            self.stats['cancelled'] += 1
+            logger.info(f"Geração cancelada após {time.time() - start_time:.2f} segundos")
+            raise
+        except Exception as e:
+            error_msg = f"Erro ao conectar com Ollama: {str(e)}"
+            logger.error(error_msg)
+            self.stats['errors'] += 1
+            yield error_msg
+        finally:
+            self._release()
+
+    async def process_with_model(self, text: str, model_name: str, system_prompt: Optional[str] = None) -> str:
+        """Processa texto com o modelo e retorna a resposta completa."""
+        pieces = []
+        generator = self.stream_with_model(text, model_name, system_prompt)
+        try:
+            async for piece in generator:
+                pieces.append(piece)
+        finally:
+            await generator.aclose()
+        return "".join(pieces)
+
+    async def ask_question_with_context(self, question: str, context: str, model_name: str) -> str:
+        """Tenta responder a pergunta usando apenas o contexto dos documentos."""
+        prompt, system_prompt = OllamaAPI._context_prompt(question, context)
+        return await self.process_with_model(prompt, model_name, system_prompt)
+
+    async def ask_question_general(self, question: str, model_name: str) -> str:
+        """Faz uma pergunta usando apenas o conhecimento base do modelo."""
+        prompt, system_prompt = OllamaAPI._general_prompt(question)
+        return await self.process_with_model(prompt, model_name, system_prompt)
+
+    async def ask_question(self, question: str, model_name: str, context: Optional[str] = None) -> str:
+        """Mesmo processo de duas etapas de OllamaAPI.ask_question."""
+        start_time = time.time()
+        if not context:
+            response = await self.ask_question_general(question, model_name)
+        else:
+            response = await self.ask_question_with_context(question, context, model_name)
+            if OllamaAPI._needs_general_knowledge(response):
+                general_response = await self.ask_question_general(question, model_name)
+                response = OllamaAPI._combine_answers(response, general_response)
+        logger.info(f"Resposta assíncrona gerada em {time.time() - start_time:.2f} segundos")
+        return response
+
+    async def train_model(self, documents: List[str], model_name: str, context: Optional[str] = None) -> str:
+        """Apresenta os documentos ao modelo, como OllamaAPI.train_model."""
+        prompt, system_prompt = OllamaAPI._training_prompt(documents)
+        return await self.process_with_model(prompt, model_name, system_prompt)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Contadores de gerações: ativas, na fila, concluídas, canceladas e com erro."""
+        return dict(self.stats, max_concurrency=self.max_concurrency)
@@ -0,0 +1,89 @@
+import argparse
+import logging
+import time
+from typing import List, Tuple
+
+import numpy as np
+
+from retrieval import IVFIndex, VectorIndex
+
+# Configuração de logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def synthetic_corpus(n_chunks: int, dim: int, n_topics: int, seed: int = 0) -> np.ndarray:
+    """Gera vetores agrupados em tópicos, imitando um corpus real."""
+    rng = np.random.default_rng(seed)
+    topics = rng.normal(size=(n_topics, dim)).astype(np.float32)
+    labels = rng.integers(0, n_topics, size=n_chunks)
+    return topics[labels] + 1.5 * rng.normal(size=(n_chunks, dim)).astype(np.float32)
+
+def load_corpus(dim: int) -> Tuple[List[int], np.ndarray]:
+    """Carrega os vetores da tabela chunks do data.db."""
+    import database
+    rows = database._load_vector_rows(dim)
+    if not rows:
+        raise SystemExit(f"Nenhum vetor de dimensão {dim} encontrado em {database.DATABASE_FILE}")
+    return [row[0] for row in rows], np.vstack([row[1] for row in rows])
+
+def measure(search, queries: np.ndarray) -> Tuple[List[List[int]], np.ndarray]:
+    """Executa as queries e retorna os ids encontrados e as latências em ms."""
+    results = []
+    latencies = np.empty(len(queries))
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        results.append([chunk_id for chunk_id, _ in search(query)])
+        latencies[i] = (time.perf_counter() - start) * 1000
+    return results, latencies
+
+def main():
+    """Compara recall@k e latência do índice IVF com a busca exata."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--from-db', action='store_true', help='usa os vetores do data.db')
+    parser.add_argument('--chunks', type=int, default=50_000, help='tamanho do corpus sintético')
+    parser.add_argument('--dim', type=int, default=256, help='dimensão dos vetores')
+    parser.add_argument('--topics', type=int, default=200, help='tópicos do corpus sintético')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--lists', type=int, default=None, help='partições do IVF (padrão: sqrt(n))')
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    args = parser.parse_args()
+
+    if args.from_db:
+        ids, vectors = load_corpus(args.dim)
+    else:
+        vectors = synthetic_corpus(args.chunks, args.dim, args.topics)
+        ids = list(range(1, len(vectors) + 1))
+
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.choice(len(vectors), args.queries)] + 0.1 * rng.normal(size=(args.queries, vectors.shape[1]))
+
+    logger.info(f"Corpus: {len(ids)} vetores de dimensão {vectors.shape[1]}; {args.queries} queries, k={args.k}")
+
+    exact = VectorIndex(vectors.shape[1], initial_capacity=len(ids))
+    exact.add(ids, vectors)
+
+    start = time.perf_counter()
+    ivf = IVFIndex.train(vectors, n_lists=args.lists)
+    ivf.add(ids, vectors)
+    logger.info(f"IVF construído em {time.perf_counter() - start:.2f} s com {ivf.n_lists} partições")
+
+    # Os logs por busca distorceriam as latências
+    logging.getLogger('retrieval').setLevel(logging.WARNING)
+
+    truth, exact_latencies = measure(lambda q: exact.search(q, args.k), queries)
+
+    print(f"\n{'método':<16}{'recall@' + str(args.k):>12}{'média (ms)':>14}{'p95 (ms)':>12}")
+    print(f"{'exata':<16}{1.0:>12.3f}{exact_latencies.mean():>14.3f}{np.percentile(exact_latencies, 95):>12.3f}")
+    for nprobe in args.nprobe:
+        if nprobe > ivf.n_lists:
+            break
+        found, latencies = measure(lambda q: ivf.search(q, args.k, nprobe=nprobe), queries)
+        recall = np.mean([
+            len(set(a) & set(t)) / len(t) if t else 1.0 for a, t in zip(found, truth)
+        ])
+        label = f"ivf nprobe={nprobe}"
+        print(f"{label:<16}{recall:>12.3f}{latencies.mean():>14.3f}{np.percentile(latencies, 95):>12.3f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+import logging
+import os
+import re
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from retrieval import normalize_rows
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Orçamento de tokens do contexto enviado ao modelo
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', 1024))
+
+# Peso da relevância no MMR (1.0 = só relevância, 0.0 = só diversidade)
+MMR_LAMBDA = float(os.getenv('MMR_LAMBDA', 0.7))
+
+# Candidatos com similaridade acima deste valor a um já escolhido são descartados
+DUPLICATE_THRESHOLD = 0.95
+
+# Média aproximada de caracteres por token (sem depender do tokenizador do modelo)
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimativa do número de tokens de um texto."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def strip_overlap(previous: str, following: str, max_words: Optional[int] = None) -> str:
+    """
+    Remove do início de following as palavras que repetem o fim de previous.
+
+    create_chunks inicia cada chunk com as últimas palavras do anterior; esta
+    função desfaz essa sobreposição ao juntar chunks adjacentes.
+    """
+    previous_words = previous.split()
+    following_words = following.split()
+    limit = min(len(previous_words), len(following_words))
+    if max_words is not None:
+        limit = min(limit, max_words)
+    for size in range(limit, 0, -1):
+        if previous_words[-size:] == following_words[:size]:
+            return ' '.join(following_words[size:])
+    return following
+
+
+def _token_set_similarity(texts: Sequence[str]) -> np.ndarray:
+    """Matriz de similaridade de Jaccard entre os conjuntos de palavras dos textos."""
+    sets = [set(re.findall(r'\w+', text.lower())) for text in texts]
+    n = len(sets)
+    similarity = np.eye(n)
+    for i in range(n):
+        for j in range(i + 1, n):
+            union = len(sets[i] | sets[j])
+            similarity[i, j] = similarity[j, i] = len(sets[i] & sets[j]) / union if union else 0.0
+    return similarity
+
+
+def mmr_order(scores: Sequence[float], similarity: np.ndarray, mmr_lambda: float = MMR_LAMBDA) -> List[int]:
+    """
+    Ordena candidatos por maximal marginal relevance.
+
+    A cada passo escolhe o candidato que maximiza
+    lambda * relevância - (1 - lambda) * maior similaridade com os já escolhidos.
+    """
+    relevance = np.asarray(scores, dtype=np.float64)
+    if relevance.size == 0:
+        return []
+    top = relevance.max()
+    relevance = relevance / top if top > 0 else np.ones_like(relevance)
+
+    remaining = list(range(len(relevance)))
+    redundancy = np.zeros(len(relevance))
+    order = []
+    while remaining:
+        marginal = [mmr_lambda * relevance[i] - (1 - mmr_lambda) * redundancy[i] for i in remaining]
+        chosen = remaining.pop(int(np.argmax(marginal)))
+        order.append(chosen)
+        redundancy = np.maximum(redundancy, similarity[chosen])
+    return order
+
+
+def _assemble(selected: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Junta os chunks selecionados em seções por documento.
+
+    Chunks consecutivos do mesmo documento viram uma única seção, sem o texto
+    sobreposto; as seções ficam na ordem do chunk mais relevante de cada uma.
+    """
+    groups: Dict[Any, List[Dict[str, Any]]] = {}
+    for chunk in selected:
+        groups.setdefault(chunk['document_id'], []).append(chunk)
+
+    sections = []
+    chars_saved = 0
+    for document_id, chunks in groups.items():
+        chunks = sorted(chunks, key=lambda chunk: (chunk['chunk_index'] is None, chunk['chunk_index']))
+        current = None
+        for chunk in chunks:
+            adjacent = (
+                current is not None and document_id is not None and chunk['chunk_index'] is not None
+                and chunk['chunk_index'] == current['last_index'] + 1
+            )
+            if adjacent:
+                max_words = chunk['overlap'] // 2 + 1 if chunk['overlap'] else None
+                tail = strip_overlap(current['text'], chunk['content'], max_words)
+                chars_saved += len(chunk['content']) - len(tail)
+                current['text'] = f"{current['text']} {tail}" if tail else current['text']
+                current['last_index'] = chunk['chunk_index']
+                current['rank'] = min(current['rank'], chunk['rank'])
+            else:
+                current = {
+                    'text': chunk['content'],
+                    'last_index': chunk['chunk_index'],
+                    'rank': chunk['rank']
+                }
+                sections.append(current)
+
+    sections.sort(key=lambda section: section['rank'])
+    text = "\n\n".join(section['text'] for section in sections)
+    return {'text': text, 'tokens': estimate_tokens(text), 'sections': len(sections), 'chars_saved': chars_saved}
+
+
+def pack_context(chunks: Sequence[Sequence[Any]], token_budget: Optional[int] = None,
+                 vectors: Optional[np.ndarray] = None, mmr_lambda: float = MMR_LAMBDA) -> Dict[str, Any]:
+    """
+    Monta o contexto enviado ao modelo a partir dos chunks recuperados.
+
+    Etapas: ordena os candidatos por MMR (relevância com diversidade), descarta
+    quase-duplicatas, adiciona um a um enquanto o contexto montado couber no
+    orçamento de tokens, junta chunks adjacentes do mesmo documento e remove o
+    texto sobreposto.
+
+    Args:
+        chunks: Tuplas de get_relevant_chunks (content, score, source_path,
+            chunk_size, overlap, document_id, chunk_index)
+        token_budget: Máximo de tokens estimados do contexto
+        vectors: Vetores dos chunks para a similaridade do MMR; se None, usa
+            Jaccard entre as palavras
+
+    Returns:
+        Dicionário com text, tokens, sections, chunks_used, chunks_dropped,
+        chars_saved e input_tokens (tokens dos chunks sem empacotamento)
+    """
+    token_budget = token_budget or CONTEXT_TOKEN_BUDGET
+    candidates = []
+    for rank, row in enumerate(chunks):
+        candidates.append({
+            'content': row[0],
+            'score': row[1] if row[1] is not None else 0.0,
+            'overlap': row[4] if len(row) > 4 else 0,
+            'document_id': row[5] if len(row) > 5 else None,
+            'chunk_index': row[6] if len(row) > 6 else None,
+            'rank': rank
+        })
+
+    input_tokens = sum(estimate_tokens(candidate['content']) for candidate in candidates)
+    result = {'text': '', 'tokens': 0, 'sections': 0, 'chars_saved': 0}
+    if candidates:
+        if vectors is not None and len(vectors) == len(candidates):
+            normalized = normalize_rows(np.asarray(vectors, dtype=np.float32))
+            similarity = normalized @ normalized.T
+        else:
+            similarity = _token_set_similarity([candidate['content'] for candidate in candidates])
+
+        selected = []
+        chosen = []
+        for i in mmr_order([candidate['score'] for candidate in candidates], similarity, mmr_lambda):
+            if chosen and similarity[i, chosen].max() >= DUPLICATE_THRESHOLD:
+                continue
+            packed = _assemble(selected + [candidates[i]])
+            if packed['tokens'] <= token_budget:
+                selected.append(candidates[i])
+                chosen.append(i)
+                result = packed
+
+        # Se nem o melhor chunk cabe, envia o início dele truncado ao orçamento
+        if not selected:
+            text = candidates[0]['content'][:token_budget * CHARS_PER_TOKEN]
+            selected = [candidates[0]]
+            result = {'text': text, 'tokens': estimate_tokens(text), 'sections': 1, 'chars_saved': 0}
+
+        result['chunks_used'] = len(selected)
+    else:
+        result['chunks_used'] = 0
+
+    result['chunks_dropped'] = len(candidates) - result['chunks_used']
+    result['input_tokens'] = input_tokens
+    logger.info(f"Contexto montado: {result['chunks_used']} chunks em {result['sections']} seções, "
+                f"~{result['tokens']} tokens (orçamento {token_budget}, {input_tokens} sem empacotamento)")
+    return result
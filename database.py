@@ -1,7 +1,120 @@
 import sqlite3
-import json
 import os
+import json
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from url_processor import URLProcessor
+from retrieval import (
+    IVFIndex, PartitionedVectorIndex, RetrievalCache, build_vector_index, reciprocal_rank_fusion, vector_block,
+    vector_length
+)
+from vector_store import (
+    FORMAT_JSON, MemmapVectorStore, encode_vector, decode_vector, decode_sparse_vector, vector_dimension
+)
+
+DATABASE_FILE = os.getenv('DATABASE_FILE', 'data.db')
+
+# Modo padrão de recuperação: 'vector' (cosseno), 'bm25' (FTS5 no SQLite),
+# 'ann' (IVF) ou 'hybrid' (BM25 + cosseno com reciprocal rank fusion)
+RETRIEVAL_MODES = ('vector', 'bm25', 'ann', 'hybrid')
+RETRIEVAL_MODE = os.getenv('RETRIEVAL_MODE', 'vector')
+
+# Índice aproximado (IVF): partições varridas por busca (recall x latência)
+ANN_NPROBE = int(os.getenv('ANN_NPROBE', 8))
+
+# Onde os vetores da busca exata ficam: 'memory' (matriz carregada do SQLite
+# em cada processo) ou 'memmap' (arquivo float32 compartilhado entre workers)
+VECTOR_STORE = os.getenv('VECTOR_STORE', 'memory')
+
+# Filtros de metadados aceitos por get_relevant_chunks
+FILTER_KEYS = ('model_name', 'source_type', 'source_path_prefix', 'created_after', 'created_before')
+
+# Perguntas vetorizadas e pontuadas juntas por get_relevant_chunks_batch
+BATCH_QUERY_BLOCK = 256
+
+# Busca híbrida: candidatos por retriever = top_k * fator (mínimo 20)
+HYBRID_CANDIDATE_FACTOR = 4
+
+# Threads para executar os retrievers da busca híbrida em paralelo
+_retrieval_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='retrieval')
+
+# Índice vetorial em memória, carregado sob demanda (RLock: get_vector_index
+# é chamado com o lock já adquirido ao sincronizar os índices)
+_vector_index = None
+_ann_index = None
+_vector_index_lock = threading.RLock()
+# Só uma thread carrega ou treina o índice IVF; as demais aguardam e reaproveitam o resultado
+_ann_build_lock = threading.Lock()
+
+# Geração do corpus: guardada no banco (tabela corpus_meta) e incrementada na
+# mesma transação de cada ingestão ou remoção, de modo que todos os processos
+# vejam a mesma geração. _known_generation é a geração refletida pelos índices
+# em memória deste processo
+_known_generation = None
+
+# Disponibilidade do índice full-text (FTS5) por arquivo de banco, verificada uma vez
+_fts_available = {}
+
+# Cache LRU de resultados de get_relevant_chunks
+_retrieval_cache = RetrievalCache(max_entries=int(os.getenv('RETRIEVAL_CACHE_SIZE', 256)))
+
+def get_corpus_generation():
+    """
+    Retorna a geração atual do corpus, lida do banco.
+    
+    Se outro processo alterou o corpus desde a última leitura, os índices
+    vetoriais em memória deste processo são descartados (recarregados sob
+    demanda com os chunks novos).
+    """
+    conn = create_connection(DATABASE_FILE)
+    try:
+        row = conn.execute("SELECT value FROM corpus_meta WHERE key = 'generation'").fetchone()
+    finally:
+        conn.close()
+    generation = row[0] if row else 0
+    _sync_corpus_generation(generation)
+    return generation
+
+def bump_corpus_generation(cursor):
+    """
+    Marca o corpus como alterado, invalidando resultados em cache em todos os
+    processos. Deve ser chamada na transação que altera o corpus.
+    
+    Returns:
+        A nova geração
+    """
+    cursor.execute("UPDATE corpus_meta SET value = value + 1 WHERE key = 'generation'")
+    cursor.execute("SELECT value FROM corpus_meta WHERE key = 'generation'")
+    return cursor.fetchone()[0]
+
+def _sync_corpus_generation(generation, previous=None, apply_change=None):
+    """
+    Alinha os índices em memória com a geração do corpus.
+    
+    previous e apply_change descrevem uma alteração feita por este processo
+    (previous -> generation): se os índices estão em previous, apply_change
+    os atualiza incrementalmente. Qualquer outra diferença significa que
+    outro processo alterou o corpus, e os índices são descartados.
+    """
+    global _known_generation, _vector_index, _ann_index
+    with _vector_index_lock:
+        if _known_generation == generation:
+            return
+        if apply_change is not None and _known_generation == previous:
+            apply_change()
+        else:
+            # O store memory-mapped é compartilhado: os outros processos gravam nele
+            if VECTOR_STORE != 'memmap':
+                _vector_index = None
+            _ann_index = None
+        _known_generation = generation
+
+def get_retrieval_cache_stats():
+    """Contadores de acertos/falhas do cache de recuperação."""
+    return _retrieval_cache.stats()
 
 def create_connection(db_file):
     """Create a database connection to the SQLite database specified by db_file."""
@@ -13,13 +126,14 @@ def ensure_database_exists():
     Verifica se o banco de dados existe e está configurado corretamente.
     Se não existir, cria com a estrutura adequada.
     """
-    if not os.path.exists('data.db'):
+    if not os.path.exists(DATABASE_FILE):
         print("Criando novo banco de dados...")
         initialize_database()
         return
     
     # Verifica se as tabelas necessárias existem
-    conn = create_connection('data.db')
+    conn = create_connection(DATABASE_FILE)
+    migrated = 0
     try:
         with conn:
             cursor = conn.cursor()
@@ -62,8 +176,89 @@ def ensure_database_exists():
                 cursor.execute("DROP TABLE documents_old")
                 
                 print("Migração de dados concluída com sucesso!")
+                cursor.execute("PRAGMA table_info(chunks)")
+                columns = {row[1] for row in cursor.fetchall()}
+            
+            # Bancos anteriores guardam os vetores como texto JSON, sem formato
+            if 'vector_format' not in columns:
+                cursor.execute(f"ALTER TABLE chunks ADD COLUMN vector_format TEXT DEFAULT '{FORMAT_JSON}'")
+            
+            initialize_indexes(cursor)
+            initialize_jobs(cursor)
+            initialize_meta(cursor)
+            migrated = migrate_vectors_to_binary(cursor)
+            
+            # Bancos anteriores não têm o índice full-text
+            cursor.execute("SELECT name FROM sqlite_master WHERE name = 'chunks_fts'")
+            if cursor.fetchone() is None and initialize_fts(cursor):
+                print("Indexando chunks existentes para busca full-text...")
+                cursor.execute("INSERT INTO chunks_fts(chunks_fts) VALUES ('rebuild')")
+        
+        if migrated:
+            # Devolve ao sistema de arquivos o espaço liberado pelos vetores JSON
+            print("Compactando banco de dados...")
+            conn.execute("VACUUM")
     finally:
         conn.close()
+    _fts_available.pop(DATABASE_FILE, None)
+
+def migrate_vectors_to_binary(cursor, batch_size=500, url_processor=None):
+    """
+    Converte os chunks com vetores JSON (bancos antigos) para o formato binário.
+    
+    Os vetores JSON vêm de um TfidfVectorizer ajustado documento a documento:
+    sua dimensão é o vocabulário de cada documento e não é comparável com o
+    espaço vetorial atual, então seriam descartados pela busca. Por isso o
+    conteúdo desses chunks é revetorizado com o URLProcessor. Se a
+    vetorização falhar (ex.: modo 'ollama' com o servidor fora do ar), os
+    chunks restantes continuam em JSON e são revetorizados na próxima
+    inicialização.
+    
+    Returns:
+        Número de chunks convertidos
+    """
+    cursor.execute("SELECT COUNT(*) FROM chunks WHERE vector_format IS NULL OR vector_format = ?", (FORMAT_JSON,))
+    total = cursor.fetchone()[0]
+    if not total:
+        return 0
+    
+    print(f"Revetorizando {total} chunks com vetores JSON do formato antigo...")
+    if url_processor is None:
+        url_processor = URLProcessor()
+    migrated = 0
+    last_id = 0
+    while True:
+        cursor.execute("""
+            SELECT id, content FROM chunks
+            WHERE (vector_format IS NULL OR vector_format = ?) AND id > ?
+            ORDER BY id
+            LIMIT ?
+        """, (FORMAT_JSON, last_id, batch_size))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        
+        try:
+            vectors, _ = url_processor.vectorize_chunks([content or '' for _, content in rows])
+        except Exception as e:
+            print(f"Aviso: não foi possível revetorizar os chunks antigos: {str(e)}")
+            break
+        updates = []
+        for (chunk_id, _), vector in zip(rows, vectors):
+            blob, vector_format = encode_vector(vector)
+            updates.append((blob, vector_format, chunk_id))
+        cursor.executemany("UPDATE chunks SET vector = ?, vector_format = ? WHERE id = ?", updates)
+        
+        migrated += len(rows)
+        last_id = rows[-1][0]
+        print(f"- {migrated}/{total} chunks revetorizados...")
+    
+    if migrated < total:
+        print(f"Aviso: {total - migrated} chunks continuam com vetores do formato antigo e não aparecem na "
+              f"busca vetorial; serão revetorizados na próxima inicialização (ou reenvie os documentos)")
+    if migrated:
+        bump_corpus_generation(cursor)
+    return migrated
 
 def initialize_tables(cursor):
     """Cria as tabelas do banco de dados."""
@@ -87,25 +282,125 @@ def initialize_tables(cursor):
             content TEXT,
             chunk_index INTEGER,
             relevance_score REAL,
-            vector TEXT,  -- vetor serializado como JSON
+            vector BLOB,  -- vetor serializado (ver vector_format)
             chunk_size INTEGER,  -- tamanho do chunk usado
             overlap INTEGER,     -- sobreposição usada
+            vector_format TEXT DEFAULT 'json',  -- 'csr-f32', 'dense-f32', 'dense-f16' ou 'json' (legado)
             FOREIGN KEY (document_id) REFERENCES documents (id)
         )
     """)
+    
+    initialize_indexes(cursor)
+    initialize_fts(cursor)
+    initialize_jobs(cursor)
+    initialize_meta(cursor)
+
+def initialize_indexes(cursor):
+    """Cria os índices usados pelos filtros de metadados e pelas junções."""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_chunks_document ON chunks (document_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_documents_partition ON documents (model_name, source_type)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_documents_source_path ON documents (source_path)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_documents_created_at ON documents (created_at)")
+
+def initialize_fts(cursor):
+    """
+    Cria o índice full-text (FTS5) sobre chunks.content.
+    
+    A tabela usa chunks como conteúdo externo e é mantida em sincronia por
+    triggers, então save_to_database não precisa inserir nela explicitamente.
+    
+    Returns:
+        False se o SQLite não tiver suporte a FTS5
+    """
+    try:
+        cursor.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
+                content,
+                content='chunks',
+                content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+        """)
+    except sqlite3.OperationalError as e:
+        print(f"FTS5 indisponível, busca BM25 desativada: {str(e)}")
+        return False
+    
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS chunks_fts_insert AFTER INSERT ON chunks BEGIN
+            INSERT INTO chunks_fts(rowid, content) VALUES (new.id, new.content);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS chunks_fts_delete AFTER DELETE ON chunks BEGIN
+            INSERT INTO chunks_fts(chunks_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS chunks_fts_update AFTER UPDATE OF content ON chunks BEGIN
+            INSERT INTO chunks_fts(chunks_fts, rowid, content) VALUES ('delete', old.id, old.content);
+            INSERT INTO chunks_fts(rowid, content) VALUES (new.id, new.content);
+        END
+    """)
+    return True
+
+def initialize_jobs(cursor):
+    """
+    Cria a tabela de jobs de ingestão em segundo plano.
+    
+    Cada job guarda os parâmetros necessários para ser executado de novo
+    (payload) e o processo dono (owner), que renova updated_at enquanto o
+    job está na fila ou em execução; jobs sem renovação são retomados por
+    outro processo.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT,          -- 'file', 'url' ou 'text'
+            status TEXT,        -- 'queued', 'running', 'done' ou 'failed'
+            stage TEXT,
+            progress REAL DEFAULT 0,
+            payload TEXT,       -- parâmetros do job (JSON)
+            result TEXT,        -- resultado (JSON)
+            error TEXT,
+            timings TEXT,       -- ms por etapa (JSON)
+            owner TEXT,
+            attempts INTEGER DEFAULT 0,
+            document_id INTEGER,  -- documento gravado pelo job (evita gravá-lo de novo ao retomar)
+            created_at REAL,
+            updated_at REAL
+        )
+    """)
+    cursor.execute("PRAGMA table_info(jobs)")
+    if 'document_id' not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute("ALTER TABLE jobs ADD COLUMN document_id INTEGER")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, updated_at)")
+
+def initialize_meta(cursor):
+    """Cria a tabela de metadados do corpus (geração compartilhada entre processos)."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS corpus_meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER
+        )
+    """)
+    cursor.execute("INSERT OR IGNORE INTO corpus_meta (key, value) VALUES ('generation', 0)")
 
 def initialize_database():
     """Initialize the database with the correct schema."""
-    conn = create_connection('data.db')
+    conn = create_connection(DATABASE_FILE)
     with conn:
         cursor = conn.cursor()
         initialize_tables(cursor)
     conn.close()
+    _fts_available.pop(DATABASE_FILE, None)
     print("Banco de dados inicializado com sucesso!")
 
 def process_content(content, url_processor):
     """
     Processa o conteúdo usando o URLProcessor para garantir consistência.
+    
+    No modo hashing cada vetor é uma linha CSR (1, dim), gravada no banco e
+    nos índices sem ser densificada.
     """
     chunks = url_processor.create_chunks(content)
     vectors, scores = url_processor.vectorize_chunks(chunks)
@@ -114,7 +409,7 @@ def process_content(content, url_processor):
     for i, (chunk, vector, score) in enumerate(zip(chunks, vectors, scores)):
         chunks_data.append({
             'content': chunk,
-            'vector': vector.tolist(),
+            'vector': vector,
             'score': score,
             'chunk_size': url_processor.chunk_size,
             'overlap': url_processor.overlap,
@@ -123,9 +418,16 @@ def process_content(content, url_processor):
     
     return chunks_data
 
-def save_to_database(content, model_name='mistral', source_type='text', source_path=None, chunks_data=None, url_processor=None):
+def save_to_database(content, model_name='mistral', source_type='text', source_path=None, chunks_data=None,
+                     url_processor=None, job_id=None):
     """
     Salva o documento e seus chunks no banco de dados.
+    
+    Com job_id, o id do documento é registrado no job na mesma transação, de
+    modo que um job retomado sabe se o documento já foi gravado.
+    
+    Returns:
+        Id do documento
     """
     print("\nIniciando salvamento no banco de dados:")
     print(f"- Model name: {model_name}")
@@ -144,7 +446,7 @@ def save_to_database(content, model_name='mistral', source_type='text', source_p
     
     print(f"- Total de chunks a serem salvos: {len(chunks_data)}")
     
-    conn = create_connection('data.db')
+    conn = create_connection(DATABASE_FILE)
     try:
         with conn:
             cursor = conn.cursor()
@@ -159,33 +461,100 @@ def save_to_database(content, model_name='mistral', source_type='text', source_p
             print(f"- Documento inserido com ID: {document_id}")
             
             # Insere os chunks
+            chunk_ids = []
             for i, chunk_data in enumerate(chunks_data):
                 cursor.execute("""
                     INSERT INTO chunks (
                         document_id, content, chunk_index, relevance_score, 
-                        vector, chunk_size, overlap
+                        vector, vector_format, chunk_size, overlap
                     )
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
                 """, (
                     document_id,
                     chunk_data['content'],
                     chunk_data['index'],
                     chunk_data['score'],
-                    json.dumps(chunk_data['vector']),
+                    *encode_vector(chunk_data['vector'], chunk_data.get('vector_format')),
                     chunk_data['chunk_size'],
                     chunk_data['overlap']
                 ))
+                chunk_ids.append(cursor.lastrowid)
                 if (i + 1) % 10 == 0:
                     print(f"- {i + 1} chunks salvos...")
             
             print(f"- Todos os {len(chunks_data)} chunks foram salvos com sucesso")
+            if job_id is not None:
+                cursor.execute("UPDATE jobs SET document_id = ? WHERE id = ?", (document_id, job_id))
+            generation = bump_corpus_generation(cursor)
                     
     finally:
         conn.close()
+    
+    vectors = [chunk_data['vector'] for chunk_data in chunks_data]
+    if VECTOR_STORE == 'memmap' and vectors:
+        # O arquivo é compartilhado: grava mesmo que este processo ainda não o tenha aberto
+        get_vector_index(vector_length(vectors[0])).add(chunk_ids, vectors)
+    _sync_corpus_generation(generation, generation - 1,
+                            lambda: _add_to_vector_index(chunk_ids, vectors, (model_name, source_type)))
+    return document_id
+
+def get_document_info(document_id):
+    """
+    Tamanho do documento e número de chunks.
+    
+    Returns:
+        Dicionário com document_id, chunks e characters, ou None se o
+        documento não existir
+    """
+    conn = create_connection(DATABASE_FILE)
+    try:
+        row = conn.execute("""
+            SELECT LENGTH(d.content), (SELECT COUNT(*) FROM chunks c WHERE c.document_id = d.id)
+            FROM documents d WHERE d.id = ?
+        """, (document_id,)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    return {'document_id': document_id, 'chunks': row[1], 'characters': row[0]}
+
+def delete_document(document_id):
+    """
+    Remove um documento e seus chunks.
+    
+    O índice full-text é atualizado pelos triggers. Os chunks são marcados
+    como removidos nos stores memory-mapped, e os índices vetoriais em
+    memória são descartados e recarregados sob demanda (o índice IVF remove
+    os chunks apagados ao ser recarregado).
+    
+    Returns:
+        True se o documento existia
+    """
+    conn = create_connection(DATABASE_FILE)
+    try:
+        with conn:
+            cursor = conn.cursor()
+            _remove_from_memmap_stores(cursor, document_id)
+            cursor.execute("DELETE FROM chunks WHERE document_id = ?", (document_id,))
+            cursor.execute("DELETE FROM documents WHERE id = ?", (document_id,))
+            deleted = cursor.rowcount > 0
+            if deleted:
+                generation = bump_corpus_generation(cursor)
+    finally:
+        conn.close()
+    
+    if deleted:
+        def drop_indexes():
+            global _vector_index, _ann_index
+            if VECTOR_STORE != 'memmap':
+                _vector_index = None
+            _ann_index = None
+        _sync_corpus_generation(generation, generation - 1, drop_indexes)
+    return deleted
 
 def get_saved_data():
     """Retrieve all saved data from the database."""
-    conn = create_connection('data.db')
+    conn = create_connection(DATABASE_FILE)
     try:
         with conn:
             cursor = conn.cursor()
@@ -200,7 +569,7 @@ def get_saved_data():
                 SELECT 
                     d.id, d.content, d.model_name, d.source_type, d.source_path,
                     c.content as chunk_content, c.relevance_score, c.vector,
-                    c.chunk_size, c.overlap
+                    c.chunk_size, c.overlap, c.vector_format
                 FROM documents d
                 LEFT JOIN chunks c ON d.id = c.document_id
                 ORDER BY d.id, c.chunk_index
@@ -232,7 +601,7 @@ def get_saved_data():
                     documents[doc_id]["chunks"].append({
                         "content": row[5],
                         "score": row[6],
-                        "vector": json.loads(row[7]),
+                        "vector": decode_vector(row[7], row[10]),
                         "chunk_size": row[8],
                         "overlap": row[9]
                     })
@@ -246,20 +615,712 @@ def get_saved_data():
     finally:
         conn.close()
 
-def get_relevant_chunks(query, top_k=3):
-    """Recupera os chunks mais relevantes para uma query."""
-    conn = create_connection('data.db')
+JOB_JSON_FIELDS = ('payload', 'result', 'timings')
+
+def _job_from_row(cursor, row):
+    job = dict(zip([column[0] for column in cursor.description], row))
+    for field in JOB_JSON_FIELDS:
+        job[field] = json.loads(job[field]) if job[field] else None
+    return job
+
+def create_job(job_id, kind, payload, owner):
+    """Registra um job de ingestão na fila."""
+    now = time.time()
+    conn = create_connection(DATABASE_FILE)
+    try:
+        with conn:
+            conn.execute("""
+                INSERT INTO jobs (id, kind, status, stage, progress, payload, owner, created_at, updated_at)
+                VALUES (?, ?, 'queued', 'queued', 0, ?, ?, ?, ?)
+            """, (job_id, kind, json.dumps(payload, ensure_ascii=False), owner, now, now))
+    finally:
+        conn.close()
+
+def update_job(job_id, owner=None, **fields):
+    """
+    Atualiza campos do job (payload, result e timings são serializados em JSON).
+    
+    Com owner, só atualiza se o job ainda pertencer a esse processo.
+    
+    Returns:
+        True se o job foi atualizado
+    """
+    fields['updated_at'] = time.time()
+    values = [json.dumps(value, ensure_ascii=False) if field in JOB_JSON_FIELDS and value is not None else value
+              for field, value in fields.items()]
+    sql = f"UPDATE jobs SET {', '.join(f'{field} = ?' for field in fields)} WHERE id = ?"
+    params = values + [job_id]
+    if owner is not None:
+        sql += " AND owner = ?"
+        params.append(owner)
+    conn = create_connection(DATABASE_FILE)
+    try:
+        with conn:
+            return conn.execute(sql, params).rowcount > 0
+    finally:
+        conn.close()
+
+def get_job(job_id):
+    """Retorna o job como dicionário, ou None se não existir."""
+    conn = create_connection(DATABASE_FILE)
+    try:
+        cursor = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        row = cursor.fetchone()
+        return _job_from_row(cursor, row) if row else None
+    finally:
+        conn.close()
+
+def touch_jobs(job_ids, owner):
+    """Renova updated_at dos jobs ainda pertencentes ao processo (lease)."""
+    if not job_ids:
+        return
+    conn = create_connection(DATABASE_FILE)
+    try:
+        with conn:
+            placeholders = ",".join("?" for _ in job_ids)
+            conn.execute(
+                f"UPDATE jobs SET updated_at = ? WHERE owner = ? AND id IN ({placeholders})",
+                [time.time(), owner, *job_ids]
+            )
+    finally:
+        conn.close()
+
+def claim_stale_jobs(owner, stale_before):
+    """
+    Assume os jobs pendentes ('queued' ou 'running') sem renovação desde
+    stale_before, de processos que pararam. A troca de dono é atômica: se
+    dois processos tentarem assumir o mesmo job, só um consegue.
+    
+    Returns:
+        Lista dos jobs assumidos
+    """
+    conn = create_connection(DATABASE_FILE)
+    claimed = []
+    try:
+        with conn:
+            cursor = conn.execute("""
+                SELECT * FROM jobs
+                WHERE status IN ('queued', 'running') AND updated_at < ? AND (owner IS NULL OR owner != ?)
+                ORDER BY created_at
+            """, (stale_before, owner))
+            for row in cursor.fetchall():
+                job = _job_from_row(cursor, row)
+                taken = conn.execute("""
+                    UPDATE jobs SET owner = ?, status = 'queued', attempts = attempts + 1, updated_at = ?
+                    WHERE id = ? AND owner IS ? AND updated_at = ?
+                """, (owner, time.time(), job['id'], job['owner'], job['updated_at'])).rowcount
+                if taken:
+                    claimed.append(job)
+    finally:
+        conn.close()
+    return claimed
+
+def _load_vector_rows(dim, sparse=False, ids=None):
+    """
+    Lê da tabela chunks os vetores da dimensão dada (só dos ids dados, se informados).
+    
+    Com sparse, vetores 'csr-f32' são devolvidos como linhas CSR em vez de
+    densificados (para os índices em memória, que os guardam em CSR).
+    
+    Returns:
+        Lista de triplas (id, vetor, (model_name, source_type))
+    """
+    decode = decode_sparse_vector if sparse else decode_vector
+    query = """
+        SELECT c.id, c.vector, c.vector_format, d.model_name, d.source_type
+        FROM chunks c
+        JOIN documents d ON c.document_id = d.id
+        WHERE c.vector IS NOT NULL{}
+        ORDER BY c.id
+    """
+    conn = create_connection(DATABASE_FILE)
+    try:
+        cursor = conn.cursor()
+        if ids is None:
+            fetched = cursor.execute(query.format('')).fetchall()
+        else:
+            ids = [int(chunk_id) for chunk_id in ids]
+            fetched = []
+            for start in range(0, len(ids), 500):
+                batch = ids[start:start + 500]
+                placeholders = ",".join("?" for _ in batch)
+                fetched.extend(cursor.execute(query.format(f" AND c.id IN ({placeholders})"), batch).fetchall())
+        rows = []
+        skipped = 0
+        for chunk_id, blob, vector_format, model_name, source_type in fetched:
+            # Vetores de outro espaço são descartados sem decodificação completa
+            if vector_dimension(blob, vector_format) != dim:
+                skipped += 1
+                continue
+            rows.append((chunk_id, decode(blob, vector_format), (model_name, source_type)))
+        if skipped:
+            print(f"Aviso: {skipped} chunks têm vetores de outro espaço vetorial (dimensão diferente de {dim}) "
+                  f"e não aparecem na busca vetorial; reenvie os documentos para revetorizá-los")
+        return rows
+    finally:
+        conn.close()
+
+def _load_vector_index(dim):
+    """Carrega os vetores da tabela chunks em um índice particionado por (model_name, source_type)."""
+    index = build_vector_index(_load_vector_rows(dim, sparse=True), dim)
+    print(f"Índice vetorial carregado: {len(index)} chunks (dimensão {dim})")
+    return index
+
+def vector_store_path():
+    """Prefixo dos arquivos do store memory-mapped, ao lado do banco de dados."""
+    return os.getenv('VECTOR_STORE_FILE') or f"{os.path.splitext(DATABASE_FILE)[0]}.vectors"
+
+def _chunk_ids():
+    """Ids de todos os chunks com vetor."""
+    conn = create_connection(DATABASE_FILE)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id FROM chunks WHERE vector IS NOT NULL")
+        return np.fromiter((row[0] for row in cursor), dtype=np.int64)
+    finally:
+        conn.close()
+
+def _reconcile_ids(indexed_ids):
+    """
+    Compara os ids de um índice persistido com os chunks do banco.
+    
+    Os ids do índice devem ser lidos antes desta chamada: um chunk só é
+    gravado nos índices depois de confirmado no banco, então nenhum id
+    recém-gravado é tomado por removido.
+    
+    Returns:
+        (ids do banco ausentes do índice, ids do índice que não estão mais no banco)
+    """
+    chunk_ids = _chunk_ids()
+    return np.setdiff1d(chunk_ids, indexed_ids), np.setdiff1d(indexed_ids, chunk_ids)
+
+def _open_memmap_store(dim):
+    """
+    Abre o store memory-mapped e o alinha com o banco: acrescenta os chunks
+    que não estão nele (em qualquer ordem de id, ex.: gravados por outro
+    processo que parou antes de atualizar o store) e remove os apagados.
+    """
+    store = MemmapVectorStore(vector_store_path(), dim)
+    missing, stale = _reconcile_ids(store.stored_ids())
+    if stale.size:
+        store.remove(stale)
+    rows = _load_vector_rows(dim, ids=missing) if missing.size else []
+    if rows:
+        store.add([row[0] for row in rows], [row[1] for row in rows])
+    print(f"Store vetorial memory-mapped aberto: {len(store)} chunks (dimensão {dim})")
+    return store
+
+def _remove_from_memmap_stores(cursor, document_id):
+    """
+    Marca como removidos, nos stores memory-mapped existentes, os chunks do
+    documento. Chamada na transação que os apaga, antes do commit: até lá
+    nenhum chunk novo pode reutilizar os ids.
+    """
+    cursor.execute("SELECT id, vector, vector_format FROM chunks WHERE document_id = ? AND vector IS NOT NULL",
+                   (document_id,))
+    ids_by_dim = {}
+    for chunk_id, blob, vector_format in cursor.fetchall():
+        ids_by_dim.setdefault(vector_dimension(blob, vector_format), []).append(chunk_id)
+    for dim, chunk_ids in ids_by_dim.items():
+        with _vector_index_lock:
+            store = _vector_index if isinstance(_vector_index, MemmapVectorStore) and _vector_index.dim == dim else None
+        if store is None:
+            if not os.path.exists(f"{vector_store_path()}.{dim}.ids"):
+                continue
+            store = MemmapVectorStore(vector_store_path(), dim)
+        store.remove(chunk_ids)
+
+def get_vector_index(dim):
+    """
+    Retorna o índice vetorial da busca exata, carregando-o na primeira chamada.
+    
+    Se a dimensão pedida mudar (vetorizador reajustado), o índice é recarregado.
+    """
+    global _vector_index
+    with _vector_index_lock:
+        if _vector_index is None or _vector_index.dim != dim:
+            if VECTOR_STORE == 'memmap':
+                _vector_index = _open_memmap_store(dim)
+            else:
+                _vector_index = _load_vector_index(dim)
+        return _vector_index
+
+def ann_index_path():
+    """Caminho do índice IVF salvo, ao lado do banco de dados."""
+    return os.getenv('ANN_INDEX_FILE') or f"{os.path.splitext(DATABASE_FILE)[0]}.ivf.npz"
+
+def build_ann_index(dim, n_lists=None, nprobe=None):
+    """
+    Treina um índice IVF com os vetores da tabela chunks e salva em disco.
+    
+    Returns:
+        O IVFIndex construído, ou None se não houver vetores da dimensão dada
+    """
+    global _ann_index
+    rows = _load_vector_rows(dim, sparse=True)
+    if not rows:
+        return None
+    
+    ids, vectors = vector_block([row[0] for row in rows], [row[1] for row in rows], dim)
+    index = IVFIndex.train(vectors, n_lists=n_lists, nprobe=nprobe or ANN_NPROBE)
+    index.add(ids, vectors)
+    index.save(ann_index_path())
+    print(f"Índice IVF construído: {len(index)} chunks em {index.n_lists} partições")
+    
+    with _vector_index_lock:
+        _ann_index = index
+    return index
+
+def get_ann_index(dim):
+    """
+    Retorna o índice IVF, carregando-o do disco ou construindo-o se necessário.
+    
+    Ao carregar, o índice é alinhado com o banco sem retreinar os
+    centróides: chunks que não estão nele (salvos depois da última gravação,
+    em qualquer ordem de id) são adicionados e chunks apagados são removidos.
+    Consultas simultâneas sem índice carregado fazem isso uma única vez.
+    """
+    global _ann_index
+    with _vector_index_lock:
+        if _ann_index is not None and _ann_index.dim == dim:
+            return _ann_index
+    
+    with _ann_build_lock:
+        with _vector_index_lock:
+            # Outra thread pode ter carregado ou construído o índice enquanto esta aguardava
+            if _ann_index is not None and _ann_index.dim == dim:
+                return _ann_index
+            
+            path = ann_index_path()
+            if os.path.exists(path):
+                index = IVFIndex.load(path)
+                if index.dim == dim:
+                    missing, stale = _reconcile_ids(index.ids())
+                    removed = index.remove(stale) if stale.size else 0
+                    rows = _load_vector_rows(dim, sparse=True, ids=missing) if missing.size else []
+                    if rows:
+                        index.add([row[0] for row in rows], [row[1] for row in rows])
+                    if rows or removed:
+                        index.save(path)
+                    _ann_index = index
+                    return index
+        
+        # O treino roda fora de _vector_index_lock para não bloquear as demais consultas e gravações
+        return build_ann_index(dim)
+
+def _add_to_vector_index(chunk_ids, vectors, partition=None):
+    """Mantém os índices carregados sincronizados com os chunks recém-salvos."""
+    with _vector_index_lock:
+        if isinstance(_vector_index, PartitionedVectorIndex):
+            _vector_index.add(chunk_ids, vectors, partition)
+        elif _vector_index is not None:
+            _vector_index.add(chunk_ids, vectors)
+        if _ann_index is not None:
+            _ann_index.add(chunk_ids, vectors)
+
+def _fetch_chunks_by_id(cursor, ranked):
+    """Busca os chunks pelos ids preservando a ordem do ranking."""
+    ids = [chunk_id for chunk_id, _ in ranked]
+    placeholders = ",".join("?" for _ in ids)
+    cursor.execute(f"""
+        SELECT c.id, c.content, d.source_path, c.chunk_size, c.overlap,
+               c.document_id, c.chunk_index
+        FROM chunks c
+        JOIN documents d ON c.document_id = d.id
+        WHERE c.id IN ({placeholders})
+    """, ids)
+    rows = {row[0]: row[1:] for row in cursor.fetchall()}
+    
+    results = []
+    for chunk_id, score in ranked:
+        if chunk_id in rows:
+            content, source_path, chunk_size, overlap, document_id, chunk_index = rows[chunk_id]
+            results.append((content, score, source_path, chunk_size, overlap, document_id, chunk_index))
+    return results
+
+def normalize_filters(filters):
+    """
+    Valida e normaliza os filtros de metadados.
+    
+    Aceita model_name e source_type (valor ou lista de valores),
+    source_path_prefix, created_after (inclusivo) e created_before (exclusivo),
+    com datas no formato do SQLite ('AAAA-MM-DD' ou 'AAAA-MM-DD HH:MM:SS').
+    
+    Returns:
+        Dicionário normalizado, ou None se não houver filtros
+    
+    Raises:
+        ValueError: se filters não for um objeto ou tiver filtros ou valores inválidos
+    """
+    if not filters:
+        return None
+    if not isinstance(filters, dict):
+        raise ValueError("filters deve ser um objeto com os filtros de metadados")
+    unknown = set(filters) - set(FILTER_KEYS)
+    if unknown:
+        raise ValueError(f"Filtros desconhecidos: {', '.join(sorted(unknown))}")
+    
+    normalized = {}
+    for key in ('model_name', 'source_type'):
+        value = filters.get(key)
+        if value:
+            values = [value] if isinstance(value, str) else value
+            if not isinstance(values, (list, tuple)) or not all(isinstance(item, str) for item in values):
+                raise ValueError(f"O filtro {key} deve ser um texto ou uma lista de textos")
+            normalized[key] = tuple(sorted(set(values)))
+    for key in ('source_path_prefix', 'created_after', 'created_before'):
+        if filters.get(key):
+            if not isinstance(filters[key], str):
+                raise ValueError(f"O filtro {key} deve ser um texto")
+            normalized[key] = filters[key]
+    return normalized or None
+
+def _filter_conditions(filters, include_partition=True):
+    """Cláusulas SQL (sobre o alias d de documents) e parâmetros dos filtros."""
+    conditions = []
+    params = []
+    if include_partition:
+        for key in ('model_name', 'source_type'):
+            if key in filters:
+                conditions.append(f"d.{key} IN ({','.join('?' for _ in filters[key])})")
+                params.extend(filters[key])
+    if 'source_path_prefix' in filters:
+        prefix = re.sub(r'([\\%_])', r'\\\1', filters['source_path_prefix'])
+        conditions.append("d.source_path LIKE ? ESCAPE '\\'")
+        params.append(prefix + '%')
+    if 'created_after' in filters:
+        conditions.append("d.created_at >= ?")
+        params.append(filters['created_after'])
+    if 'created_before' in filters:
+        conditions.append("d.created_at < ?")
+        params.append(filters['created_before'])
+    return conditions, params
+
+def _partition_filter(filters):
+    """Predicado sobre as chaves (model_name, source_type) das partições do índice."""
+    if not filters or not ({'model_name', 'source_type'} & set(filters)):
+        return None
+    
+    def accepts(partition):
+        model_name, source_type = partition
+        return (
+            ('model_name' not in filters or model_name in filters['model_name'])
+            and ('source_type' not in filters or source_type in filters['source_type'])
+        )
+    return accepts
+
+def _allowed_chunk_ids(filters, include_partition=True):
+    """
+    Ids dos chunks que satisfazem os filtros, usados como pré-filtro na busca vetorial.
+    
+    Returns:
+        Array de ids, ou None se não houver condições a aplicar
+    """
+    if not filters:
+        return None
+    conditions, params = _filter_conditions(filters, include_partition)
+    if not conditions:
+        return None
+    
+    conn = create_connection(DATABASE_FILE)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT c.id FROM chunks c
+            JOIN documents d ON c.document_id = d.id
+            WHERE {' AND '.join(conditions)}
+        """, params)
+        return np.fromiter((row[0] for row in cursor.fetchall()), dtype=np.int64)
+    finally:
+        conn.close()
+
+def _filtered_fts_clause(filters):
+    """Restrição do FTS aos chunks dos documentos que satisfazem os filtros."""
+    if not filters:
+        return "", []
+    conditions, params = _filter_conditions(filters)
+    return f"""
+            AND rowid IN (
+                SELECT c.id FROM chunks c
+                JOIN documents d ON c.document_id = d.id
+                WHERE {' AND '.join(conditions)}
+            )""", params
+
+def fts_available():
+    """
+    Indica se o índice full-text (chunks_fts) existe e pode ser consultado.
+    
+    O resultado é guardado por arquivo de banco: sem FTS5 no SQLite,
+    initialize_fts não cria a tabela e os modos 'bm25' e 'hybrid' não podem
+    ser usados.
+    """
+    if DATABASE_FILE not in _fts_available:
+        conn = create_connection(DATABASE_FILE)
+        try:
+            conn.execute("SELECT rowid FROM chunks_fts LIMIT 0")
+            _fts_available[DATABASE_FILE] = True
+        except sqlite3.OperationalError as e:
+            print(f"Aviso: índice full-text indisponível ({str(e)}); modos 'bm25' e 'hybrid' usarão 'vector'")
+            _fts_available[DATABASE_FILE] = False
+        finally:
+            conn.close()
+    return _fts_available[DATABASE_FILE]
+
+def _resolve_mode(mode):
+    """Valida o modo de recuperação, trocando os modos lexicais por 'vector' se não houver FTS5."""
+    mode = mode or RETRIEVAL_MODE
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Modo de recuperação inválido: {mode}")
+    if mode in ('bm25', 'hybrid') and not fts_available():
+        return 'vector'
+    return mode
+
+def _fts_query(query):
+    """Converte a pergunta em uma expressão FTS5 (termos entre aspas unidos por OR)."""
+    terms = re.findall(r'\w+', query.lower())
+    return " OR ".join(f'"{term}"' for term in dict.fromkeys(terms))
+
+def _search_bm25(cursor, query, top_k, filters=None):
+    """
+    Busca lexical ranqueada por BM25, executada inteiramente no SQLite.
+    
+    O LIMIT é aplicado dentro da consulta FTS5, então só top_k linhas de
+    chunks são lidas independentemente do tamanho do corpus.
+    """
+    match = _fts_query(query)
+    if not match:
+        return []
+    
+    filter_clause, filter_params = _filtered_fts_clause(filters)
+    cursor.execute(f"""
+        SELECT c.content, -fts.rank AS score, d.source_path,
+               c.chunk_size, c.overlap, c.document_id, c.chunk_index
+        FROM (
+            SELECT rowid, rank FROM chunks_fts
+            WHERE chunks_fts MATCH ?{filter_clause}
+            ORDER BY rank
+            LIMIT ?
+        ) fts
+        JOIN chunks c ON c.id = fts.rowid
+        JOIN documents d ON c.document_id = d.id
+        ORDER BY fts.rank
+    """, (match, *filter_params, top_k))
+    return cursor.fetchall()
+
+def _rank_bm25(query, top_k, filters=None):
+    """Ranking BM25 como lista de (chunk_id, score), em conexão própria (uso em threads)."""
+    match = _fts_query(query)
+    if not match:
+        return []
+    
+    filter_clause, filter_params = _filtered_fts_clause(filters)
+    conn = create_connection(DATABASE_FILE)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT rowid, -rank FROM chunks_fts
+            WHERE chunks_fts MATCH ?{filter_clause}
+            ORDER BY rank
+            LIMIT ?
+        """, (match, *filter_params, top_k))
+        return cursor.fetchall()
+    finally:
+        conn.close()
+
+def _rank_vector(query, top_k, url_processor, mode='vector', filters=None):
+    """
+    Ranking por similaridade de cosseno como lista de (chunk_id, score).
+    
+    Com filtros, a busca é exata e restrita à fatia filtrada: no índice em
+    memória, apenas as partições (model_name, source_type) aceitas são
+    varridas; prefixo de caminho e intervalo de datas viram um pré-filtro por
+    id. O índice IVF não é particionado, então consultas filtradas usam a
+    busca exata.
+    
+    Returns:
+        None se a query não puder ser vetorizada
+    """
+    query_vector = url_processor.vectorize_query(query) if url_processor else None
+    if query_vector is None:
+        return None
+    
+    dim = len(query_vector)
+    if filters:
+        index = get_vector_index(dim)
+        return index.search(query_vector, top_k, **_vector_filter_args(index, filters))
+    
+    index = get_ann_index(dim) if mode == 'ann' else None
+    if index is None:
+        index = get_vector_index(dim)
+    return index.search(query_vector, top_k)
+
+def _vector_filter_args(index, filters):
+    """Argumentos de filtro para search/search_many conforme o tipo de índice."""
+    if not filters:
+        return {}
+    if isinstance(index, PartitionedVectorIndex):
+        return {
+            'partition_filter': _partition_filter(filters),
+            'allowed_ids': _allowed_chunk_ids(filters, include_partition=False)
+        }
+    return {'allowed_ids': _allowed_chunk_ids(filters)}
+
+def _timed(timings, stage, function, *args):
+    """Executa function(*args) registrando a duração em timings[stage] (ms)."""
+    start_time = time.perf_counter()
+    try:
+        return function(*args)
+    finally:
+        timings[stage] = (time.perf_counter() - start_time) * 1000
+
+def _rank_hybrid(query, top_k, url_processor, timings, filters=None):
+    """
+    Executa os rankings lexical (BM25) e vetorial em paralelo e os combina
+    por reciprocal rank fusion.
+    """
+    candidates = max(top_k * HYBRID_CANDIDATE_FACTOR, 20)
+    lexical = _retrieval_executor.submit(_timed, timings, 'lexical_ms', _rank_bm25, query, candidates, filters)
+    vector = _retrieval_executor.submit(_timed, timings, 'vector_ms', _rank_vector,
+                                        query, candidates, url_processor, 'vector', filters)
+    
+    rankings = [[chunk_id for chunk_id, _ in lexical.result()]]
+    vector_ranked = vector.result()
+    if vector_ranked is not None:
+        rankings.append([chunk_id for chunk_id, _ in vector_ranked])
+    
+    return _timed(timings, 'fusion_ms', reciprocal_rank_fusion, rankings, top_k)
+
+def get_relevant_chunks(query, top_k=3, url_processor=None, mode=None, timings=None, filters=None):
+    """
+    Recupera os chunks mais relevantes para uma query.
+    
+    Modos:
+    - 'vector': com um url_processor capaz de vetorizar a query, ranqueia por
+      similaridade de cosseno no índice vetorial em memória
+    - 'bm25': busca full-text (FTS5) ranqueada por BM25 dentro do SQLite
+    - 'ann': como 'vector', mas no índice aproximado IVF (corpora grandes)
+    - 'hybrid': BM25 e vetorial em paralelo, combinados por reciprocal rank
+      fusion (o score é o score RRF)
+    
+    Sem FTS5 no SQLite, 'bm25' e 'hybrid' usam 'vector'. Sem modo aplicável,
+    usa o relevance_score armazenado. Resultados ficam em um cache LRU
+    (pergunta normalizada, top_k, modo, espaço vetorial, filtros) válido até
+    a próxima alteração do corpus.
+    
+    Args:
+        timings: Dicionário opcional preenchido com o tempo (ms) de cada etapa
+        filters: Filtros de metadados aplicados antes do ranking (ver
+            normalize_filters)
+    
+    Returns:
+        Lista de tuplas (content, score, source_path, chunk_size, overlap,
+        document_id, chunk_index)
+    """
+    mode = _resolve_mode(mode)
+    timings = {} if timings is None else timings
+    filters = normalize_filters(filters)
+    
+    start_time = time.perf_counter()
+    generation = get_corpus_generation()
+    cache_key = (
+        " ".join(query.lower().split()),
+        top_k,
+        mode,
+        url_processor.vector_space if url_processor else None,
+        tuple(sorted(filters.items())) if filters else None
+    )
+    cached = _retrieval_cache.get(cache_key, generation)
+    if cached is not None:
+        timings['cache_ms'] = (time.perf_counter() - start_time) * 1000
+        print(f"Recuperação ({mode}): resultado em cache")
+        return list(cached)
+    
+    results = _get_relevant_chunks_uncached(query, top_k, url_processor, mode, timings, filters)
+    _retrieval_cache.put(cache_key, generation, tuple(results))
+    timings['total_ms'] = (time.perf_counter() - start_time) * 1000
+    print(f"Recuperação ({mode}): " + ", ".join(f"{stage}={ms:.1f}" for stage, ms in timings.items()))
+    return results
+
+def get_relevant_chunks_batch(queries, top_k=3, url_processor=None, mode=None, filters=None):
+    """
+    Recupera os chunks relevantes de várias perguntas de uma vez.
+    
+    Nos modos 'vector' e 'ann', as perguntas fora do cache são vetorizadas em
+    uma única chamada ao vetorizador e pontuadas contra a matriz de chunks com
+    um produto matriz-matriz (busca exata, também no modo 'ann'), em blocos de
+    BATCH_QUERY_BLOCK perguntas para limitar a memória. Os demais modos
+    recuperam pergunta a pergunta.
+    
+    Returns:
+        Lista com os chunks de cada pergunta, na ordem de queries
+    """
+    mode = _resolve_mode(mode)
+    if mode not in ('vector', 'ann') or url_processor is None:
+        return [get_relevant_chunks(query, top_k, url_processor, mode, filters=filters) for query in queries]
+    
+    filters = normalize_filters(filters)
+    start_time = time.perf_counter()
+    generation = get_corpus_generation()
+    keys = [
+        (" ".join(query.lower().split()), top_k, mode, url_processor.vector_space,
+         tuple(sorted(filters.items())) if filters else None)
+        for query in queries
+    ]
+    results = [_retrieval_cache.get(key, generation) for key in keys]
+    missing = [i for i, cached in enumerate(results) if cached is None]
+    
+    conn = create_connection(DATABASE_FILE)
+    try:
+        cursor = conn.cursor()
+        for block_start in range(0, len(missing), BATCH_QUERY_BLOCK):
+            block = missing[block_start:block_start + BATCH_QUERY_BLOCK]
+            query_matrix = url_processor.vectorize_queries([queries[i] for i in block])
+            if query_matrix is None:
+                for i in block:
+                    results[i] = _get_relevant_chunks_uncached(queries[i], top_k, url_processor, mode, {}, filters)
+                continue
+            
+            index = get_vector_index(query_matrix.shape[1])
+            rankings = index.search_many(query_matrix, top_k, **_vector_filter_args(index, filters))
+            for i, ranked in zip(block, rankings):
+                results[i] = _fetch_chunks_by_id(cursor, ranked) if ranked else []
+    finally:
+        conn.close()
+    
+    for i in missing:
+        _retrieval_cache.put(keys[i], generation, tuple(results[i]))
+    print(f"Recuperação em lote ({mode}): {len(queries)} perguntas, {len(queries) - len(missing)} do cache, "
+          f"{(time.perf_counter() - start_time) * 1000:.1f} ms")
+    return [list(chunks) for chunks in results]
+
+def _get_relevant_chunks_uncached(query, top_k, url_processor, mode, timings, filters=None):
+    """Executa a recuperação no modo pedido, sem consultar o cache."""
+    conn = create_connection(DATABASE_FILE)
     try:
         with conn:
             cursor = conn.cursor()
-            cursor.execute("""
+            if mode == 'bm25':
+                return _timed(timings, 'lexical_ms', _search_bm25, cursor, query, top_k, filters)
+            
+            if mode == 'hybrid':
+                ranked = _rank_hybrid(query, top_k, url_processor, timings, filters)
+            else:
+                ranked = _timed(timings, 'vector_ms', _rank_vector, query, top_k, url_processor, mode, filters)
+            
+            if ranked is not None:
+                return _timed(timings, 'fetch_ms', _fetch_chunks_by_id, cursor, ranked) if ranked else []
+            
+            conditions, params = _filter_conditions(filters) if filters else ([], [])
+            where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+            cursor.execute(f"""
                 SELECT c.content, c.relevance_score, d.source_path,
-                       c.chunk_size, c.overlap
+                       c.chunk_size, c.overlap, c.document_id, c.chunk_index
                 FROM chunks c
                 JOIN documents d ON c.document_id = d.id
+                {where}
                 ORDER BY c.relevance_score DESC
                 LIMIT ?
-            """, (top_k,))
+            """, (*params, top_k))
             
             return cursor.fetchall()
     finally:
@@ -0,0 +1,193 @@
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Métodos que podem ser repetidos sem efeitos colaterais
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS'})
+
+# Respostas transitórias que justificam uma nova tentativa
+RETRY_STATUSES = frozenset({502, 503, 504})
+
+Timeout = Union[float, Tuple[float, float]]
+
+
+class HTTPClient:
+    """
+    Sessão HTTP compartilhada com pool de conexões keep-alive.
+
+    Todas as chamadas têm timeout de conexão e de leitura (configuráveis por
+    chamada). Requisições idempotentes que falham por erro de conexão,
+    timeout ou status 502/503/504 são repetidas até max_retries vezes com
+    backoff exponencial; um timeout de conexão é repetido para qualquer
+    método, pois a requisição não chegou a ser enviada.
+
+    Respostas com stream=True contam como em andamento até serem fechadas.
+    """
+
+    def __init__(self, pool_maxsize: Optional[int] = None, connect_timeout: Optional[float] = None,
+                 read_timeout: Optional[float] = None, max_retries: Optional[int] = None,
+                 backoff: Optional[float] = None, pool_connections: Optional[int] = None):
+        self.pool_maxsize = pool_maxsize or int(os.getenv('MAX_WORKERS', 4))
+        # Número de hosts com pool próprio (ex.: Ollama e sites de ingestão por URL)
+        self.pool_connections = pool_connections or int(os.getenv('HTTP_POOL_CONNECTIONS', 4))
+        self.connect_timeout = connect_timeout or float(os.getenv('CONNECT_TIMEOUT', 5))
+        self.read_timeout = read_timeout or float(os.getenv('TIMEOUT', 30))
+        self.max_retries = int(os.getenv('HTTP_RETRIES', 2)) if max_retries is None else max_retries
+        self.backoff = float(os.getenv('HTTP_BACKOFF', 0.5)) if backoff is None else backoff
+
+        self.session = requests.Session()
+        # Conexões além de pool_maxsize são abertas sob demanda e descartadas após o uso
+        self.adapter = HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize)
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+
+        self._lock = threading.Lock()
+        self._stats = {'requests': 0, 'retries': 0, 'errors': 0, 'in_flight': 0, 'peak_in_flight': 0}
+        logger.info(f"Cliente HTTP inicializado (pool: {self.pool_maxsize} conexões x {self.pool_connections} hosts, "
+                    f"timeouts: {self.connect_timeout}s conexão / {self.read_timeout}s leitura, "
+                    f"tentativas extras: {self.max_retries})")
+
+    def _timeout(self, timeout: Optional[Timeout]) -> Tuple[float, float]:
+        """Normaliza o timeout para (conexão, leitura), usando os padrões configurados."""
+        if timeout is None:
+            return self.connect_timeout, self.read_timeout
+        if isinstance(timeout, tuple):
+            return timeout
+        return self.connect_timeout, timeout
+
+    def _count(self, key: str, delta: int = 1):
+        with self._lock:
+            self._stats[key] += delta
+            if key == 'in_flight':
+                self._stats['peak_in_flight'] = max(self._stats['peak_in_flight'], self._stats['in_flight'])
+
+    def _release_on_close(self, response: requests.Response):
+        """Mantém a resposta em streaming como em andamento até ser fechada (uma única vez)."""
+        close = response.close
+        released = []
+
+        def close_and_release():
+            try:
+                close()
+            finally:
+                with self._lock:
+                    if not released:
+                        released.append(True)
+                        self._stats['in_flight'] -= 1
+
+        response.close = close_and_release
+
+    def request(self, method: str, url: str, timeout: Optional[Timeout] = None,
+                idempotent: Optional[bool] = None, **kwargs: Any) -> requests.Response:
+        """
+        Executa uma requisição pelo pool compartilhado.
+
+        Args:
+            timeout: Segundos de leitura, ou tupla (conexão, leitura)
+            idempotent: Se a requisição pode ser repetida; por padrão, só
+                GET/HEAD/OPTIONS (ex.: /api/embed é POST mas pode ser marcado)
+
+        Raises:
+            requests.RequestException: Após esgotar as tentativas
+        """
+        method = method.upper()
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        timeout = self._timeout(timeout)
+
+        for attempt in range(self.max_retries + 1):
+            can_retry = attempt < self.max_retries
+            streaming = False
+            self._count('requests')
+            self._count('in_flight')
+            try:
+                response = self.session.request(method, url, timeout=timeout, **kwargs)
+            except requests.ConnectTimeout as e:
+                # A requisição não foi enviada: pode ser repetida qualquer que seja o método
+                if not can_retry:
+                    self._count('errors')
+                    raise
+                reason = e
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if not (idempotent and can_retry):
+                    self._count('errors')
+                    raise
+                reason = e
+            else:
+                if not (idempotent and can_retry and response.status_code in RETRY_STATUSES):
+                    if kwargs.get('stream'):
+                        # O corpo ainda vai ser lido: a requisição termina quando a resposta é fechada
+                        self._release_on_close(response)
+                        streaming = True
+                    return response
+                response.close()
+                reason = f"status {response.status_code}"
+            finally:
+                if not streaming:
+                    self._count('in_flight', -1)
+
+            delay = self.backoff * (2 ** attempt)
+            self._count('retries')
+            logger.warning(f"{method} {url} falhou ({reason}); tentativa {attempt + 1}/{self.max_retries} "
+                           f"em {delay:.2f} segundos")
+            time.sleep(delay)
+
+    def get(self, url: str, **kwargs: Any) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs: Any) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Contadores de requisições e uso do pool.
+
+        Por host: conexões abertas (num_connections), requisições enviadas
+        (num_requests) e conexões ociosas no pool; a diferença entre
+        requisições e conexões é o número de reaproveitamentos keep-alive.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        pools = {}
+        for key in list(self.adapter.poolmanager.pools.keys()):
+            pool = self.adapter.poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            pools[f"{pool.scheme}://{pool.host}:{pool.port}"] = {
+                'connections_opened': pool.num_connections,
+                'requests': pool.num_requests,
+                'reused': max(pool.num_requests - pool.num_connections, 0),
+                'idle': sum(conn is not None for conn in list(pool.pool.queue)) if pool.pool is not None else 0,
+                'maxsize': self.pool_maxsize
+            }
+        stats['pools'] = pools
+        return stats
+
+    def close(self):
+        self.session.close()
+
+
+_client: Optional[HTTPClient] = None
+_client_lock = threading.Lock()
+
+
+def get_http_client() -> HTTPClient:
+    """Retorna o cliente HTTP do processo, criado no primeiro uso (após o .env ser carregado)."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HTTPClient()
+        return _client
+
+
+def get_http_stats() -> Dict[str, Any]:
+    """Estatísticas do cliente compartilhado (vazio se ainda não foi usado)."""
+    return _client.stats() if _client is not None else {}
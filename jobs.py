@@ -0,0 +1,261 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from database import claim_stale_jobs, create_job, get_job, touch_jobs, update_job
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Estados finais de um job
+FINISHED_STATUSES = frozenset({'done', 'failed'})
+
+
+class IngestionJob:
+    """
+    Handle entregue à função do job para informar etapa e progresso.
+
+    O progresso total é calculado a partir dos pesos das etapas registradas
+    para o tipo de job: etapas concluídas contam inteiras e a atual conta
+    pela fração informada em progress().
+    """
+
+    def __init__(self, queue: 'IngestionQueue', job_id: str, stages: List[Tuple[str, float]]):
+        self.queue = queue
+        self.id = job_id
+        self.stages = stages
+        self._weights = dict(stages)
+        self._total_weight = sum(self._weights.values()) or 1.0
+        self._done_weight = 0.0
+        self._stage: Optional[str] = None
+        self._stage_started = 0.0
+        self.timings: Dict[str, float] = {}
+
+    def _close_stage(self):
+        if self._stage is not None:
+            self.timings[self._stage] = (time.time() - self._stage_started) * 1000
+            self._done_weight += self._weights.get(self._stage, 0.0)
+
+    def stage(self, name: str):
+        """Inicia uma etapa (a anterior é dada como concluída e cronometrada)."""
+        self._close_stage()
+        self._stage = name
+        self._stage_started = time.time()
+        self.queue._update(self.id, stage=name, progress=self._done_weight / self._total_weight,
+                           timings=dict(self.timings), persist=True)
+
+    def progress(self, fraction: float):
+        """Informa a fração (0 a 1) concluída da etapa atual."""
+        fraction = min(max(fraction, 0.0), 1.0)
+        overall = (self._done_weight + self._weights.get(self._stage, 0.0) * fraction) / self._total_weight
+        self.queue._update(self.id, progress=overall)
+
+    def finish(self) -> Dict[str, float]:
+        """Fecha a última etapa e devolve os tempos por etapa."""
+        self._close_stage()
+        self._stage = None
+        return dict(self.timings)
+
+
+class IngestionQueue:
+    """
+    Fila de jobs de ingestão executados por um pool de workers.
+
+    Os jobs são registrados no banco (tabela jobs) antes de entrar na fila,
+    com os parâmetros necessários para serem executados de novo. Enquanto
+    estão na fila ou em execução, o processo renova o lease (updated_at) a
+    cada lease_seconds / 3; jobs cujo lease venceu (o processo parou) são
+    assumidos e reexecutados desde o início, por este ou outro processo.
+
+    O estado dos jobs deste processo fica também em memória, para que
+    wait_for_change possa notificar quem acompanha o progresso.
+    """
+
+    # Atualizações de progresso gravadas no banco no máximo a cada intervalo (segundos)
+    PERSIST_INTERVAL = 0.5
+
+    def __init__(self, max_workers: Optional[int] = None, lease_seconds: Optional[float] = None):
+        self.max_workers = max_workers or int(os.getenv('INGEST_WORKERS', 2))
+        self.lease_seconds = lease_seconds or float(os.getenv('JOB_LEASE_SECONDS', 60))
+        self.owner = uuid.uuid4().hex
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='ingest')
+        self._handlers: Dict[str, Tuple[Callable[[IngestionJob, Dict[str, Any]], Any], List[Tuple[str, float]]]] = {}
+        self._cond = threading.Condition()
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._persisted_at: Dict[str, float] = {}
+        self._maintenance: Optional[threading.Thread] = None
+        self.stats = {'submitted': 0, 'resumed': 0, 'completed': 0, 'failed': 0}
+
+    def register(self, kind: str, handler: Callable[[IngestionJob, Dict[str, Any]], Any],
+                 stages: List[Tuple[str, float]]):
+        """
+        Registra a função que executa jobs do tipo kind.
+
+        Args:
+            handler: Recebe (job, payload) e devolve o resultado (serializável em JSON)
+            stages: Etapas (nome, peso) na ordem em que handler as inicia
+        """
+        self._handlers[kind] = (handler, stages)
+
+    def start(self):
+        """
+        Retoma jobs interrompidos e inicia a renovação de leases em segundo
+        plano (chamadas seguintes não têm efeito).
+
+        Deve ser chamado apenas no processo que executa os jobs (não, por
+        exemplo, no processo observador do reloader do Flask).
+        """
+        with self._cond:
+            if self._maintenance is not None:
+                return
+            self._maintenance = threading.Thread(target=self._maintain, daemon=True)
+        self._claim_stale()
+        self._maintenance.start()
+
+    def submit(self, kind: str, payload: Dict[str, Any]) -> str:
+        """Registra o job no banco, coloca-o na fila e devolve seu id."""
+        if kind not in self._handlers:
+            raise ValueError(f"Tipo de job desconhecido: {kind}")
+        job_id = uuid.uuid4().hex
+        create_job(job_id, kind, payload, self.owner)
+        self.stats['submitted'] += 1
+        self._enqueue(job_id, kind, payload)
+        logger.info(f"Job {job_id} ({kind}) na fila")
+        return job_id
+
+    def _enqueue(self, job_id: str, kind: str, payload: Dict[str, Any]):
+        now = time.time()
+        with self._cond:
+            self._jobs[job_id] = {
+                'id': job_id, 'kind': kind, 'status': 'queued', 'stage': 'queued', 'progress': 0.0,
+                'result': None, 'error': None, 'timings': {}, 'created_at': now, 'updated_at': now, 'version': 0
+            }
+            self._cond.notify_all()
+        self._executor.submit(self._run, job_id, kind, payload)
+
+    def _update(self, job_id: str, persist: bool = False, **fields):
+        """
+        Grava no banco (com limite de frequência, exceto se persist) e depois
+        atualiza o estado em memória e notifica quem espera: quem vê um
+        estado final em memória o encontra também no banco.
+        """
+        now = time.time()
+        with self._cond:
+            write = persist or now - self._persisted_at.get(job_id, 0.0) >= self.PERSIST_INTERVAL
+            if write:
+                self._persisted_at[job_id] = now
+        if write:
+            update_job(job_id, owner=self.owner, **fields)
+        self._set_state(job_id, **fields)
+
+    def _set_state(self, job_id: str, **fields):
+        """Atualiza o estado em memória do job e notifica quem espera."""
+        with self._cond:
+            state = self._jobs.get(job_id)
+            if state is not None:
+                # O payload fica só no banco
+                state.update({field: value for field, value in fields.items() if field != 'payload'},
+                             updated_at=time.time(), version=state['version'] + 1)
+                self._cond.notify_all()
+
+    def _run(self, job_id: str, kind: str, payload: Dict[str, Any]):
+        handler, stages = self._handlers[kind]
+        # Outro processo pode ter assumido o job enquanto ele aguardava na fila
+        if not update_job(job_id, owner=self.owner, status='running'):
+            logger.info(f"Job {job_id} assumido por outro processo; ignorando")
+            with self._cond:
+                self._jobs.pop(job_id, None)
+            return
+        job = IngestionJob(self, job_id, stages)
+        start_time = time.time()
+        self._set_state(job_id, status='running')
+        try:
+            result = handler(job, payload)
+        except Exception as e:
+            logger.error(f"Job {job_id} ({kind}) falhou: {str(e)}")
+            self.stats['failed'] += 1
+            self._update(job_id, status='failed', stage='failed', error=str(e), timings=job.finish(), persist=True)
+        else:
+            timings = job.finish()
+            timings['total'] = (time.time() - start_time) * 1000
+            logger.info(f"Job {job_id} ({kind}) concluído em {timings['total'] / 1000:.2f} segundos")
+            self.stats['completed'] += 1
+            # O conteúdo já está no banco: o payload não é mais necessário
+            self._update(job_id, status='done', stage='done', progress=1.0, result=result, timings=timings,
+                         payload=None, persist=True)
+        finally:
+            with self._cond:
+                self._persisted_at.pop(job_id, None)
+
+    def _claim_stale(self):
+        """Assume e enfileira jobs pendentes cujo lease venceu."""
+        for job in claim_stale_jobs(self.owner, time.time() - self.lease_seconds):
+            if job['kind'] not in self._handlers:
+                update_job(job['id'], owner=self.owner, status='failed', error=f"Tipo de job desconhecido: {job['kind']}")
+                continue
+            logger.info(f"Retomando job {job['id']} ({job['kind']}), tentativa {job['attempts'] + 2}")
+            self.stats['resumed'] += 1
+            self._enqueue(job['id'], job['kind'], job['payload'] or {})
+
+    def _maintain(self):
+        """
+        Renova os leases dos jobs deste processo, retoma jobs abandonados e
+        descarta da memória os jobs finalizados há mais de lease_seconds
+        (continuam disponíveis no banco).
+        """
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            try:
+                expired = time.time() - self.lease_seconds
+                with self._cond:
+                    for job_id in [job_id for job_id, state in self._jobs.items()
+                                   if state['status'] in FINISHED_STATUSES and state['updated_at'] < expired]:
+                        del self._jobs[job_id]
+                    pending = [job_id for job_id, state in self._jobs.items()
+                               if state['status'] not in FINISHED_STATUSES]
+                touch_jobs(pending, self.owner)
+                self._claim_stale()
+            except Exception as e:
+                logger.error(f"Erro na manutenção da fila de jobs: {str(e)}")
+
+    def shutdown(self, wait: bool = True):
+        """Para de aceitar jobs e aguarda os que estão em execução (se wait)."""
+        self._executor.shutdown(wait=wait)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Estado do job: em memória se for deste processo, senão lido do banco."""
+        with self._cond:
+            state = self._jobs.get(job_id)
+            if state is not None:
+                return dict(state)
+        job = get_job(job_id)
+        if job is not None:
+            job.pop('payload', None)
+            job.pop('owner', None)
+        return job
+
+    def wait_for_change(self, job_id: str, version: int, timeout: float) -> bool:
+        """
+        Aguarda até o job deste processo passar da versão informada.
+
+        Returns:
+            False se o job não está em memória (é de outro processo: consulte o
+            banco periodicamente) ou se o timeout venceu
+        """
+        with self._cond:
+            if job_id not in self._jobs:
+                return False
+            return self._cond.wait_for(
+                lambda: job_id not in self._jobs or self._jobs[job_id]['version'] > version, timeout=timeout
+            )
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Jobs na fila e em execução neste processo, e contadores desde a inicialização."""
+        with self._cond:
+            statuses = [state['status'] for state in self._jobs.values()]
+        return dict(self.stats, workers=self.max_workers,
+                    queued=statuses.count('queued'), running=statuses.count('running'))
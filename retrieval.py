@@ -0,0 +1,872 @@
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy.sparse import csr_matrix, issparse, vstack as sparse_vstack
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Abaixo desta densidade (fração de valores não nulos) o VectorIndex guarda os vetores em CSR
+SPARSE_DENSITY_THRESHOLD = 0.5
+
+
+def top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """
+    Retorna os índices dos top_k maiores scores em ordem decrescente.
+
+    Usa argpartition (O(n)) para selecionar os candidatos e ordena apenas
+    os top_k selecionados, evitando a ordenação completa do vetor.
+    """
+    n = scores.shape[0]
+    if n == 0 or top_k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if top_k < n:
+        candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        candidates = np.arange(n)
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+def top_k_indices_batch(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """
+    Versão de top_k_indices para uma matriz (n_queries, n) de scores.
+
+    Returns:
+        Matriz (n_queries, min(top_k, n)) de índices, cada linha em ordem
+        decrescente de score
+    """
+    n = scores.shape[1]
+    if n == 0 or top_k <= 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+    if top_k < n:
+        candidates = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+    else:
+        candidates = np.broadcast_to(np.arange(n), scores.shape)
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+def normalize_queries(query_matrix: np.ndarray, dim: int) -> Optional[np.ndarray]:
+    """
+    Converte uma matriz de queries para float32 com linhas normalizadas.
+
+    Returns:
+        None se a dimensão não for a do índice
+    """
+    queries = np.atleast_2d(np.asarray(query_matrix, dtype=np.float32))
+    if queries.shape[1] != dim:
+        logger.warning(f"Dimensão das queries ({queries.shape[1]}) difere do índice ({dim})")
+        return None
+    return normalize_rows(queries)
+
+
+def ranked_lists(ids: np.ndarray, scores: np.ndarray) -> List[List[Tuple[int, float]]]:
+    """Converte matrizes (n_queries, k) de ids e scores em listas de (id, score) positivos."""
+    return [
+        [(int(chunk_id), float(score)) for chunk_id, score in zip(row_ids, row_scores) if score > 0]
+        for row_ids, row_scores in zip(ids, scores)
+    ]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], top_k: int,
+                           k: int = 60) -> List[Tuple[int, float]]:
+    """
+    Combina vários rankings por reciprocal rank fusion.
+
+    Cada item recebe a soma de 1 / (k + posição) nos rankings em que aparece,
+    o que dispensa normalizar scores de naturezas diferentes (BM25 x cosseno).
+
+    Returns:
+        Lista de (id, score RRF) em ordem decrescente, com no máximo top_k itens
+    """
+    fused = {}
+    for ranking in rankings:
+        for position, item in enumerate(ranking, start=1):
+            fused[item] = fused.get(item, 0.0) + 1.0 / (k + position)
+    return sorted(fused.items(), key=lambda entry: entry[1], reverse=True)[:top_k]
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """Normaliza as linhas pela norma L2 (linhas nulas permanecem nulas)."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def normalize_csr_rows(matrix: csr_matrix) -> csr_matrix:
+    """Versão de normalize_rows para matrizes CSR (sem densificar)."""
+    matrix = csr_matrix(matrix, dtype=np.float32, copy=True)
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1), dtype=np.float64).ravel())
+    norms[norms == 0] = 1.0
+    matrix.data /= np.repeat(norms, np.diff(matrix.indptr)).astype(np.float32)
+    return matrix
+
+
+def vector_length(vector) -> int:
+    """Dimensão de um vetor denso (array ou lista) ou de uma linha esparsa (1, dim)."""
+    return vector.shape[-1] if issparse(vector) else len(vector)
+
+
+def vector_block(ids: Sequence[int], vectors, dim: int) -> Tuple[List[int], Any]:
+    """
+    Reúne os vetores com a dimensão dada em um bloco: matriz CSR se algum
+    vetor for esparso, senão matriz densa float32.
+
+    Returns:
+        (ids mantidos, bloco), com bloco None se nenhum vetor tiver a dimensão
+    """
+    if issparse(vectors) or (isinstance(vectors, np.ndarray) and vectors.ndim == 2):
+        if vectors.shape[1] != dim:
+            return [], None
+        return list(ids), vectors
+
+    kept_ids = []
+    kept_vectors = []
+    for chunk_id, vector in zip(ids, vectors):
+        if vector_length(vector) != dim:
+            continue
+        kept_ids.append(chunk_id)
+        kept_vectors.append(vector)
+    if not kept_ids:
+        return [], None
+    if any(issparse(vector) for vector in kept_vectors):
+        return kept_ids, sparse_vstack([csr_matrix(vector).reshape(1, dim) for vector in kept_vectors], format='csr')
+    return kept_ids, np.asarray(kept_vectors, dtype=np.float32)
+
+
+def normalize_block(block) -> Any:
+    """Normaliza as linhas de um bloco denso ou CSR, mantendo o formato."""
+    if issparse(block):
+        return normalize_csr_rows(block)
+    return normalize_rows(np.asarray(block, dtype=np.float32))
+
+
+class VectorIndex:
+    """
+    Índice vetorial em memória para busca por similaridade de cosseno.
+
+    Os vetores ficam com as linhas normalizadas em uma única matriz float32,
+    de modo que a similaridade é um produto matriz-vetor. Vetores densos
+    (embeddings) ficam em uma matriz contígua; vetores esparsos (ex.:
+    HashingVectorizer, em que cada chunk tem poucas das milhares de
+    dimensões preenchidas) ficam em formato CSR, ocupando memória
+    proporcional aos valores não nulos. O formato é escolhido pela densidade
+    dos primeiros vetores adicionados, se sparse não for informado.
+
+    As estruturas crescem por duplicação de capacidade, então inserções
+    incrementais (vindas de save_to_database) têm custo amortizado O(1)
+    por linha.
+    """
+
+    def __init__(self, dim: int, initial_capacity: int = 1024, sparse: Optional[bool] = None):
+        self.dim = dim
+        self.sparse = sparse
+        self._lock = threading.RLock()
+        self._capacity = max(initial_capacity, 1)
+        self._ids = np.zeros(self._capacity, dtype=np.int64)
+        self._size = 0
+        # Denso: matriz (capacidade, dim), alocada quando o formato é definido
+        self._matrix: Optional[np.ndarray] = None
+        # Esparso: valores e colunas das linhas, com a linha i em indptr[i]:indptr[i + 1]
+        self._data = np.zeros(0, dtype=np.float32)
+        self._indices = np.zeros(0, dtype=np.int32)
+        self._indptr = np.zeros(self._capacity + 1, dtype=np.int32)
+        self._csr: Optional[csr_matrix] = None
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _ensure_capacity(self, extra: int, extra_nnz: int = 0):
+        required = self._size + extra
+        if required > self._capacity:
+            new_capacity = max(required, self._capacity * 2)
+            ids = np.zeros(new_capacity, dtype=np.int64)
+            ids[:self._size] = self._ids[:self._size]
+            self._ids = ids
+            if self.sparse:
+                indptr = np.zeros(new_capacity + 1, dtype=np.int32)
+                indptr[:self._size + 1] = self._indptr[:self._size + 1]
+                self._indptr = indptr
+            elif self._matrix is not None:
+                matrix = np.zeros((new_capacity, self.dim), dtype=np.float32)
+                matrix[:self._size] = self._matrix[:self._size]
+                self._matrix = matrix
+            self._capacity = new_capacity
+        if not self.sparse and self._matrix is None:
+            self._matrix = np.zeros((self._capacity, self.dim), dtype=np.float32)
+        nnz = int(self._indptr[self._size])
+        if self.sparse and nnz + extra_nnz > self._data.shape[0]:
+            new_nnz_capacity = max(nnz + extra_nnz, self._data.shape[0] * 2)
+            data = np.zeros(new_nnz_capacity, dtype=np.float32)
+            data[:nnz] = self._data[:nnz]
+            indices = np.zeros(new_nnz_capacity, dtype=np.int32)
+            indices[:nnz] = self._indices[:nnz]
+            self._data, self._indices = data, indices
+
+    def add(self, ids: Sequence[int], vectors) -> int:
+        """
+        Adiciona vetores ao índice.
+
+        Aceita uma matriz densa ou esparsa, ou uma sequência de vetores
+        (densos ou linhas esparsas). Vetores com dimensão diferente da do
+        índice são ignorados, pois pertencem a outro espaço vetorial e não
+        são comparáveis.
+
+        Returns:
+            Número de vetores efetivamente adicionados
+        """
+        kept_ids, block = vector_block(ids, vectors, self.dim)
+        if not kept_ids:
+            return 0
+
+        with self._lock:
+            if self.sparse is None:
+                nonzero = block.nnz if issparse(block) else np.count_nonzero(block)
+                self.sparse = nonzero / (block.shape[0] * self.dim) < SPARSE_DENSITY_THRESHOLD
+            if self.sparse:
+                block = normalize_csr_rows(csr_matrix(block, dtype=np.float32))
+            else:
+                block = normalize_rows(block.toarray() if issparse(block) else np.asarray(block, dtype=np.float32))
+
+            self._ensure_capacity(len(kept_ids), block.nnz if self.sparse else 0)
+            start = self._size
+            if self.sparse:
+                nnz = int(self._indptr[start])
+                self._data[nnz:nnz + block.nnz] = block.data
+                self._indices[nnz:nnz + block.nnz] = block.indices
+                self._indptr[start + 1:start + len(kept_ids) + 1] = nnz + block.indptr[1:]
+                self._csr = None
+            else:
+                self._matrix[start:start + len(kept_ids)] = block
+            self._ids[start:start + len(kept_ids)] = kept_ids
+            self._size += len(kept_ids)
+        return len(kept_ids)
+
+    def _rows_matrix(self, rows: Optional[np.ndarray] = None):
+        """Matriz normalizada das linhas ocupadas (ou das linhas dadas); chamado com o lock."""
+        if self.sparse:
+            if self._csr is None:
+                nnz = int(self._indptr[self._size])
+                # Sem cópia: a matriz aponta para os arrays do índice
+                self._csr = csr_matrix(
+                    (self._data[:nnz], self._indices[:nnz], self._indptr[:self._size + 1]),
+                    shape=(self._size, self.dim), copy=False
+                )
+            return self._csr if rows is None else self._csr[rows]
+        if self._matrix is None:
+            return np.zeros((0 if rows is None else len(rows), self.dim), dtype=np.float32)
+        return self._matrix[:self._size] if rows is None else self._matrix[rows]
+
+    def search(self, query_vector: np.ndarray, top_k: int = 3,
+               allowed_ids: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """
+        Busca os top_k vetores mais similares à query.
+
+        Args:
+            allowed_ids: Se informado, só estes ids são pontuados (pré-filtro)
+
+        Returns:
+            Lista de (id, similaridade) em ordem decrescente, apenas com
+            similaridade positiva
+        """
+        query = np.asarray(query_vector, dtype=np.float32).ravel()
+        if query.shape[0] != self.dim:
+            logger.warning(f"Dimensão da query ({query.shape[0]}) difere do índice ({self.dim})")
+            return []
+
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return []
+
+        start_time = time.time()
+        ids, scores = self._search_normalized(query / norm, top_k, allowed_ids)
+        results = [(int(chunk_id), float(score)) for chunk_id, score in zip(ids, scores) if score > 0]
+
+        logger.info(f"Busca vetorial em {self._size} chunks concluída em {(time.time() - start_time) * 1000:.2f} ms")
+        return results
+
+    def _search_normalized(self, query: np.ndarray, top_k: int,
+                           allowed_ids: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k para uma query já normalizada; retorna arrays (ids, scores)."""
+        with self._lock:
+            if allowed_ids is None:
+                scores = self._rows_matrix() @ query
+                indices = top_k_indices(scores, top_k)
+                return self._ids[indices], scores[indices]
+
+            rows = np.flatnonzero(np.isin(self._ids[:self._size], allowed_ids))
+            scores = self._rows_matrix(rows) @ query
+            indices = top_k_indices(scores, top_k)
+            return self._ids[rows[indices]], scores[indices]
+
+    def search_many(self, query_matrix: np.ndarray, top_k: int = 3,
+                    allowed_ids: Optional[np.ndarray] = None) -> List[List[Tuple[int, float]]]:
+        """
+        Busca várias queries de uma vez com um único produto matriz-matriz.
+
+        Returns:
+            Uma lista de (id, similaridade) por query, na ordem das queries
+        """
+        queries = normalize_queries(query_matrix, self.dim)
+        if queries is None:
+            return [[] for _ in range(len(query_matrix))]
+
+        start_time = time.time()
+        results = ranked_lists(*self._search_normalized_many(queries, top_k, allowed_ids))
+        logger.info(f"Busca vetorial de {len(queries)} queries em {self._size} chunks concluída em "
+                    f"{(time.time() - start_time) * 1000:.2f} ms")
+        return results
+
+    def _search_normalized_many(self, queries: np.ndarray, top_k: int,
+                                allowed_ids: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k para queries já normalizadas; retorna matrizes (n_queries, k) de ids e scores."""
+        with self._lock:
+            if allowed_ids is None:
+                rows = np.arange(self._size)
+                matrix = self._rows_matrix()
+            else:
+                rows = np.flatnonzero(np.isin(self._ids[:self._size], allowed_ids))
+                matrix = self._rows_matrix(rows)
+            scores = np.asarray(matrix @ queries.T).T
+            indices = top_k_indices_batch(scores, top_k)
+            return self._ids[rows[indices]], np.take_along_axis(scores, indices, axis=1)
+
+    def rows(self) -> Tuple[np.ndarray, Any]:
+        """Retorna cópias de (ids, matriz normalizada) com as linhas ocupadas (CSR se o índice for esparso)."""
+        with self._lock:
+            return self._ids[:self._size].copy(), self._rows_matrix().copy()
+
+    def remove(self, ids: Sequence[int]) -> int:
+        """
+        Remove os vetores dos ids dados, compactando as linhas restantes.
+
+        Returns:
+            Número de vetores removidos
+        """
+        with self._lock:
+            keep = ~np.isin(self._ids[:self._size], np.asarray(ids, dtype=np.int64))
+            removed = self._size - int(keep.sum())
+            if not removed:
+                return 0
+            kept_ids = self._ids[:self._size][keep]
+            if self.sparse:
+                kept = self._rows_matrix(np.flatnonzero(keep))
+                nnz = kept.nnz
+                self._data[:nnz] = kept.data
+                self._indices[:nnz] = kept.indices
+                self._indptr[:len(kept_ids) + 1] = kept.indptr
+                self._csr = None
+            else:
+                self._matrix[:len(kept_ids)] = self._matrix[:self._size][keep]
+            self._ids[:len(kept_ids)] = kept_ids
+            self._size = len(kept_ids)
+            return removed
+
+
+class PartitionedVectorIndex:
+    """
+    Conjunto de VectorIndex particionado por metadados (ex.: model_name,
+    source_type).
+
+    Buscas com filtro de partição varrem apenas as partições aceitas, em vez
+    de filtrar o top-k global depois: uma consulta restrita toca somente a sua
+    fatia do corpus.
+    """
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.partitions: Dict[Hashable, VectorIndex] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return sum(len(index) for index in self.partitions.values())
+
+    def add(self, ids: Sequence[int], vectors: Sequence[Sequence[float]], partition: Hashable = None) -> int:
+        """Adiciona vetores à partição indicada (criada se não existir)."""
+        with self._lock:
+            index = self.partitions.get(partition)
+            if index is None:
+                index = self.partitions[partition] = VectorIndex(self.dim, initial_capacity=max(len(ids), 16))
+        return index.add(ids, vectors)
+
+    def search(self, query_vector: np.ndarray, top_k: int = 3,
+               partition_filter: Optional[Callable[[Hashable], bool]] = None,
+               allowed_ids: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """
+        Busca nas partições aceitas por partition_filter (todas, se None).
+
+        Args:
+            allowed_ids: Pré-filtro adicional por id dentro das partições
+        """
+        query = np.asarray(query_vector, dtype=np.float32).ravel()
+        if query.shape[0] != self.dim:
+            logger.warning(f"Dimensão da query ({query.shape[0]}) difere do índice ({self.dim})")
+            return []
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return []
+        query = query / norm
+
+        start_time = time.time()
+        with self._lock:
+            partitions = [
+                index for key, index in self.partitions.items()
+                if partition_filter is None or partition_filter(key)
+            ]
+
+        candidate_ids = [np.empty(0, dtype=np.int64)]
+        candidate_scores = [np.empty(0, dtype=np.float32)]
+        for index in partitions:
+            ids, scores = index._search_normalized(query, top_k, allowed_ids)
+            candidate_ids.append(ids)
+            candidate_scores.append(scores)
+
+        ids = np.concatenate(candidate_ids)
+        scores = np.concatenate(candidate_scores)
+        best = top_k_indices(scores, top_k)
+        results = [(int(ids[i]), float(scores[i])) for i in best if scores[i] > 0]
+
+        scanned = sum(len(index) for index in partitions)
+        logger.info(f"Busca vetorial em {len(partitions)}/{len(self.partitions)} partições "
+                    f"({scanned} chunks) concluída em {(time.time() - start_time) * 1000:.2f} ms")
+        return results
+
+    def search_many(self, query_matrix: np.ndarray, top_k: int = 3,
+                    partition_filter: Optional[Callable[[Hashable], bool]] = None,
+                    allowed_ids: Optional[np.ndarray] = None) -> List[List[Tuple[int, float]]]:
+        """
+        Busca várias queries de uma vez: um produto matriz-matriz por partição
+        aceita, seguido da fusão dos top-k parciais de cada query.
+        """
+        queries = normalize_queries(query_matrix, self.dim)
+        if queries is None:
+            return [[] for _ in range(len(query_matrix))]
+
+        start_time = time.time()
+        with self._lock:
+            partitions = [
+                index for key, index in self.partitions.items()
+                if partition_filter is None or partition_filter(key)
+            ]
+
+        candidate_ids = [np.empty((len(queries), 0), dtype=np.int64)]
+        candidate_scores = [np.empty((len(queries), 0), dtype=np.float32)]
+        for index in partitions:
+            ids, scores = index._search_normalized_many(queries, top_k, allowed_ids)
+            candidate_ids.append(ids)
+            candidate_scores.append(scores)
+
+        ids = np.concatenate(candidate_ids, axis=1)
+        scores = np.concatenate(candidate_scores, axis=1)
+        best = top_k_indices_batch(scores, top_k)
+        results = ranked_lists(np.take_along_axis(ids, best, axis=1), np.take_along_axis(scores, best, axis=1))
+
+        scanned = sum(len(index) for index in partitions)
+        logger.info(f"Busca vetorial de {len(queries)} queries em {len(partitions)}/{len(self.partitions)} "
+                    f"partições ({scanned} chunks) concluída em {(time.time() - start_time) * 1000:.2f} ms")
+        return results
+
+
+def build_vector_index(rows: Sequence[Tuple[int, Sequence[float], Hashable]], dim: int) -> PartitionedVectorIndex:
+    """Constrói um PartitionedVectorIndex a partir de triplas (id, vetor, partição)."""
+    index = PartitionedVectorIndex(dim)
+    grouped: Dict[Hashable, Tuple[List[int], List[Sequence[float]]]] = {}
+    for chunk_id, vector, partition in rows:
+        ids, vectors = grouped.setdefault(partition, ([], []))
+        ids.append(chunk_id)
+        vectors.append(vector)
+
+    added = sum(index.add(ids, vectors, partition) for partition, (ids, vectors) in grouped.items())
+    skipped = len(rows) - added
+    if skipped:
+        logger.info(f"{skipped} chunks ignorados por estarem em outro espaço vetorial")
+    return index
+
+
+def _dense_rows(vectors, rows: np.ndarray) -> np.ndarray:
+    """Cópia densa float32 das linhas dadas de uma matriz densa ou CSR."""
+    selected = vectors[rows]
+    return (selected.toarray() if issparse(selected) else np.array(selected)).astype(np.float32)
+
+
+def spherical_kmeans(vectors: np.ndarray, n_clusters: int, n_iter: int = 10,
+                     seed: int = 0, batch_size: int = 4096) -> np.ndarray:
+    """
+    K-means esférico (similaridade de cosseno) sobre linhas já normalizadas
+    (matriz densa ou CSR; os centróides são densos).
+
+    Returns:
+        Matriz (n_clusters, dim) de centróides normalizados
+    """
+    rng = np.random.default_rng(seed)
+    n = vectors.shape[0]
+    centroids = _dense_rows(vectors, rng.choice(n, n_clusters, replace=False))
+
+    for _ in range(n_iter):
+        assignments = np.empty(n, dtype=np.int64)
+        for start in range(0, n, batch_size):
+            block = vectors[start:start + batch_size]
+            assignments[start:start + batch_size] = np.argmax(np.asarray(block @ centroids.T), axis=1)
+
+        # Soma dos membros de cada cluster como produto esparso (funciona para vetores densos e CSR)
+        membership = csr_matrix((np.ones(n, dtype=np.float32), (assignments, np.arange(n))), shape=(n_clusters, n))
+        sums = membership @ vectors
+        sums = sums.toarray() if issparse(sums) else np.asarray(sums)
+        # Clusters vazios são reiniciados em pontos aleatórios
+        empty = np.bincount(assignments, minlength=n_clusters) == 0
+        if empty.any():
+            sums[empty] = _dense_rows(vectors, rng.choice(n, int(empty.sum())))
+        centroids = normalize_rows(sums).astype(np.float32)
+
+    return centroids
+
+
+class IVFIndex:
+    """
+    Índice aproximado (IVF) para corpora grandes.
+
+    Os vetores são particionados pelo centróide mais próximo (k-means
+    esférico) e cada partição é um VectorIndex. Uma busca compara a query com
+    os centróides e varre apenas as nprobe partições mais próximas: nprobe
+    maior aumenta o recall, nprobe menor reduz a latência. Com nprobe igual ao
+    número de partições a busca é exata.
+    """
+
+    def __init__(self, centroids: np.ndarray, nprobe: int = 8):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.n_lists, self.dim = self.centroids.shape
+        self.nprobe = nprobe
+        self.lists = [VectorIndex(self.dim, initial_capacity=16) for _ in range(self.n_lists)]
+        self.max_id = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return sum(len(inverted_list) for inverted_list in self.lists)
+
+    @classmethod
+    def train(cls, vectors: np.ndarray, n_lists: Optional[int] = None, nprobe: int = 8,
+              n_iter: int = 10, sample_size: int = 100_000, seed: int = 0) -> 'IVFIndex':
+        """
+        Treina os centróides sobre uma amostra dos vetores.
+
+        Args:
+            vectors: Matriz (n, dim) densa ou CSR com os vetores do corpus
+            n_lists: Número de partições; padrão ~ sqrt(n)
+        """
+        vectors = normalize_block(vectors)
+        n = vectors.shape[0]
+        if n == 0:
+            raise ValueError("Não é possível treinar o índice IVF sem vetores")
+        n_lists = min(n, n_lists or max(1, int(np.sqrt(n))))
+
+        if n > sample_size:
+            sample = vectors[np.random.default_rng(seed).choice(n, sample_size, replace=False)]
+        else:
+            sample = vectors
+
+        start_time = time.time()
+        centroids = spherical_kmeans(sample, n_lists, n_iter=n_iter, seed=seed)
+        logger.info(f"Índice IVF treinado: {n_lists} partições em {time.time() - start_time:.2f} segundos")
+        return cls(centroids, nprobe=nprobe)
+
+    def add(self, ids: Sequence[int], vectors) -> int:
+        """Atribui cada vetor (denso ou esparso) à partição do centróide mais próximo."""
+        kept_ids, block = vector_block(ids, vectors, self.dim)
+        if not kept_ids:
+            return 0
+
+        kept_ids = np.asarray(kept_ids, dtype=np.int64)
+        block = normalize_block(block)
+        assignments = np.argmax(np.asarray(block @ self.centroids.T), axis=1)
+
+        with self._lock:
+            for list_id in np.unique(assignments):
+                rows = np.flatnonzero(assignments == list_id)
+                self.lists[list_id].add(kept_ids[rows], block[rows])
+            self.max_id = max(self.max_id, int(kept_ids.max()))
+        return len(kept_ids)
+
+    def remove(self, ids: Sequence[int]) -> int:
+        """Remove os vetores dos ids dados das partições (os centróides não mudam)."""
+        with self._lock:
+            return sum(inverted_list.remove(ids) for inverted_list in self.lists)
+
+    def ids(self) -> np.ndarray:
+        """Ids de todos os vetores indexados."""
+        with self._lock:
+            parts = [inverted_list._ids[:len(inverted_list)].copy() for inverted_list in self.lists]
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+
+    def search(self, query_vector: np.ndarray, top_k: int = 3,
+               nprobe: Optional[int] = None) -> List[Tuple[int, float]]:
+        """Busca aproximada varrendo as nprobe partições mais próximas da query."""
+        query = np.asarray(query_vector, dtype=np.float32).ravel()
+        if query.shape[0] != self.dim:
+            logger.warning(f"Dimensão da query ({query.shape[0]}) difere do índice ({self.dim})")
+            return []
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return []
+        query = query / norm
+
+        start_time = time.time()
+        nprobe = min(nprobe or self.nprobe, self.n_lists)
+        probed = top_k_indices(self.centroids @ query, nprobe)
+
+        candidate_ids = []
+        candidate_scores = []
+        scanned = 0
+        for list_id in probed:
+            inverted_list = self.lists[list_id]
+            scanned += len(inverted_list)
+            ids, scores = inverted_list._search_normalized(query, top_k)
+            candidate_ids.append(ids)
+            candidate_scores.append(scores)
+
+        ids = np.concatenate(candidate_ids)
+        scores = np.concatenate(candidate_scores)
+        best = top_k_indices(scores, top_k)
+        results = [(int(ids[i]), float(scores[i])) for i in best if scores[i] > 0]
+
+        logger.info(f"Busca IVF (nprobe={nprobe}) em {scanned} chunks concluída em "
+                    f"{(time.time() - start_time) * 1000:.2f} ms")
+        return results
+
+    def save(self, path: str):
+        """Salva centróides e partições em um arquivo .npz (escrita atômica)."""
+        with self._lock:
+            parts = [inverted_list.rows() for inverted_list in self.lists]
+        offsets = np.cumsum([0] + [len(ids) for ids, _ in parts])
+        ids = np.concatenate([ids for ids, _ in parts]) if parts else np.empty(0, dtype=np.int64)
+        if any(issparse(matrix) for _, matrix in parts):
+            # Partições esparsas são salvas em CSR (data, indices, indptr)
+            matrix = sparse_vstack([csr_matrix(matrix) for _, matrix in parts], format='csr')
+            vectors = {'data': matrix.data, 'indices': matrix.indices, 'indptr': matrix.indptr}
+        else:
+            vectors = {'vectors': np.concatenate([matrix for _, matrix in parts])
+                       if parts else np.empty((0, self.dim), dtype=np.float32)}
+
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, centroids=self.centroids, ids=ids, offsets=offsets,
+                 nprobe=np.array(self.nprobe), max_id=np.array(self.max_id), **vectors)
+        os.replace(tmp_path, path)
+        logger.info(f"Índice IVF salvo em {path}: {len(ids)} chunks")
+
+    @classmethod
+    def load(cls, path: str) -> 'IVFIndex':
+        """Carrega um índice salvo com save()."""
+        with np.load(path) as data:
+            index = cls(data['centroids'], nprobe=int(data['nprobe']))
+            offsets = data['offsets']
+            ids = data['ids']
+            if 'indptr' in data:
+                vectors = csr_matrix((data['data'], data['indices'], data['indptr']),
+                                     shape=(len(ids), index.dim))
+            else:
+                vectors = data['vectors']
+            for list_id in range(index.n_lists):
+                start, end = offsets[list_id], offsets[list_id + 1]
+                if end > start:
+                    index.lists[list_id].add(ids[start:end], vectors[start:end])
+            index.max_id = int(data['max_id'])
+        logger.info(f"Índice IVF carregado de {path}: {len(index)} chunks")
+        return index
+
+
+class RetrievalCache:
+    """
+    Cache LRU de resultados de recuperação, versionado pela geração do corpus.
+
+    Cada entrada guarda a geração em que foi calculada; quando o corpus muda
+    (nova ingestão ou remoção), a geração é incrementada e as entradas antigas
+    deixam de ser servidas.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[Hashable, Tuple[int, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, generation: int) -> Optional[Any]:
+        """Retorna o valor em cache para a chave, se calculado na geração atual."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != generation:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, generation: int, value: Any):
+        """Armazena um resultado, descartando o menos usado se o limite for atingido."""
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (generation, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Remove todas as entradas (os contadores são mantidos)."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Contadores para dimensionar o cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+
+# Palavras de uma letra comuns demais para distinguir perguntas
+_GUARD_STOPWORDS = frozenset({'a', 'e', 'o', 'é', 'à', 'y'})
+
+
+def question_guard(question: str) -> Tuple[str, ...]:
+    """
+    Tokens que precisam coincidir, na mesma ordem, para duas perguntas serem
+    consideradas equivalentes: números, nomes próprios e siglas (palavras com
+    maiúscula fora do início da pergunta) e palavras de uma letra ("produto A").
+
+    Embeddings tratam "produto A" e "produto B", ou "2002" e "2006", como
+    quase idênticos; a comparação exata desses tokens evita reaproveitar a
+    resposta errada.
+    """
+    tokens = re.findall(r"\w+", question)
+    guard = []
+    for position, token in enumerate(tokens):
+        if any(char.isdigit() for char in token):
+            guard.append(token)
+        elif len(token) == 1 and token.lower() not in _GUARD_STOPWORDS:
+            guard.append(token.lower())
+        elif position > 0 and any(char.isupper() for char in token):
+            guard.append(token.lower())
+    return tuple(guard)
+
+
+class SemanticAnswerCache:
+    """
+    Cache LRU de respostas por similaridade entre perguntas.
+
+    Cada resposta é guardada com o vetor (normalizado) da pergunta, um escopo
+    (ex.: modelo e filtros), a geração do corpus e os tokens de guarda da
+    pergunta (ver question_guard). Uma nova pergunta reutiliza a resposta da
+    pergunta mais parecida do mesmo escopo, da geração atual e com os mesmos
+    tokens de guarda, se o cosseno for pelo menos threshold. Os vetores de
+    cada escopo ficam numa matriz, de modo que a busca é um produto
+    matriz-vetor; entradas de gerações anteriores são descartadas na
+    primeira consulta ao escopo.
+    """
+
+    def __init__(self, max_entries: int = 512, threshold: float = 0.9):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self._entries: 'OrderedDict[int, Tuple[Hashable, Any]]' = OrderedDict()
+        self._scopes: Dict[Hashable, Dict[str, Any]] = {}
+        self._ids = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _unit(vector: np.ndarray) -> Optional[np.ndarray]:
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else None
+
+    def _remove(self, entry_id: int):
+        """Remove a entrada do LRU e da matriz do seu escopo (chamado com o lock)."""
+        scope, _ = self._entries.pop(entry_id)
+        data = self._scopes[scope]
+        position = data['ids'].index(entry_id)
+        del data['ids'][position]
+        del data['vectors'][position]
+        del data['guards'][position]
+        data['matrix'] = None
+        if not data['ids']:
+            del self._scopes[scope]
+
+    def get(self, scope: Hashable, generation: int, vector: np.ndarray,
+            guard: Tuple[str, ...] = ()) -> Optional[Tuple[Any, float]]:
+        """Retorna (valor, similaridade) da pergunta mais parecida com a mesma guarda, se acima do limiar."""
+        unit = self._unit(vector)
+        with self._lock:
+            data = self._scopes.get(scope)
+            if data is not None and data['generation'] != generation:
+                for entry_id in list(data['ids']):
+                    self._remove(entry_id)
+                data = None
+            if unit is None or data is None or data['vectors'][0].shape != unit.shape:
+                self.misses += 1
+                return None
+            if data['matrix'] is None:
+                data['matrix'] = np.vstack(data['vectors'])
+            similarities = data['matrix'] @ unit
+            similarities[[stored != tuple(guard) for stored in data['guards']]] = -np.inf
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+            entry_id = data['ids'][best]
+            self._entries.move_to_end(entry_id)
+            self.hits += 1
+            return self._entries[entry_id][1], float(similarities[best])
+
+    def put(self, scope: Hashable, generation: int, vector: np.ndarray, value: Any,
+            guard: Tuple[str, ...] = ()):
+        """Armazena a resposta, descartando as menos usadas se o limite for atingido."""
+        unit = self._unit(vector)
+        if self.max_entries <= 0 or unit is None:
+            return
+        with self._lock:
+            data = self._scopes.get(scope)
+            if data is not None and (data['generation'] != generation or data['vectors'][0].shape != unit.shape):
+                for entry_id in list(data['ids']):
+                    self._remove(entry_id)
+            data = self._scopes.setdefault(scope, {'generation': generation, 'ids': [], 'vectors': [], 'guards': [],
+                                                   'matrix': None})
+            self._ids += 1
+            self._entries[self._ids] = (scope, value)
+            data['ids'].append(self._ids)
+            data['vectors'].append(unit)
+            data['guards'].append(tuple(guard))
+            data['matrix'] = None
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Contadores para calibrar o limiar e o tamanho do cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'threshold': self.threshold,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
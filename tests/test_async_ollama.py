@@ -0,0 +1,108 @@
+import unittest
+import sys
+import json
+import time
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# Adiciona o diretório raiz ao PYTHONPATH
+sys.path.append(str(Path(__file__).parent.parent))
+
+import async_ollama
+from async_ollama import AsyncOllamaAPI
+
+class SlowGenerateHandler(BaseHTTPRequestHandler):
+    """Ollama falso: responde em streaming, uma palavra a cada 50 ms, registrando a concorrência."""
+    
+    lock = threading.Lock()
+    active = 0
+    peak = 0
+    
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with SlowGenerateHandler.lock:
+            SlowGenerateHandler.active += 1
+            SlowGenerateHandler.peak = max(SlowGenerateHandler.peak, SlowGenerateHandler.active)
+        try:
+            if 'Contexto dos documentos' in payload['prompt']:
+                answer = "Vou usar meu conhecimento geral."
+            else:
+                answer = "Resposta do modelo " + payload['model']
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.end_headers()
+            for word in answer.split(' '):
+                self.wfile.write((json.dumps({'response': word + ' ', 'done': False}) + '\n').encode('utf-8'))
+                self.wfile.flush()
+                time.sleep(0.05)
+            self.wfile.write((json.dumps({'response': '', 'done': True}) + '\n').encode('utf-8'))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            with SlowGenerateHandler.lock:
+                SlowGenerateHandler.active -= 1
+    
+    def log_message(self, *args):
+        pass
+
+@unittest.skipIf(async_ollama.aiohttp is None, "aiohttp não instalado")
+class TestAsyncOllamaAPI(unittest.TestCase):
+    """Testes do cliente assíncrono contra um Ollama falso local."""
+    
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), SlowGenerateHandler)
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+    
+    def setUp(self):
+        SlowGenerateHandler.peak = 0
+    
+    def test_concurrency_limit(self):
+        """Várias perguntas rodam em paralelo, nunca acima do limite do semáforo."""
+        async def run():
+            async with AsyncOllamaAPI(base_url=self.base_url, max_concurrency=2) as api:
+                answers = await asyncio.gather(*(api.ask_question("Pergunta?", f"m{i}") for i in range(5)))
+                return answers, api.get_stats()
+        
+        answers, stats = asyncio.run(run())
+        self.assertEqual([answer.strip() for answer in answers], [f"Resposta do modelo m{i}" for i in range(5)])
+        self.assertEqual(SlowGenerateHandler.peak, 2)
+        self.assertEqual((stats['completed'], stats['active'], stats['peak_active']), (5, 0, 2))
+    
+    def test_two_step_flow(self):
+        """Quando o contexto não basta, a etapa geral complementa a resposta."""
+        async def run():
+            async with AsyncOllamaAPI(base_url=self.base_url) as api:
+                return await api.ask_question("Pergunta?", 'fake', context="Texto.")
+        
+        answer = asyncio.run(run())
+        self.assertIn("Baseado nos documentos fornecidos: Vou usar meu conhecimento geral.", answer)
+        self.assertIn("Complementando com o conhecimento base do modelo: Resposta do modelo fake", answer)
+    
+    def test_cancellation(self):
+        """Cancelar a task interrompe a geração e libera a vaga do semáforo."""
+        async def run():
+            async with AsyncOllamaAPI(base_url=self.base_url, max_concurrency=1) as api:
+                task = asyncio.create_task(api.process_with_model("Pergunta?", 'fake'))
+                await asyncio.sleep(0.08)
+                task.cancel()
+                with self.assertRaises(asyncio.CancelledError):
+                    await task
+                # A vaga liberada permite a próxima geração
+                answer = await asyncio.wait_for(api.process_with_model("Pergunta?", 'fake'), timeout=5)
+                return answer, api.get_stats()
+        
+        answer, stats = asyncio.run(run())
+        self.assertTrue(answer.startswith("Resposta do modelo"))
+        self.assertEqual((stats['cancelled'], stats['completed'], stats['active']), (1, 1, 0))
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,54 @@
+import unittest
+import sys
+from pathlib import Path
+
+import numpy as np
+
+# Adiciona o diretório raiz ao PYTHONPATH
+sys.path.append(str(Path(__file__).parent.parent))
+
+from context_packer import estimate_tokens, mmr_order, pack_context, strip_overlap
+from url_processor import URLProcessor
+
+class TestContextPacker(unittest.TestCase):
+    """Testes da montagem do contexto enviado ao modelo."""
+    
+    def test_strip_overlap(self):
+        """As palavras repetidas no início do chunk seguinte são removidas."""
+        self.assertEqual(strip_overlap("a b c d", "c d e f"), "e f")
+        self.assertEqual(strip_overlap("a b c d", "x y"), "x y")
+    
+    def test_adjacent_chunks_merged_without_overlap(self):
+        """Chunks adjacentes de create_chunks voltam a formar o texto original."""
+        processor = URLProcessor(chunk_size=40, overlap=15, vectorizer_mode='tfidf')
+        text = "um dois três quatro cinco seis sete oito nove dez onze doze treze catorze quinze"
+        chunks = processor.create_chunks(text)
+        rows = [(chunk, 1.0, None, 40, 15, 1, i) for i, chunk in enumerate(chunks)]
+        
+        packed = pack_context(rows, token_budget=1000)
+        self.assertEqual(packed['text'], text)
+        self.assertEqual(packed['sections'], 1)
+        self.assertGreater(packed['chars_saved'], 0)
+        self.assertLess(packed['tokens'], packed['input_tokens'])
+    
+    def test_budget_and_diversity(self):
+        """Duplicatas são preteridas pelo MMR e o orçamento de tokens é respeitado."""
+        rows = [
+            ("gatos são felinos domésticos", 0.9, None, 0, 0, 1, 0),
+            ("gatos são felinos domésticos", 0.85, None, 0, 0, 2, 0),
+            ("cachorros são animais leais", 0.5, None, 0, 0, 3, 0),
+        ]
+        self.assertEqual(mmr_order([0.9, 0.85, 0.5], np.array([[1, 1, 0], [1, 1, 0], [0, 0, 1]]), 0.5), [0, 2, 1])
+        
+        packed = pack_context(rows, token_budget=1000, mmr_lambda=0.5)
+        self.assertEqual(packed['text'], "gatos são felinos domésticos\n\ncachorros são animais leais")
+        self.assertEqual(packed['chunks_dropped'], 1)
+        
+        packed = pack_context(rows, token_budget=estimate_tokens(rows[0][0]) + 1)
+        self.assertEqual(packed['chunks_used'], 1)
+        
+        packed = pack_context(rows, token_budget=2)
+        self.assertEqual(packed['text'], "gatos sã")
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,93 @@
+import unittest
+import os
+import sys
+import json
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import numpy as np
+
+# Adiciona o diretório raiz ao PYTHONPATH
+sys.path.append(str(Path(__file__).parent.parent))
+
+from vectorizer import OllamaEmbedder
+from url_processor import URLProcessor
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    """Servidor Ollama falso: o embedding de um texto é [len(texto), nº de 'a', 1]."""
+    
+    batches = []
+    
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        if self.path != '/api/embed':
+            self.send_error(404)
+            return
+        FakeOllamaHandler.batches.append(payload['input'])
+        body = json.dumps({
+            'model': payload['model'],
+            'embeddings': [[len(text), text.count('a'), 1.0] for text in payload['input']]
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, *args):
+        pass
+
+class TestOllamaEmbedder(unittest.TestCase):
+    """Testes do backend de embeddings contra um Ollama falso local."""
+    
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeOllamaHandler)
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+    
+    def setUp(self):
+        FakeOllamaHandler.batches = []
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.tmpdir.name, 'embeddings.db')
+    
+    def tearDown(self):
+        self.tmpdir.cleanup()
+    
+    def make_embedder(self):
+        return OllamaEmbedder(model='fake', base_url=self.base_url, batch_size=2, cache_path=self.cache_path)
+    
+    def test_batches_and_cache(self):
+        """Textos são enviados em lotes e textos já vistos não são reenviados."""
+        embedder = self.make_embedder()
+        vectors = embedder.embed(["banana", "abc", "banana", "xyz", "casa"])
+        
+        np.testing.assert_array_equal(vectors[0], [6, 3, 1])
+        np.testing.assert_array_equal(vectors[2], vectors[0])
+        self.assertEqual([len(batch) for batch in FakeOllamaHandler.batches], [2, 2])
+        
+        # Um novo embedder (ex.: após reiniciar) usa o cache em disco
+        embedder = self.make_embedder()
+        embedder.embed(["casa", "abc", "nova"])
+        self.assertEqual(FakeOllamaHandler.batches[-1], ["nova"])
+        self.assertEqual(embedder.stats, {'cache_hits': 2, 'cache_misses': 1, 'requests': 1})
+    
+    def test_url_processor_mode(self):
+        """O URLProcessor no modo 'ollama' vetoriza chunks e queries com o embedder."""
+        processor = URLProcessor(chunk_size=20, overlap=0, vectorizer_mode='ollama',
+                                 embedder=self.make_embedder())
+        chunks = processor.create_chunks("abacate amarelo pera verde uva roxa")
+        vectors, scores = processor.vectorize_chunks(chunks)
+        
+        self.assertEqual(vectors.shape, (len(chunks), 3))
+        np.testing.assert_array_equal(processor.vectorize_query("aaa"), [3, 3, 1])
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,121 @@
+import unittest
+import sys
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import requests
+
+# Adiciona o diretório raiz ao PYTHONPATH
+sys.path.append(str(Path(__file__).parent.parent))
+
+from http_client import HTTPClient
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    """Servidor falso: /flaky responde 503 nas primeiras falhas, /slow demora a responder."""
+    
+    protocol_version = 'HTTP/1.1'
+    failures = 0
+    hits = 0
+    
+    def _reply(self, status, body=b'ok'):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def _handle(self):
+        FlakyHandler.hits += 1
+        length = int(self.headers.get('Content-Length', 0))
+        if length:
+            self.rfile.read(length)
+        if self.path == '/slow':
+            time.sleep(0.5)
+        if self.path == '/flaky' and FlakyHandler.failures > 0:
+            FlakyHandler.failures -= 1
+            self._reply(503, b'indisponivel')
+            return
+        self._reply(200)
+    
+    do_GET = _handle
+    do_POST = _handle
+    
+    def log_message(self, *args):
+        pass
+
+class TestHTTPClient(unittest.TestCase):
+    """Testes do cliente HTTP compartilhado contra um servidor local."""
+    
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FlakyHandler)
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+    
+    def setUp(self):
+        FlakyHandler.failures = 0
+        FlakyHandler.hits = 0
+        self.client = HTTPClient(pool_maxsize=2, connect_timeout=1, read_timeout=5, max_retries=2, backoff=0)
+    
+    def tearDown(self):
+        self.client.close()
+    
+    def test_connections_reused(self):
+        """Requisições sequenciais ao mesmo host reaproveitam uma única conexão."""
+        for _ in range(5):
+            self.assertEqual(self.client.get(f"{self.base_url}/ok").status_code, 200)
+        
+        pool = self.client.stats()['pools'][f"http://127.0.0.1:{self.server.server_address[1]}"]
+        self.assertEqual(pool['connections_opened'], 1)
+        self.assertEqual(pool['reused'], 4)
+        self.assertEqual(pool['idle'], 1)
+    
+    def test_streamed_response_in_flight_until_closed(self):
+        """Respostas em streaming contam como em andamento até serem fechadas."""
+        response = self.client.get(f"{self.base_url}/ok", stream=True)
+        self.assertEqual(self.client.stats()['in_flight'], 1)
+        response.close()
+        response.close()
+        self.assertEqual(self.client.stats()['in_flight'], 0)
+        
+        with self.client.get(f"{self.base_url}/ok", stream=True) as response:
+            self.assertEqual(response.content, b'ok')
+        self.assertEqual(self.client.stats()['in_flight'], 0)
+    
+    def test_pool_connections_configurable(self):
+        """O número de hosts com pool próprio vem do parâmetro ou do ambiente."""
+        client = HTTPClient(pool_connections=8)
+        self.assertEqual(client.adapter._pool_connections, 8)
+        client.close()
+    
+    def test_idempotent_retries(self):
+        """GET é repetido em 503; POST só quando marcado como idempotente."""
+        FlakyHandler.failures = 2
+        self.assertEqual(self.client.get(f"{self.base_url}/flaky").status_code, 200)
+        self.assertEqual(self.client.stats()['retries'], 2)
+        
+        FlakyHandler.failures = 1
+        self.assertEqual(self.client.post(f"{self.base_url}/flaky", json={}).status_code, 503)
+        FlakyHandler.failures = 1
+        self.assertEqual(self.client.post(f"{self.base_url}/flaky", json={}, idempotent=True).status_code, 200)
+        
+        FlakyHandler.failures = 5
+        self.assertEqual(self.client.get(f"{self.base_url}/flaky").status_code, 503)
+        self.assertEqual(FlakyHandler.hits, 3 + 1 + 2 + 3)
+    
+    def test_read_timeout(self):
+        """O timeout de leitura por chamada interrompe respostas lentas."""
+        with self.assertRaises(requests.Timeout):
+            self.client.post(f"{self.base_url}/slow", json={}, timeout=0.1)
+        self.assertEqual(FlakyHandler.hits, 1)
+        self.assertEqual(self.client.stats()['errors'], 1)
+        self.assertEqual(self.client.stats()['in_flight'], 0)
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
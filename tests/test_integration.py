@@ -43,7 +43,7 @@ class TestIntegration(unittest.TestCase):
         vectors, scores = self.url_processor.vectorize_chunks(chunks)
         
         self.assertGreater(len(chunks), 0)
-        self.assertEqual(len(chunks), len(vectors))
+        self.assertEqual(len(chunks), vectors.shape[0])
         self.assertEqual(len(chunks), len(scores))
     
     def test_3_database_operations(self):
@@ -56,7 +56,7 @@ class TestIntegration(unittest.TestCase):
         for i, (chunk, vector, score) in enumerate(zip(chunks, vectors, scores)):
             chunks_data.append({
                 'content': chunk,
-                'vector': vector.tolist(),
+                'vector': vector,
                 'score': float(score),
                 'chunk_size': self.url_processor.chunk_size,
                 'overlap': self.url_processor.overlap,
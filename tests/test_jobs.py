@@ -0,0 +1,105 @@
+import unittest
+import os
+import sys
+import sqlite3
+import tempfile
+import threading
+from pathlib import Path
+
+# Adiciona o diretório raiz ao PYTHONPATH
+sys.path.append(str(Path(__file__).parent.parent))
+
+import database
+from jobs import IngestionQueue
+
+class TestIngestionQueue(unittest.TestCase):
+    """Testes da fila de jobs de ingestão registrada no banco."""
+    
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.original_db = database.DATABASE_FILE
+        database.DATABASE_FILE = os.path.join(self.tmpdir.name, 'data.db')
+        database.ensure_database_exists()
+        self.release = threading.Event()
+        self.queue = self._queue()
+    
+    def tearDown(self):
+        self.release.set()
+        self.queue.shutdown()
+        database.DATABASE_FILE = self.original_db
+        self.tmpdir.cleanup()
+    
+    def _queue(self):
+        queue = IngestionQueue(max_workers=1, lease_seconds=60)
+        
+        def handler(job, payload):
+            job.stage('chunking')
+            job.progress(0.5)
+            self.release.wait(5)
+            job.stage('saving')
+            if payload.get('fail'):
+                raise ValueError('conteúdo inválido')
+            return {'chunks': len(payload['content'])}
+        
+        queue.register('text', handler, [('chunking', 0.5), ('saving', 0.5)])
+        return queue
+    
+    def _wait_finished(self, queue, job_id):
+        state = queue.get(job_id)
+        while state['status'] not in ('done', 'failed'):
+            self.assertTrue(queue.wait_for_change(job_id, state['version'], timeout=5))
+            state = queue.get(job_id)
+        return state
+    
+    def test_progress_and_result(self):
+        """O job informa etapa e progresso enquanto roda e grava resultado e tempos ao terminar."""
+        job_id = self.queue.submit('text', {'content': 'abc'})
+        state = self.queue.get(job_id)
+        while state['stage'] != 'chunking' or state['progress'] != 0.25:
+            self.queue.wait_for_change(job_id, state['version'], timeout=5)
+            state = self.queue.get(job_id)
+        self.assertEqual(state['status'], 'running')
+        
+        self.release.set()
+        state = self._wait_finished(self.queue, job_id)
+        self.assertEqual((state['status'], state['progress'], state['result']), ('done', 1.0, {'chunks': 3}))
+        self.assertEqual(set(state['timings']), {'chunking', 'saving', 'total'})
+        
+        stored = database.get_job(job_id)
+        self.assertEqual((stored['status'], stored['result'], stored['payload']), ('done', {'chunks': 3}, None))
+    
+    def test_failure_recorded(self):
+        """Exceções do job viram status 'failed' com a mensagem de erro."""
+        self.release.set()
+        job_id = self.queue.submit('text', {'content': 'abc', 'fail': True})
+        state = self._wait_finished(self.queue, job_id)
+        self.assertEqual((state['status'], state['error']), ('failed', 'conteúdo inválido'))
+        self.assertEqual(database.get_job(job_id)['status'], 'failed')
+    
+    def test_stale_jobs_resumed(self):
+        """Jobs pendentes de um processo que parou são retomados; os com lease em dia, não."""
+        database.create_job('abandonado', 'text', {'content': 'abcd'}, owner='processo-morto')
+        database.create_job('ativo', 'text', {'content': 'ab'}, owner='processo-vivo')
+        with sqlite3.connect(database.DATABASE_FILE) as conn:
+            conn.execute("UPDATE jobs SET status = 'running', updated_at = 0 WHERE id = 'abandonado'")
+        
+        self.release.set()
+        self.queue.start()
+        state = self._wait_finished(self.queue, 'abandonado')
+        self.assertEqual((state['status'], state['result']), ('done', {'chunks': 4}))
+        self.assertEqual(database.get_job('abandonado')['attempts'], 1)
+        self.assertEqual(database.get_job('ativo')['status'], 'queued')
+        self.assertEqual(self.queue.get_stats()['resumed'], 1)
+    
+    def test_saved_document_recorded_in_job(self):
+        """O documento gravado por um job fica registrado nele, na mesma transação."""
+        database.create_job('gravado', 'text', {'content': 'abc'}, owner='processo-morto')
+        chunks_data = [{'content': 'abc', 'vector': [1.0, 0.0], 'score': 1.0, 'chunk_size': 60, 'overlap': 10,
+                        'index': 0}]
+        document_id = database.save_to_database('abc', chunks_data=chunks_data, job_id='gravado')
+        self.assertEqual(database.get_job('gravado')['document_id'], document_id)
+        self.assertEqual(database.get_document_info(document_id),
+                         {'document_id': document_id, 'chunks': 1, 'characters': 3})
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
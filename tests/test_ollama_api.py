@@ -0,0 +1,659 @@
+import unittest
+import sys
+import os
+import json
+import time
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# Adiciona o diretório raiz ao PYTHONPATH
+sys.path.append(str(Path(__file__).parent.parent))
+
+from vectorizer import OllamaAPI, ResponseCache, ContextSessionStore, GenerationScheduler, SummaryCache
+
+class FakeGenerateHandler(BaseHTTPRequestHandler):
+    """
+    Servidor Ollama falso para /api/generate.
+    
+    Com contexto, responde a partir dele, a menos que o contexto contenha
+    'desconhecido'; sem contexto, dá uma resposta geral. Em streaming, envia
+    uma linha NDJSON por palavra. Cada requisição demora delay segundos.
+    """
+    
+    requests = []
+    delay = 0
+    models = ['fake:latest']
+    tags_requests = 0
+    loaded = set()
+    word_delays = {}
+    
+    def _reply_json(self, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def do_GET(self):
+        if self.path == '/api/ps':
+            self._reply_json({'models': [{'name': name} for name in sorted(FakeGenerateHandler.loaded)]})
+        elif self.path == '/api/tags':
+            FakeGenerateHandler.tags_requests += 1
+            time.sleep(FakeGenerateHandler.delay)
+            self._reply_json({'models': [{'name': name} for name in FakeGenerateHandler.models]})
+        else:
+            self.send_error(404)
+    
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        if self.path != '/api/generate':
+            self.send_error(404)
+            return
+        FakeGenerateHandler.requests.append(payload)
+        time.sleep(FakeGenerateHandler.delay)
+        if payload['model'].split(':')[0] + ':latest' not in FakeGenerateHandler.models:
+            self.send_error(404, 'model not found')
+            return
+        
+        # Modelo ainda não carregado: a geração inclui 2 s de carga (load_duration)
+        load_duration = 0 if payload['model'] in FakeGenerateHandler.loaded else 2_000_000_000
+        if payload.get('keep_alive') == 0:
+            FakeGenerateHandler.loaded.discard(payload['model'])
+        else:
+            FakeGenerateHandler.loaded.add(payload['model'])
+        if 'prompt' not in payload:
+            self._reply_json({'model': payload['model'], 'done': True, 'load_duration': load_duration})
+            return
+        
+        prompt = payload['prompt']
+        if payload.get('context'):
+            answer = "Resposta baseada na sessão."
+        elif 'Contexto dos documentos' not in prompt:
+            answer = "Resposta geral do modelo."
+        elif 'desconhecido' in prompt:
+            answer = "Não está no contexto, vou usar meu conhecimento geral."
+        else:
+            answer = "Resposta baseada no contexto."
+        
+        if not payload.get('stream', True):
+            context = payload.get('context', []) + list(range(len(prompt.split()) + len(answer.split())))
+            self._reply_json({'model': payload['model'], 'response': answer, 'done': True,
+                              'context': context, 'load_duration': load_duration})
+            return
+        
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+        words = answer.split(' ')
+        for i, word in enumerate(words):
+            piece = word if i == 0 else ' ' + word
+            self.wfile.write((json.dumps({'response': piece, 'done': False}) + '\n').encode('utf-8'))
+            self.wfile.flush()
+            time.sleep(FakeGenerateHandler.word_delays.get(payload['model'], 0))
+        self.wfile.write((json.dumps({'response': '', 'done': True, 'eval_count': len(words),
+                                      'load_duration': load_duration}) + '\n').encode('utf-8'))
+    
+    def log_message(self, *args):
+        pass
+
+class TestOllamaStreaming(unittest.TestCase):
+    """Testes das respostas em streaming contra um Ollama falso local."""
+    
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeGenerateHandler)
+        cls.api = OllamaAPI(base_url=f"http://127.0.0.1:{cls.server.server_address[1]}")
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+    
+    def setUp(self):
+        FakeGenerateHandler.requests = []
+        FakeGenerateHandler.delay = 0
+    
+    def test_stream_with_model(self):
+        """Os trechos chegam separados e juntos formam a resposta completa."""
+        pieces = list(self.api.stream_with_model("Pergunta: teste", 'fake'))
+        self.assertGreater(len(pieces), 1)
+        self.assertEqual("".join(pieces), self.api.process_with_model("Pergunta: teste", 'fake'))
+        self.assertTrue(FakeGenerateHandler.requests[0]['stream'])
+    
+    def test_context_answer_streamed(self):
+        """Quando o contexto basta, só a etapa de contexto é executada."""
+        events = list(self.api.ask_question_stream("O que é?", 'fake', context="Texto dos documentos."))
+        
+        self.assertEqual(events[0], {'event': 'stage', 'stage': 'context'})
+        text = "".join(event['text'] for event in events if event['event'] == 'token')
+        self.assertEqual(text, "Resposta baseada no contexto.")
+        self.assertEqual(events[-1]['event'], 'done')
+        self.assertIsNotNone(events[-1]['first_token_ms'])
+        self.assertEqual(len(FakeGenerateHandler.requests), 1)
+    
+    def test_falls_back_to_general_knowledge(self):
+        """A etapa geral segue a de contexto quando o modelo indica que precisa dela."""
+        events = list(self.api.ask_question_stream("O que é?", 'fake', context="Algo desconhecido."))
+        
+        stages = [event['stage'] for event in events if event['event'] == 'stage']
+        self.assertEqual(stages, ['context', 'general'])
+        general = "".join(event['text'] for event in events
+                          if event['event'] == 'token' and event['stage'] == 'general')
+        self.assertEqual(general, "Resposta geral do modelo.")
+        
+        events = list(self.api.ask_question_stream("O que é?", 'fake'))
+        self.assertEqual([event['stage'] for event in events if event['event'] == 'stage'], ['general'])
+
+    def test_speculative_general_answer(self):
+        """No modo especulativo as duas etapas rodam em paralelo e a resposta é a mesma."""
+        expected = self.api.ask_question("O que é?", 'fake', context="Algo desconhecido.", speculative=False)
+        FakeGenerateHandler.delay = 0.3
+        
+        start_time = time.time()
+        answer = self.api.ask_question("O que é?", 'fake', context="Algo desconhecido.", speculative=True)
+        self.assertLess(time.time() - start_time, 0.55)
+        self.assertEqual(answer, expected)
+        
+        answer = self.api.ask_question("O que é?", 'fake', context="Texto dos documentos.", speculative=True)
+        self.assertEqual(answer, "Resposta baseada no contexto.")
+        
+        deadline = time.time() + 2
+        while self.api.get_speculation_stats()['runs'] < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        stats = self.api.get_speculation_stats()
+        self.assertEqual((stats['runs'], stats['used'], stats['cancelled']), (2, 1, 1))
+        self.assertGreater(stats['saved_ms'], 100)
+        self.assertEqual(stats['hit_rate'], 0.5)
+
+class TestModelsCache(unittest.TestCase):
+    """Testes do cache da lista de modelos."""
+    
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeGenerateHandler)
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+    
+    def setUp(self):
+        FakeGenerateHandler.delay = 0
+        FakeGenerateHandler.tags_requests = 0
+        FakeGenerateHandler.models = ['fake:latest']
+        self.api = OllamaAPI(base_url=self.base_url)
+    
+    def tearDown(self):
+        FakeGenerateHandler.models = ['fake:latest']
+    
+    def wait_for(self, condition):
+        deadline = time.time() + 2
+        while not condition() and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(condition())
+    
+    def test_stale_while_revalidate(self):
+        """Vencido o TTL, a lista anterior é servida na hora e atualizada em segundo plano."""
+        self.assertEqual(self.api.list_models(), ['fake:latest'])
+        self.api.list_models()
+        self.assertEqual(FakeGenerateHandler.tags_requests, 1)
+        
+        FakeGenerateHandler.models = ['fake:latest', 'novo:latest']
+        FakeGenerateHandler.delay = 0.3
+        self.api.models_ttl = 0
+        start_time = time.time()
+        self.assertEqual(self.api.list_models(), ['fake:latest'])
+        self.api.list_models()
+        self.assertLess(time.time() - start_time, 0.2)
+        
+        self.wait_for(lambda: self.api.get_models_cache_stats()['changes'] == 1)
+        self.assertEqual(FakeGenerateHandler.tags_requests, 2)
+        self.api.models_ttl = 60
+        self.assertEqual(self.api.list_models(), ['fake:latest', 'novo:latest'])
+    
+    def test_cold_cache_single_flight(self):
+        """Com o cache vazio, chamadas simultâneas fazem uma única consulta ao Ollama."""
+        FakeGenerateHandler.delay = 0.2
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.api.list_models())) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(results, [['fake:latest']] * 8)
+        self.assertEqual(FakeGenerateHandler.tags_requests, 1)
+        self.assertEqual(self.api.get_models_cache_stats()['waited'], 7)
+    
+    def test_invalidated_by_model_changes(self):
+        """Um modelo removido (404) ou desconhecido na geração atualiza a lista imediatamente."""
+        self.api.list_models()
+        FakeGenerateHandler.models = ['outro:latest']
+        self.api.process_with_model("Pergunta: x", 'fake')
+        self.wait_for(lambda: self.api.list_models() == ['outro:latest'])
+        
+        FakeGenerateHandler.models = ['outro:latest', 'fake:latest']
+        self.api.process_with_model("Pergunta: x", 'fake')
+        self.wait_for(lambda: self.api.list_models() == ['outro:latest', 'fake:latest'])
+
+class TestResponseCache(unittest.TestCase):
+    """Testes do cache persistente de respostas do modelo."""
+    
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeGenerateHandler)
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+    
+    def setUp(self):
+        FakeGenerateHandler.requests = []
+        FakeGenerateHandler.delay = 0
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'responses.db')
+    
+    def tearDown(self):
+        self.tmpdir.cleanup()
+    
+    def test_deterministic_requests_cached(self):
+        """Com temperatura 0, a segunda pergunta idêntica não chega ao Ollama."""
+        api = OllamaAPI(base_url=self.base_url, response_cache=ResponseCache(self.path))
+        api.options = {'temperature': 0}
+        first = api.ask_question("O que é?", 'fake', context="Texto dos documentos.")
+        self.assertEqual(api.ask_question("O que é?", 'fake', context="Texto dos documentos."), first)
+        self.assertEqual("".join(api.stream_with_model("Pergunta: x", 'fake')),
+                         "".join(api.stream_with_model("Pergunta: x", 'fake')))
+        self.assertEqual(len(FakeGenerateHandler.requests), 2)
+        self.assertEqual(FakeGenerateHandler.requests[0]['options'], {'temperature': 0})
+        
+        # Outro modelo ou outras opções são outra chave
+        api.process_with_model("Pergunta: x", 'outro')
+        self.assertEqual(len(FakeGenerateHandler.requests), 3)
+        self.assertEqual(api.response_cache.get_stats()['hits'], 2)
+    
+    def test_sampling_bypassed_unless_enabled(self):
+        """Gerações com amostragem só são cacheadas quando habilitado."""
+        api = OllamaAPI(base_url=self.base_url, response_cache=ResponseCache(self.path))
+        api.options = {'temperature': 0.7}
+        api.process_with_model("Pergunta: x", 'fake')
+        api.process_with_model("Pergunta: x", 'fake')
+        self.assertEqual(len(FakeGenerateHandler.requests), 2)
+        self.assertEqual(api.response_cache.get_stats()['bypassed'], 2)
+        self.assertFalse(os.path.exists(self.path))
+        
+        api.response_cache = ResponseCache(self.path, allow_nondeterministic=True)
+        api.process_with_model("Pergunta: x", 'fake')
+        api.process_with_model("Pergunta: x", 'fake')
+        self.assertEqual(len(FakeGenerateHandler.requests), 3)
+        self.assertTrue(api.response_cache.cacheable({'temperature': 0.7, 'seed': 42}))
+    
+    def test_ttl_and_size_eviction(self):
+        """Entradas expiram pelo TTL e as menos usadas saem quando o limite é excedido."""
+        cache = ResponseCache(self.path, ttl=60, max_bytes=10)
+        cache.put('a', 'fake', '1234')
+        cache.put('b', 'fake', '5678')
+        self.assertEqual(cache.get('a'), '1234')  # 'b' passa a ser a menos usada
+        cache.put('c', 'fake', 'abcd')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 'abcd')
+        self.assertEqual(cache.get_stats()['evictions'], 1)
+        
+        cache.ttl = 0
+        time.sleep(0.01)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get_stats()['expired'], 1)
+
+class TestContextSessions(unittest.TestCase):
+    """Testes do reaproveitamento dos tokens de contexto devolvidos pelo Ollama."""
+    
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeGenerateHandler)
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+    
+    def setUp(self):
+        FakeGenerateHandler.requests = []
+        FakeGenerateHandler.delay = 0
+        self.api = OllamaAPI(base_url=self.base_url)
+    
+    def test_questions_continue_training_session(self):
+        """Após train_model, as perguntas enviam os tokens da sessão e o contexto recuperado."""
+        self.api.train_model(["Documento secreto."], 'fake', corpus_version=1)
+        session = self.api.sessions.get('fake', 1)
+        self.assertTrue(session)
+        
+        answer = self.api.ask_question("Pergunta?", 'fake', context="Trecho recuperado.", corpus_version=1)
+        self.assertEqual(answer, "Resposta baseada na sessão.")
+        payload = FakeGenerateHandler.requests[-1]
+        self.assertEqual(payload['context'], session)
+        self.assertIn("Trecho recuperado.", payload['prompt'])
+        self.assertNotIn("Documento secreto.", payload['prompt'])
+        
+        # Corpus alterado: sem sessão, o contexto volta a ser enviado no prompt
+        answer = self.api.ask_question("Pergunta?", 'fake', context="Documento secreto.", corpus_version=2)
+        self.assertEqual(answer, "Resposta baseada no contexto.")
+        self.assertNotIn('context', FakeGenerateHandler.requests[-1])
+    
+    def test_store_eviction(self):
+        """Uma nova versão substitui a anterior do modelo e o limite de tokens descarta as mais antigas."""
+        store = ContextSessionStore(max_tokens=10)
+        store.put('a', 1, [1, 2, 3, 4])
+        store.put('a', 2, [1, 2, 3, 4])
+        self.assertIsNone(store.get('a', 1))
+        store.put('b', 1, [5, 6, 7, 8])
+        self.assertEqual(store.get('a', 2), [1, 2, 3, 4])  # 'b' passa a ser a menos usada
+        store.put('c', 1, [9, 10, 11])
+        self.assertIsNone(store.get('b', 1))
+        self.assertEqual(store.get_stats()['tokens'], 7)
+        self.assertEqual(store.get_stats()['evictions'], 1)
+
+class TestGenerationScheduler(unittest.TestCase):
+    """Testes da fila de prioridades e da coalescência de requisições idênticas."""
+    
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeGenerateHandler)
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+    
+    def setUp(self):
+        FakeGenerateHandler.requests = []
+        FakeGenerateHandler.delay = 0.4
+        self.api = OllamaAPI(base_url=self.base_url)
+        self.api.scheduler = GenerationScheduler(max_workers=1)
+    
+    def _start(self, prompt, priority):
+        def run():
+            with self.api.priority(priority):
+                self.api.process_with_model(prompt, 'fake')
+        thread = threading.Thread(target=run)
+        thread.start()
+        time.sleep(0.05)
+        return thread
+    
+    def test_interactive_before_batch_and_train(self):
+        """Com a vaga ocupada, perguntas interativas passam à frente das que chegaram antes."""
+        threads = [self._start("treino", 'train'), self._start("lote", 'batch'), self._start("outro treino", 'train'),
+                   self._start("interativa", 'interactive')]
+        stats = self.api.get_scheduler_stats()
+        self.assertEqual(stats['queued'], {'interactive': 1, 'batch': 1, 'train': 1})
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual([payload['prompt'] for payload in FakeGenerateHandler.requests],
+                         ["treino", "interativa", "lote", "outro treino"])
+        stats = self.api.get_scheduler_stats()
+        self.assertEqual((stats['executed'], stats['active'], stats['peak_queued']), (4, 0, 3))
+        self.assertGreater(stats['wait']['batch']['max_ms'], stats['wait']['interactive']['max_ms'])
+    
+    def test_identical_requests_coalesced(self):
+        """Prompts idênticos simultâneos geram uma única requisição ao Ollama."""
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.api.process_with_model("Igual?", 'fake')))
+                   for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(results, ["Resposta geral do modelo."] * 3)
+        self.assertEqual(len(FakeGenerateHandler.requests), 1)
+        self.assertEqual(self.api.get_scheduler_stats()['coalesced'], 2)
+    
+    def test_speculation_with_single_slot(self):
+        """Com uma vaga, a especulação não atrasa a resposta com contexto nem envia a pergunta geral."""
+        start_time = time.time()
+        answer = self.api.ask_question("O que é?", 'fake', context="Texto dos documentos.", speculative=True)
+        self.assertLess(time.time() - start_time, 0.7)
+        self.assertEqual(answer, "Resposta baseada no contexto.")
+        
+        time.sleep(0.2)
+        self.assertEqual(len(FakeGenerateHandler.requests), 1)
+        self.assertIn("Contexto dos documentos", FakeGenerateHandler.requests[0]['prompt'])
+    
+    def test_cancelled_while_queued(self):
+        """Uma geração cancelada enquanto aguarda vaga sai da fila sem ser enviada."""
+        cancel = threading.Event()
+        thread = self._start("ocupa a vaga", 'interactive')
+        pieces = []
+        waiter = threading.Thread(target=lambda: pieces.extend(
+            self.api.stream_with_model("cancelada", 'fake', cancel=cancel)))
+        waiter.start()
+        time.sleep(0.05)
+        self.assertEqual(self.api.get_scheduler_stats()['queued']['interactive'], 1)
+        cancel.set()
+        waiter.join(0.3)
+        self.assertFalse(waiter.is_alive())
+        thread.join()
+        
+        self.assertEqual(pieces, [])
+        self.assertEqual([payload['prompt'] for payload in FakeGenerateHandler.requests], ["ocupa a vaga"])
+        stats = self.api.get_scheduler_stats()
+        self.assertEqual((stats['abandoned'], stats['queued']['interactive']), (1, 0))
+    
+    def test_unknown_priority(self):
+        with self.assertRaises(ValueError):
+            with self.api.priority('urgente'):
+                pass
+
+class TestMapReduceTraining(unittest.TestCase):
+    """Testes do treino map-reduce com resumos em cache por documento."""
+    
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeGenerateHandler)
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+    
+    def setUp(self):
+        FakeGenerateHandler.requests = []
+        FakeGenerateHandler.delay = 0
+        self.tmpdir = tempfile.TemporaryDirectory()
+        cache = SummaryCache(os.path.join(self.tmpdir.name, 'summaries.db'))
+        self.api = OllamaAPI(base_url=self.base_url, summary_cache=cache)
+    
+    def tearDown(self):
+        self.tmpdir.cleanup()
+    
+    def _prompts(self, marker):
+        return [payload['prompt'] for payload in FakeGenerateHandler.requests if marker in payload['prompt']]
+    
+    def test_only_new_documents_summarized(self):
+        """Repetir o treino com um documento a mais gera só o resumo novo e a apresentação final."""
+        documents = ["Documento um.", "Documento dois.", "Documento três."]
+        self.api.train_model(documents, 'fake', map_reduce=True)
+        self.assertEqual(len(self._prompts("Resuma o documento")), 3)
+        training_prompt = self._prompts("Analise os seguintes documentos")[0]
+        self.assertNotIn("Documento um.", training_prompt)
+        self.assertIn("Resposta geral do modelo.", training_prompt)
+        
+        FakeGenerateHandler.requests = []
+        self.api.train_model(documents + ["Documento quatro."], 'fake', map_reduce=True)
+        summarized = self._prompts("Resuma o documento")
+        self.assertEqual(len(summarized), 1)
+        self.assertIn("Documento quatro.", summarized[0])
+        self.assertEqual(len(FakeGenerateHandler.requests), 2)
+    
+    def test_hierarchical_reduce(self):
+        """Resumos que não cabem no limite são fundidos em níveis; documentos grandes viram seções."""
+        self.api.train_max_chars = 60
+        text = " ".join(["palavra"] * 20)
+        sections = self.api._split_document(text)
+        self.assertEqual(len(sections), 3)
+        self.assertTrue(all(len(section) <= 60 for section in sections))
+        self.assertEqual(" ".join(sections), text)
+        
+        self.api.train_model(["Documento um.", "Documento dois.", "Documento três.", "Documento quatro."], 'fake')
+        # 4 resumos de 25 caracteres -> 2 fusões de pares (cabem em 60) -> apresentação final;
+        # as duas fusões têm o mesmo prompt e podem ser coalescidas pelo escalonador
+        self.assertEqual(len(self._prompts("Resuma o documento")), 4)
+        self.assertEqual(len(self._prompts("Combine os resumos")) + self.api.get_scheduler_stats()['coalesced'], 2)
+        self.assertEqual(len(self._prompts("Analise os seguintes documentos")), 1)
+
+class TestModelLifecycle(unittest.TestCase):
+    """Testes de pré-carga, keep_alive e métricas de latência fria/quente."""
+    
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeGenerateHandler)
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+    
+    def setUp(self):
+        FakeGenerateHandler.requests = []
+        FakeGenerateHandler.delay = 0
+        FakeGenerateHandler.loaded = set()
+        self.api = OllamaAPI(base_url=self.base_url)
+        self.api.keep_alive = '10m'
+    
+    def test_cold_and_warm_generations(self):
+        """A primeira geração carrega o modelo (fria); as seguintes são quentes."""
+        self.api.process_with_model("Primeira?", 'fake')
+        self.api.process_with_model("Segunda?", 'fake')
+        list(self.api.stream_with_model("Terceira?", 'fake'))
+        
+        stats = self.api.get_lifecycle_stats()
+        self.assertEqual((stats['cold']['count'], stats['warm']['count']), (1, 2))
+        self.assertEqual(stats['cold']['avg_load_ms'], 2000)
+        self.assertTrue(all(payload['keep_alive'] == '10m' for payload in FakeGenerateHandler.requests))
+    
+    def test_preload_pin_and_unload(self):
+        """Pré-carga evita a geração fria; modelos fixados usam keep_alive -1 até serem descarregados."""
+        self.assertEqual(self.api.preload_model('fake')['load_ms'], 2000)
+        self.api.process_with_model("Pergunta?", 'fake')
+        self.assertEqual(self.api.get_lifecycle_stats()['cold']['count'], 0)
+        
+        self.api.pin_model('fake')
+        self.api.process_with_model("Outra pergunta?", 'fake')
+        self.assertEqual(FakeGenerateHandler.requests[-1]['keep_alive'], -1)
+        self.assertEqual([model['name'] for model in self.api.loaded_models()], ['fake'])
+        
+        self.api.unload_model('fake')
+        self.assertEqual(FakeGenerateHandler.requests[-1], {'model': 'fake', 'keep_alive': 0})
+        self.assertEqual(self.api.loaded_models(), [])
+        self.assertEqual(self.api.get_lifecycle_stats()['pinned'], [])
+
+class TestModelRace(unittest.TestCase):
+    """Testes da corrida entre modelos com prazo para o preferido."""
+    
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeGenerateHandler)
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+    
+    def setUp(self):
+        FakeGenerateHandler.requests = []
+        FakeGenerateHandler.delay = 0
+        FakeGenerateHandler.models = ['fake:latest', 'rapido:latest', 'lento:latest']
+        self.api = OllamaAPI(base_url=self.base_url)
+    
+    def tearDown(self):
+        FakeGenerateHandler.models = ['fake:latest']
+        FakeGenerateHandler.word_delays = {}
+    
+    def test_preferred_within_deadline(self):
+        """O preferido vence se responder dentro do prazo, mesmo chegando depois."""
+        FakeGenerateHandler.word_delays = {'lento': 0.05}
+        result = self.api.ask_question_race("Pergunta?", ['lento', 'rapido'], deadline_ms=2000)
+        self.assertEqual((result['model'], result['reason']), ('lento', 'preferred'))
+        self.assertEqual(result['answer'], "Resposta geral do modelo.")
+    
+    def test_first_acceptable_after_deadline(self):
+        """Passado o prazo, vence a primeira resposta aceitável e o preferido é cancelado."""
+        FakeGenerateHandler.word_delays = {'lento': 0.3}
+        start_time = time.time()
+        result = self.api.ask_question_race("Pergunta?", ['lento', 'rapido'], deadline_ms=100)
+        self.assertLess(time.time() - start_time, 0.6)
+        self.assertEqual((result['model'], result['reason']), ('rapido', 'first_acceptable'))
+        
+        stats = self.api.get_race_stats()
+        self.assertEqual((stats['rapido']['wins'], stats['rapido']['win_rate']), (1, 1.0))
+        self.assertEqual((stats['lento']['wins'], stats['lento']['cancelled']), (0, 1))
+    
+    def test_deadline_starts_when_preferred_gets_slot(self):
+        """O tempo do preferido na fila do escalonador não conta no prazo."""
+        self.api.scheduler = GenerationScheduler(max_workers=2)
+        FakeGenerateHandler.word_delays = {'lento': 0.03}
+        release = threading.Event()
+        
+        def occupy():
+            with self.api.scheduler.slot('interactive'):
+                release.wait(5)
+        
+        holders = [threading.Thread(target=occupy) for _ in range(2)]
+        for holder in holders:
+            holder.start()
+        while self.api.get_scheduler_stats()['active'] < 2:
+            time.sleep(0.01)
+        threading.Timer(0.4, release.set).start()
+        
+        result = self.api.ask_question_race("Pergunta?", ['rapido', 'lento'], preferred='lento', deadline_ms=300)
+        self.assertEqual((result['model'], result['reason']), ('lento', 'preferred'))
+        for holder in holders:
+            holder.join()
+    
+    def test_queued_losers_never_sent(self):
+        """Com uma vaga, o perdedor ainda na fila é cancelado sem ser enviado e libera sua thread."""
+        self.api.scheduler = GenerationScheduler(max_workers=1)
+        FakeGenerateHandler.delay = 0.3
+        result = self.api.ask_question_race("Pergunta?", ['rapido', 'lento'], deadline_ms=2000)
+        self.assertEqual((result['model'], result['reason']), ('rapido', 'preferred'))
+        
+        deadline = time.time() + 1
+        while self.api.get_scheduler_stats()['abandoned'] < 1 and time.time() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.4)
+        self.assertEqual([payload['model'] for payload in FakeGenerateHandler.requests], ['rapido'])
+        stats = self.api.get_scheduler_stats()
+        self.assertEqual((stats['abandoned'], stats['executed']), (1, 1))
+        self.assertEqual(self.api.get_race_stats()['lento']['cancelled'], 1)
+    
+    def test_preferred_must_race(self):
+        """O preferido precisa estar entre os modelos da corrida."""
+        with self.assertRaises(ValueError):
+            self.api.ask_question_race("Pergunta?", ['rapido', 'lento'], preferred='fake')
+    
+    def test_none_acceptable(self):
+        """Sem resposta aceitável, devolve a do preferido."""
+        result = self.api.ask_question_race("Pergunta?", ['rapido', 'fake'], check=lambda response: False)
+        self.assertEqual((result['model'], result['reason']), ('rapido', 'none_acceptable'))
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,492 @@
+import unittest
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+from scipy.sparse import csr_matrix, issparse
+
+# Adiciona o diretório raiz ao PYTHONPATH
+sys.path.append(str(Path(__file__).parent.parent))
+
+import database
+from retrieval import (
+    IVFIndex, PartitionedVectorIndex, RetrievalCache, SemanticAnswerCache, VectorIndex, question_guard,
+    reciprocal_rank_fusion, top_k_indices
+)
+from url_processor import CorpusStatistics, URLProcessor
+from vector_store import FORMAT_CSR_F32, decode_vector
+
+class TestVectorIndex(unittest.TestCase):
+    """Testes do índice vetorial em memória."""
+    
+    def test_top_k_indices_ordered(self):
+        """Os índices retornados estão em ordem decrescente de score."""
+        scores = np.array([0.1, 0.9, 0.3, 0.7, 0.5])
+        self.assertEqual(top_k_indices(scores, 3).tolist(), [1, 3, 4])
+        self.assertEqual(top_k_indices(scores, 10).tolist(), [1, 3, 4, 2, 0])
+    
+    def test_reciprocal_rank_fusion(self):
+        """Itens bem posicionados em vários rankings sobem na fusão."""
+        fused = reciprocal_rank_fusion([[1, 2, 3], [2, 3, 4]], top_k=3, k=60)
+        self.assertEqual([item for item, _ in fused], [2, 3, 1])
+        self.assertAlmostEqual(fused[0][1], 1 / 62 + 1 / 61)
+    
+    def test_search_cosine(self):
+        """A busca ranqueia por similaridade de cosseno e cresce incrementalmente."""
+        index = VectorIndex(dim=3, initial_capacity=1)
+        index.add([10, 11], [[1, 0, 0], [0, 1, 0]])
+        index.add([12], [[1, 1, 0]])
+        index.add([13], [[1, 1]])  # dimensão diferente é ignorada
+        
+        self.assertEqual(len(index), 3)
+        results = index.search(np.array([2, 0.1, 0]), top_k=2)
+        self.assertEqual([chunk_id for chunk_id, _ in results], [10, 12])
+        self.assertAlmostEqual(results[0][1], 2 / np.linalg.norm([2, 0.1]), places=5)
+
+    def test_partitioned_search(self):
+        """Só as partições aceitas e os ids permitidos entram no ranking."""
+        index = PartitionedVectorIndex(dim=2)
+        index.add([1, 2], [[1, 0], [0.9, 0.1]], partition=('mistral', 'url'))
+        index.add([3], [[1, 0.05]], partition=('llama2', 'file'))
+        
+        self.assertEqual(len(index), 3)
+        query = np.array([1, 0])
+        self.assertEqual([chunk_id for chunk_id, _ in index.search(query, top_k=3)], [1, 3, 2])
+        results = index.search(query, top_k=3, partition_filter=lambda key: key[0] == 'llama2')
+        self.assertEqual([chunk_id for chunk_id, _ in results], [3])
+        results = index.search(query, top_k=3, allowed_ids=np.array([2, 3]))
+        self.assertEqual([chunk_id for chunk_id, _ in results], [3, 2])
+
+    def test_search_many_matches_search(self):
+        """A busca em lote devolve, para cada query, o mesmo ranking da busca individual."""
+        rng = np.random.default_rng(0)
+        index = PartitionedVectorIndex(dim=8)
+        index.add(list(range(50)), rng.normal(size=(50, 8)), partition='a')
+        index.add(list(range(50, 80)), rng.normal(size=(30, 8)), partition='b')
+        queries = rng.normal(size=(5, 8))
+        
+        batch = index.search_many(queries, top_k=4)
+        self.assertEqual(len(batch), 5)
+        for query, results in zip(queries, batch):
+            expected = index.search(query, top_k=4)
+            self.assertEqual([chunk_id for chunk_id, _ in results], [chunk_id for chunk_id, _ in expected])
+        
+        filtered = index.search_many(queries, top_k=4, partition_filter=lambda key: key == 'b')
+        self.assertTrue(all(chunk_id >= 50 for results in filtered for chunk_id, _ in results))
+
+    def test_sparse_rows_kept_sparse(self):
+        """Linhas CSR ficam em CSR no índice e ranqueiam como as densas equivalentes."""
+        rng = np.random.default_rng(1)
+        dense = rng.random((20, 1000)) * (rng.random((20, 1000)) < 0.01)
+        dense[:, 0] = 0.1  # nenhuma linha vazia
+        sparse_index = VectorIndex(dim=1000, initial_capacity=4)
+        sparse_index.add(list(range(10)), [csr_matrix(row) for row in dense[:10]])
+        sparse_index.add(list(range(10, 20)), csr_matrix(dense[10:]))
+        dense_index = VectorIndex(dim=1000, sparse=False)
+        dense_index.add(list(range(20)), dense)
+        
+        _, rows = sparse_index.rows()
+        self.assertTrue(issparse(rows))
+        self.assertEqual(rows.nnz, np.count_nonzero(dense))
+        query = dense[3] + dense[15]
+        found = sparse_index.search(query, top_k=5)
+        expected = dense_index.search(query, top_k=5)
+        self.assertEqual([chunk_id for chunk_id, _ in found], [chunk_id for chunk_id, _ in expected])
+        np.testing.assert_allclose([score for _, score in found], [score for _, score in expected], rtol=1e-5)
+
+class TestRetrievalCache(unittest.TestCase):
+    """Testes do cache LRU de recuperação."""
+    
+    def test_lru_and_generation(self):
+        """Entradas antigas são descartadas por LRU e por mudança de geração."""
+        cache = RetrievalCache(max_entries=2)
+        cache.put('a', 0, 1)
+        cache.put('b', 0, 2)
+        self.assertEqual(cache.get('a', 0), 1)
+        cache.put('c', 0, 3)  # 'b' é o menos usado
+        self.assertIsNone(cache.get('b', 0))
+        self.assertIsNone(cache.get('a', 1))  # corpus alterado
+        
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions'], stats['size']), (1, 2, 1, 1))
+
+class TestSemanticAnswerCache(unittest.TestCase):
+    """Testes do cache de respostas por similaridade de perguntas."""
+    
+    def test_similar_questions_share_answer(self):
+        """Perguntas parecidas no mesmo escopo e geração reaproveitam a resposta."""
+        cache = SemanticAnswerCache(max_entries=4, threshold=0.9)
+        cache.put('mistral', 0, np.array([1.0, 0.0, 0.0]), 'resposta X')
+        
+        answer, similarity = cache.get('mistral', 0, np.array([0.95, 0.1, 0.0]))
+        self.assertEqual(answer, 'resposta X')
+        self.assertGreater(similarity, 0.9)
+        self.assertIsNone(cache.get('mistral', 0, np.array([0.5, 0.5, 0.0])))  # abaixo do limiar
+        self.assertIsNone(cache.get('llama', 0, np.array([1.0, 0.0, 0.0])))  # outro escopo
+        self.assertIsNone(cache.get('mistral', 1, np.array([1.0, 0.0, 0.0])))  # corpus alterado
+        self.assertEqual(cache.stats()['size'], 0)
+    
+    def test_lru_eviction(self):
+        """As perguntas menos usadas saem quando o limite é atingido."""
+        cache = SemanticAnswerCache(max_entries=2, threshold=0.99)
+        cache.put('m', 0, np.array([1.0, 0.0]), 'a')
+        cache.put('m', 0, np.array([0.0, 1.0]), 'b')
+        self.assertEqual(cache.get('m', 0, np.array([1.0, 0.0]))[0], 'a')  # 'b' passa a ser a menos usada
+        cache.put('n', 0, np.array([1.0, 1.0]), 'c')
+        self.assertIsNone(cache.get('m', 0, np.array([0.0, 1.0])))
+        self.assertEqual(cache.get('n', 0, np.array([2.0, 2.0]))[0], 'c')
+        self.assertEqual((cache.stats()['evictions'], cache.stats()['size']), (1, 2))
+    
+    def test_guard_tokens_must_match(self):
+        """Números, nomes e letras isoladas precisam coincidir, na mesma ordem."""
+        self.assertNotEqual(question_guard('O Brasil é maior que a Argentina?'),
+                            question_guard('A Argentina é maior que o Brasil?'))
+        self.assertNotEqual(question_guard('Qual o prazo do produto A?'), question_guard('Qual o prazo do produto B?'))
+        self.assertEqual(question_guard('What is X?'), question_guard('Explain X'))
+        
+        cache = SemanticAnswerCache(max_entries=4, threshold=0.9)
+        cache.put('m', 0, np.array([1.0, 0.0]), 'copa de 2002', guard=question_guard('copa de 2002'))
+        self.assertIsNone(cache.get('m', 0, np.array([1.0, 0.0]), guard=question_guard('copa de 2006')))
+        self.assertEqual(cache.get('m', 0, np.array([1.0, 0.05]), guard=question_guard('a copa de 2002'))[0],
+                         'copa de 2002')
+
+class TestIVFIndex(unittest.TestCase):
+    """Testes do índice aproximado IVF."""
+    
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.vectors = rng.normal(size=(500, 16)).astype(np.float32)
+        self.ids = list(range(1, 501))
+        self.index = IVFIndex.train(self.vectors, n_lists=10, nprobe=2)
+        self.index.add(self.ids, self.vectors)
+    
+    def test_full_probe_matches_exact(self):
+        """Com nprobe igual ao número de partições a busca é exata."""
+        exact = VectorIndex(16)
+        exact.add(self.ids, self.vectors)
+        query = self.vectors[42]
+        
+        expected = [chunk_id for chunk_id, _ in exact.search(query, top_k=5)]
+        found = [chunk_id for chunk_id, _ in self.index.search(query, top_k=5, nprobe=10)]
+        self.assertEqual(found, expected)
+        self.assertEqual(self.index.search(query, top_k=1)[0][0], 43)
+    
+    def test_save_and_load(self):
+        """O índice salvo em disco é recarregado com as mesmas partições."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'index.ivf.npz')
+            self.index.save(path)
+            loaded = IVFIndex.load(path)
+        
+        self.assertEqual(len(loaded), 500)
+        self.assertEqual(loaded.max_id, 500)
+        query = self.vectors[7]
+        self.assertEqual(loaded.search(query, top_k=3), self.index.search(query, top_k=3))
+    
+    def test_sparse_vectors(self):
+        """Vetores CSR são treinados, indexados, salvos e recarregados sem densificar."""
+        rng = np.random.default_rng(2)
+        dense = rng.random((200, 2000)) * (rng.random((200, 2000)) < 0.01)
+        dense[:, 0] = 0.1
+        vectors = csr_matrix(dense, dtype=np.float32)
+        index = IVFIndex.train(vectors, n_lists=5, nprobe=5)
+        index.add(self.ids[:200], vectors)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'index.ivf.npz')
+            index.save(path)
+            loaded = IVFIndex.load(path)
+        
+        exact = VectorIndex(2000, sparse=False)
+        exact.add(self.ids[:200], dense)
+        query = dense[17]
+        expected = [chunk_id for chunk_id, _ in exact.search(query, top_k=5)]
+        self.assertEqual([chunk_id for chunk_id, _ in loaded.search(query, top_k=5)], expected)
+
+class TestCorpusStatistics(unittest.TestCase):
+    """Testes das estatísticas de frequência de documentos do corpus."""
+    
+    def test_updates_from_processes_are_merged(self):
+        """Atualizações de instâncias diferentes (outros processos) somam em vez de se sobrescrever."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'stats.npz')
+            first = CorpusStatistics(4, path)
+            second = CorpusStatistics(4, path)
+            first.update(csr_matrix([[1, 0, 0, 0], [1, 1, 0, 0]]))
+            second.update(csr_matrix([[0, 0, 1, 0]]))
+            first.update(csr_matrix([[0, 0, 0, 1]]))
+            
+            restarted = CorpusStatistics(4, path)
+            self.assertEqual(restarted.total_documents, 4)
+            self.assertEqual(restarted.document_frequency.tolist(), [2, 1, 1, 1])
+            # idf() reflete o que os outros processos gravaram
+            np.testing.assert_allclose(second.idf(), restarted.idf())
+
+class TestRelevantChunks(unittest.TestCase):
+    """Testes da recuperação de chunks por similaridade com a query."""
+    
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.original_db = database.DATABASE_FILE
+        database.DATABASE_FILE = os.path.join(self.tmpdir.name, 'data.db')
+        database._vector_index = None
+        database._retrieval_cache.clear()
+        database.ensure_database_exists()
+        os.environ['VECTORIZER_STATS_FILE'] = os.path.join(self.tmpdir.name, 'stats.npz')
+        self.url_processor = URLProcessor(chunk_size=60, overlap=10)
+    
+    def tearDown(self):
+        os.environ.pop('VECTORIZER_STATS_FILE', None)
+        database.DATABASE_FILE = self.original_db
+        database._vector_index = None
+        database._ann_index = None
+        self.tmpdir.cleanup()
+    
+    def test_ranks_by_query(self):
+        """Perguntas diferentes recuperam chunks diferentes."""
+        content = (
+            "Gatos são felinos domésticos que gostam de dormir. "
+            "Python é uma linguagem de programação muito popular. "
+            "O oceano Atlântico separa a América da Europa."
+        )
+        database.save_to_database(content, url_processor=self.url_processor)
+        
+        chunks = database.get_relevant_chunks("linguagem de programação python", top_k=1,
+                                              url_processor=self.url_processor)
+        self.assertEqual(len(chunks), 1)
+        self.assertIn("Python", chunks[0][0])
+        
+        chunks = database.get_relevant_chunks("oceano", top_k=1, url_processor=self.url_processor)
+        self.assertIn("oceano", chunks[0][0])
+    
+    def test_index_tracks_new_rows(self):
+        """Chunks salvos depois do carregamento do índice também são encontrados."""
+        database.save_to_database("texto inicial sobre bicicletas", url_processor=self.url_processor)
+        database.get_relevant_chunks("bicicletas", url_processor=self.url_processor)
+        loaded = len(database._vector_index)
+        
+        database.save_to_database("mais texto sobre bicicletas", url_processor=self.url_processor)
+        self.assertGreater(len(database._vector_index), loaded)
+    
+    def test_hashing_ingestion_stays_sparse(self):
+        """No modo hashing os chunks são vetorizados e gravados sem matriz densa chunks x n_features."""
+        content = " ".join(f"termo{i} comum" for i in range(6000))
+        tracemalloc.start()
+        try:
+            chunks_data = database.process_content(content, self.url_processor)
+            database.save_to_database(content, chunks_data=chunks_data, url_processor=self.url_processor)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        
+        self.assertGreater(len(chunks_data), 1500)
+        self.assertTrue(all(issparse(chunk['vector']) for chunk in chunks_data))
+        # Densa, só a matriz float32 dos vetores teria len(chunks_data) * 16384 * 4 bytes (> 98 MB)
+        self.assertLess(peak, 48 * 1024 * 1024)
+        
+        conn = sqlite3.connect(database.DATABASE_FILE)
+        rows = conn.execute("SELECT vector, vector_format FROM chunks ORDER BY id").fetchall()
+        conn.close()
+        self.assertEqual({vector_format for _, vector_format in rows}, {FORMAT_CSR_F32})
+        np.testing.assert_allclose(decode_vector(*rows[7]), chunks_data[7]['vector'].toarray().ravel())
+    
+    def test_uploads_share_vector_space(self):
+        """Documentos enviados separadamente são comparáveis entre si."""
+        database.save_to_database("receita de bolo de cenoura com chocolate", url_processor=self.url_processor)
+        database.save_to_database("manual de manutenção de bicicletas", url_processor=self.url_processor)
+        
+        # Um novo processador (ex.: após reiniciar) usa o mesmo espaço e as mesmas estatísticas
+        restarted = URLProcessor(chunk_size=60, overlap=10)
+        self.assertEqual(restarted.corpus_stats.total_documents, 2)
+        chunks = database.get_relevant_chunks("bolo de chocolate", top_k=2, url_processor=restarted)
+        self.assertIn("bolo", chunks[0][0])
+        self.assertEqual(len(chunks), 2)  # "de" aparece nos dois, com peso menor
+        self.assertGreater(chunks[0][1], chunks[1][1])
+    
+    def test_bm25_mode(self):
+        """A busca BM25 roda no FTS5 e respeita o top_k."""
+        database.save_to_database("Gatos são felinos domésticos.", url_processor=self.url_processor)
+        database.save_to_database("Cachorros são animais leais. Gatos também.", url_processor=self.url_processor)
+        database.save_to_database("Python é uma linguagem de programação.", url_processor=self.url_processor)
+        
+        chunks = database.get_relevant_chunks("felinos gatos", top_k=2, mode='bm25')
+        self.assertEqual(len(chunks), 2)
+        self.assertIn("felinos", chunks[0][0])
+        self.assertGreater(chunks[0][1], chunks[1][1])
+        
+        # Acentos são ignorados pelo tokenizador
+        chunks = database.get_relevant_chunks("programacao", top_k=3, mode='bm25')
+        self.assertEqual(len(chunks), 1)
+        self.assertEqual(database.get_relevant_chunks("?!", mode='bm25'), [])
+    
+    def test_lexical_modes_without_fts(self):
+        """Sem o índice full-text, 'bm25' e 'hybrid' usam a busca vetorial em vez de falhar."""
+        database.save_to_database("Gatos são felinos domésticos.", url_processor=self.url_processor)
+        with database.create_connection(database.DATABASE_FILE) as conn:
+            for trigger in ('insert', 'delete', 'update'):
+                conn.execute(f"DROP TRIGGER chunks_fts_{trigger}")
+            conn.execute("DROP TABLE chunks_fts")
+        database._fts_available.clear()
+        
+        for mode in ('bm25', 'hybrid'):
+            chunks = database.get_relevant_chunks("felinos", url_processor=self.url_processor, mode=mode)
+            self.assertIn("felinos", chunks[0][0])
+        self.assertFalse(database.fts_available())
+    
+    def test_ann_mode(self):
+        """O modo 'ann' constrói o índice IVF ao lado do banco e o mantém atualizado."""
+        database.save_to_database("Gatos são felinos domésticos.", url_processor=self.url_processor)
+        chunks = database.get_relevant_chunks("felinos", url_processor=self.url_processor, mode='ann')
+        self.assertIn("felinos", chunks[0][0])
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir.name, 'data.ivf.npz')))
+        
+        database.save_to_database("Python é uma linguagem de programação.", url_processor=self.url_processor)
+        database._ann_index = None  # simula reinício: recarrega do disco e adiciona o que falta
+        chunks = database.get_relevant_chunks("linguagem python", url_processor=self.url_processor, mode='ann')
+        self.assertIn("Python", chunks[0][0])
+    
+    def test_ann_index_built_once(self):
+        """Primeiras consultas simultâneas no modo 'ann' treinam o índice IVF uma única vez."""
+        database.save_to_database("Gatos são felinos domésticos.", url_processor=self.url_processor)
+        build = database.build_ann_index
+        calls = []
+        
+        def slow_build(dim):
+            calls.append(dim)
+            time.sleep(0.2)
+            return build(dim)
+        
+        results = []
+        database.build_ann_index = slow_build
+        try:
+            threads = [threading.Thread(target=lambda: results.append(
+                database.get_ann_index(self.url_processor.n_features))) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            database.build_ann_index = build
+        
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 4)
+        self.assertTrue(all(index is results[0] for index in results))
+    
+    def test_ann_mode_reconciles_with_database(self):
+        """Ao recarregar, o índice IVF recebe chunks de ids menores que os já indexados e perde os apagados."""
+        for text in ("Gatos são felinos domésticos.", "Leões são felinos selvagens.", "Tigres são felinos listrados."):
+            database.save_to_database(text, url_processor=self.url_processor)
+        dim = self.url_processor.n_features
+        index = database.get_ann_index(dim)
+        # Chunk 2 gravado no banco, mas ainda não no índice salvo (ex.: commit fora de ordem de outro processo)
+        index.remove([2])
+        index.save(database.ann_index_path())
+        database._ann_index = None
+        self.assertEqual(sorted(database.get_ann_index(dim).ids().tolist()), [1, 2, 3])
+        
+        self.assertTrue(database.delete_document(1))
+        chunks = database.get_relevant_chunks("felinos", top_k=3, url_processor=self.url_processor, mode='ann')
+        self.assertEqual(len(chunks), 2)
+        self.assertNotIn("Gatos são felinos domésticos.", [chunk[0] for chunk in chunks])
+        self.assertEqual(sorted(database.get_ann_index(dim).ids().tolist()), [2, 3])
+    
+    def test_hybrid_mode(self):
+        """O modo híbrido combina os dois retrievers e reporta o tempo de cada etapa."""
+        database.save_to_database("Gatos são felinos domésticos.", url_processor=self.url_processor)
+        database.save_to_database("Python é uma linguagem de programação.", url_processor=self.url_processor)
+        
+        timings = {}
+        chunks = database.get_relevant_chunks("felinos", top_k=1, url_processor=self.url_processor,
+                                              mode='hybrid', timings=timings)
+        self.assertEqual(len(chunks), 1)
+        self.assertIn("felinos", chunks[0][0])
+        for stage in ('lexical_ms', 'vector_ms', 'fusion_ms', 'fetch_ms', 'total_ms'):
+            self.assertIn(stage, timings)
+    
+    def test_cached_until_corpus_changes(self):
+        """Perguntas repetidas vêm do cache até uma ingestão ou remoção."""
+        database.save_to_database("Gatos são felinos domésticos.", url_processor=self.url_processor)
+        first = database.get_relevant_chunks("Felinos?", url_processor=self.url_processor)
+        
+        timings = {}
+        self.assertEqual(database.get_relevant_chunks("  felinos? ", url_processor=self.url_processor,
+                                                      timings=timings), first)
+        self.assertIn('cache_ms', timings)
+        hits = database.get_retrieval_cache_stats()['hits']
+        
+        database.save_to_database("Leões também são felinos.", url_processor=self.url_processor)
+        second = database.get_relevant_chunks("felinos?", url_processor=self.url_processor)
+        self.assertEqual(database.get_retrieval_cache_stats()['hits'], hits)
+        self.assertEqual(len(second), 2)
+        
+        self.assertTrue(database.delete_document(1))
+        third = database.get_relevant_chunks("felinos?", url_processor=self.url_processor)
+        self.assertEqual([chunk[0] for chunk in third], ["Leões também são felinos."])
+    
+    def test_generation_shared_between_processes(self):
+        """Uma ingestão feita por outro processo invalida o cache e o índice deste."""
+        database.save_to_database("texto inicial sobre bicicletas", url_processor=self.url_processor)
+        self.assertEqual(len(database.get_relevant_chunks("bicicletas", url_processor=self.url_processor)), 1)
+        generation = database.get_corpus_generation()
+        
+        env = dict(os.environ, DATABASE_FILE=database.DATABASE_FILE)
+        subprocess.run([sys.executable, '-c', (
+            "import database; from url_processor import URLProcessor; "
+            "database.save_to_database('mais texto sobre bicicletas', "
+            "url_processor=URLProcessor(chunk_size=60, overlap=10))"
+        )], cwd=str(Path(__file__).parent.parent), env=env, check=True, capture_output=True)
+        
+        self.assertEqual(database.get_corpus_generation(), generation + 1)
+        self.assertEqual(len(database.get_relevant_chunks("bicicletas", url_processor=self.url_processor)), 2)
+
+    def test_metadata_filters(self):
+        """Filtros de metadados restringem todos os modos antes do ranking."""
+        database.save_to_database("Gatos são felinos domésticos.", model_name='mistral',
+                                  source_type='url', source_path='https://exemplo.com/gatos',
+                                  url_processor=self.url_processor)
+        database.save_to_database("Leões são felinos selvagens.", model_name='llama2',
+                                  source_type='file', source_path='leoes.txt',
+                                  url_processor=self.url_processor)
+        
+        for mode in ('vector', 'bm25', 'ann', 'hybrid'):
+            chunks = database.get_relevant_chunks("felinos", url_processor=self.url_processor, mode=mode,
+                                                  filters={'model_name': 'llama2'})
+            self.assertEqual([chunk[0] for chunk in chunks], ["Leões são felinos selvagens."], mode)
+        
+        chunks = database.get_relevant_chunks("felinos", url_processor=self.url_processor,
+                                              filters={'source_path_prefix': 'https://exemplo.com/'})
+        self.assertEqual([chunk[0] for chunk in chunks], ["Gatos são felinos domésticos."])
+        chunks = database.get_relevant_chunks("felinos", url_processor=self.url_processor,
+                                              filters={'created_before': '2000-01-01'})
+        self.assertEqual(chunks, [])
+        
+        for filters in ({'autor': 'x'}, ['model_name'], "model_name", {'model_name': 5},
+                        {'source_type': [['url']]}, {'created_after': 2000}):
+            with self.assertRaises(ValueError):
+                database.get_relevant_chunks("felinos", filters=filters)
+            with self.assertRaises(ValueError):
+                database.get_relevant_chunks_batch(["felinos"], filters=filters)
+
+    def test_batch_retrieval(self):
+        """A recuperação em lote equivale a consultas individuais, na ordem de entrada."""
+        database.save_to_database("Gatos são felinos domésticos.", url_processor=self.url_processor)
+        database.save_to_database("Python é uma linguagem de programação.", url_processor=self.url_processor)
+        questions = ["linguagem python", "felinos", "gatos domésticos"]
+        
+        batch = database.get_relevant_chunks_batch(questions, top_k=1, url_processor=self.url_processor)
+        self.assertEqual([chunks[0][0] for chunks in batch],
+                         ["Python é uma linguagem de programação.", "Gatos são felinos domésticos.",
+                          "Gatos são felinos domésticos."])
+        database._retrieval_cache.clear()
+        for question, chunks in zip(questions, batch):
+            self.assertEqual(database.get_relevant_chunks(question, top_k=1, url_processor=self.url_processor),
+                             chunks)
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
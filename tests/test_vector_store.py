@@ -0,0 +1,190 @@
+import unittest
+import os
+import sys
+import json
+import sqlite3
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+# Adiciona o diretório raiz ao PYTHONPATH
+sys.path.append(str(Path(__file__).parent.parent))
+
+import database
+from url_processor import URLProcessor
+from vector_store import (
+    FORMAT_CSR_F32, FORMAT_DENSE_F16, FORMAT_DENSE_F32,
+    MemmapVectorStore, encode_vector, decode_vector, vector_dimension
+)
+
+class TestVectorCodec(unittest.TestCase):
+    """Testes da serialização binária dos vetores."""
+    
+    def test_sparse_roundtrip(self):
+        """Vetores esparsos usam CSR e ocupam uma fração do JSON."""
+        vector = np.zeros(16384, dtype=np.float32)
+        vector[[3, 100, 9000]] = [0.5, 0.25, 0.125]
+        
+        blob, vector_format = encode_vector(vector)
+        self.assertEqual(vector_format, FORMAT_CSR_F32)
+        self.assertLess(len(blob) * 100, len(json.dumps(vector.tolist())))
+        self.assertEqual(vector_dimension(blob, vector_format), 16384)
+        np.testing.assert_array_equal(decode_vector(blob, vector_format), vector)
+    
+    def test_sparse_row_encoded_directly(self):
+        """Uma linha CSR gera o mesmo blob que o vetor denso equivalente."""
+        vector = np.zeros(16384, dtype=np.float32)
+        vector[[3, 100, 9000]] = [0.5, 0.25, 0.125]
+        self.assertEqual(encode_vector(csr_matrix(vector)), encode_vector(vector))
+        self.assertEqual(encode_vector(csr_matrix(vector), FORMAT_DENSE_F32), encode_vector(vector, FORMAT_DENSE_F32))
+    
+    def test_dense_roundtrip(self):
+        """Embeddings densos usam bytes float32 ou float16."""
+        vector = np.random.default_rng(0).normal(size=768).astype(np.float32)
+        
+        blob, vector_format = encode_vector(vector)
+        self.assertEqual(vector_format, FORMAT_DENSE_F32)
+        np.testing.assert_array_equal(decode_vector(blob, vector_format), vector)
+        
+        blob, vector_format = encode_vector(vector, FORMAT_DENSE_F16)
+        self.assertEqual(len(blob), 768 * 2)
+        np.testing.assert_allclose(decode_vector(blob, vector_format), vector, rtol=1e-2, atol=1e-3)
+
+class TestVectorMigration(unittest.TestCase):
+    """Testes da migração de vetores JSON existentes."""
+    
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.original_db = database.DATABASE_FILE
+        database.DATABASE_FILE = os.path.join(self.tmpdir.name, 'data.db')
+        os.environ['VECTORIZER_STATS_FILE'] = os.path.join(self.tmpdir.name, 'stats.npz')
+        database._vector_index = None
+        database._retrieval_cache.clear()
+    
+    def tearDown(self):
+        os.environ.pop('VECTORIZER_STATS_FILE', None)
+        database.DATABASE_FILE = self.original_db
+        database._vector_index = None
+        self.tmpdir.cleanup()
+    
+    def test_json_rows_are_converted(self):
+        """ensure_database_exists revetoriza no espaço atual os chunks com vetores JSON de bancos antigos."""
+        conn = sqlite3.connect(database.DATABASE_FILE)
+        with conn:
+            conn.execute("""
+                CREATE TABLE documents (id INTEGER PRIMARY KEY, content TEXT, model_name TEXT,
+                    source_type TEXT, source_path TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)
+            """)
+            conn.execute("""
+                CREATE TABLE chunks (id INTEGER PRIMARY KEY, document_id INTEGER, content TEXT,
+                    chunk_index INTEGER, relevance_score REAL, vector TEXT, chunk_size INTEGER, overlap INTEGER)
+            """)
+            conn.execute("INSERT INTO documents (id, content, model_name) VALUES (1, 'doc', 'mistral')")
+            # Vetor TF-IDF do vocabulário do próprio documento (dimensão 5)
+            conn.execute(
+                "INSERT INTO chunks (document_id, content, chunk_index, relevance_score, vector, chunk_size, overlap) "
+                "VALUES (1, 'receita de bolo de cenoura', 0, 1.0, ?, 1000, 100)",
+                (json.dumps([0.0, 0.0, 0.6, 0.0, 0.8]),)
+            )
+        conn.close()
+        
+        database.ensure_database_exists()
+        
+        conn = sqlite3.connect(database.DATABASE_FILE)
+        blob, vector_format = conn.execute("SELECT vector, vector_format FROM chunks").fetchone()
+        conn.close()
+        url_processor = URLProcessor()
+        self.assertEqual(vector_format, FORMAT_CSR_F32)
+        self.assertEqual(vector_dimension(blob, vector_format), url_processor.n_features)
+        self.assertEqual(url_processor.corpus_stats.total_documents, 1)
+        chunks = database.get_relevant_chunks("bolo de cenoura", top_k=1, url_processor=url_processor, mode='vector')
+        self.assertEqual(chunks[0][0], 'receita de bolo de cenoura')
+
+class TestMemmapVectorStore(unittest.TestCase):
+    """Testes do store de vetores memory-mapped."""
+    
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'data.vectors')
+    
+    def tearDown(self):
+        self.tmpdir.cleanup()
+    
+    def test_appends_visible_to_other_readers(self):
+        """Linhas gravadas por um "worker" aparecem para outro sem recarga."""
+        writer = MemmapVectorStore(self.path, dim=3)
+        reader = MemmapVectorStore(self.path, dim=3)
+        self.assertEqual(len(reader), 0)
+        self.assertEqual(reader.search([1, 0, 0]), [])
+        
+        writer.add([1, 2], [[1, 0, 0], [0, 1, 0]])
+        self.assertEqual(reader.search([1, 0.1, 0], top_k=1)[0][0], 1)
+        
+        writer.add([3], [[0, 0, 5]])
+        self.assertEqual(reader.search([0, 0, 1], top_k=1), [(3, 1.0)])
+        np.testing.assert_allclose(reader.vector(3), [0, 0, 1])
+        self.assertEqual(reader.max_id, 3)
+    
+    def test_duplicate_ids_ignored(self):
+        """Ids já gravados (ex.: dois workers sincronizando) não são duplicados."""
+        store = MemmapVectorStore(self.path, dim=2)
+        self.assertEqual(store.add([1, 2], [[1, 0], [0, 1]]), 2)
+        self.assertEqual(store.add([2, 3], [[0, 1], [1, 1]]), 1)
+        self.assertEqual(len(MemmapVectorStore(self.path, dim=2)), 3)
+    
+    def test_removed_rows_hidden(self):
+        """Linhas removidas somem das buscas de todos os leitores e o id pode ser gravado de novo."""
+        writer = MemmapVectorStore(self.path, dim=2)
+        reader = MemmapVectorStore(self.path, dim=2)
+        writer.add([1, 2, 3], [[1, 0], [1, 0.1], [0.3, 1]])
+        self.assertEqual(writer.remove([2, 7]), 1)
+        
+        self.assertEqual([chunk_id for chunk_id, _ in reader.search([1, 0], top_k=3)], [1, 3])
+        self.assertEqual([chunk_id for chunk_id, _ in reader.search_many(np.array([[1, 0]]), top_k=3)[0]], [1, 3])
+        self.assertIsNone(reader.vector(2))
+        self.assertEqual(len(reader), 2)
+        
+        self.assertEqual(writer.add([2], [[1, 0.2]]), 1)
+        self.assertEqual(reader.search([1, 0.2], top_k=1)[0][0], 2)
+        self.assertEqual(sorted(MemmapVectorStore(self.path, dim=2).stored_ids().tolist()), [1, 2, 3])
+    
+    def test_database_memmap_mode(self):
+        """Com VECTOR_STORE='memmap' a busca exata usa o arquivo compartilhado."""
+        original = (database.DATABASE_FILE, database.VECTOR_STORE)
+        database.DATABASE_FILE = os.path.join(self.tmpdir.name, 'data.db')
+        database.VECTOR_STORE = 'memmap'
+        database._vector_index = None
+        os.environ['VECTORIZER_STATS_FILE'] = os.path.join(self.tmpdir.name, 'stats.npz')
+        try:
+            database.ensure_database_exists()
+            processor = URLProcessor(chunk_size=60, overlap=10)
+            database.save_to_database("Gatos são felinos domésticos.", url_processor=processor)
+            
+            # Outro worker abre o store sem carregar vetores do SQLite
+            other_worker = MemmapVectorStore(database.vector_store_path(), processor.n_features)
+            self.assertEqual(len(other_worker), 1)
+            
+            database.save_to_database("Python é uma linguagem.", url_processor=processor)
+            self.assertEqual(other_worker.refresh(), 1)
+            chunks = database.get_relevant_chunks("python", url_processor=processor, mode='vector')
+            self.assertIn("Python", chunks[0][0])
+            
+            # Um chunk de id menor que o maior do store (commit fora de ordem) entra ao abrir o store
+            other_worker.remove([1])
+            database._vector_index = None
+            self.assertEqual(sorted(database.get_vector_index(processor.n_features).stored_ids().tolist()), [1, 2])
+            
+            # Chunks apagados deixam de aparecer também para quem já tinha o store aberto
+            self.assertTrue(database.delete_document(1))
+            chunks = database.get_relevant_chunks("felinos python", top_k=2, url_processor=processor, mode='vector')
+            self.assertEqual([chunk[0] for chunk in chunks], ["Python é uma linguagem."])
+            self.assertEqual(other_worker.stored_ids().tolist(), [2])
+        finally:
+            database.DATABASE_FILE, database.VECTOR_STORE = original
+            database._vector_index = None
+            os.environ.pop('VECTORIZER_STATS_FILE', None)
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
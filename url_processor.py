@@ -1,6 +1,5 @@
-import requests
 from bs4 import BeautifulSoup
-from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.feature_extraction.text import TfidfVectorizer, HashingVectorizer
 import numpy as np
 from typing import List, Dict, Optional, Any, Union, Tuple
 import re
@@ -8,8 +7,15 @@ from tqdm import tqdm
 import logging
 import time
 import os
+import threading
 from dotenv import load_dotenv
-from scipy.sparse import spmatrix, csr_matrix
+from scipy.sparse import spmatrix, csr_matrix, issparse
+from sklearn.exceptions import NotFittedError
+
+from http_client import get_http_client
+from retrieval import top_k_indices
+from vector_store import file_lock
+from vectorizer import OllamaEmbedder
 
 # Carrega variáveis de ambiente
 load_dotenv()
@@ -39,15 +45,113 @@ def init_gpu():
 # Inicializa o suporte à GPU
 init_gpu()
 
+VECTORIZER_MODES = ('hashing', 'tfidf', 'ollama')
+
+class CorpusStatistics:
+    """
+    Frequência de documentos por feature do HashingVectorizer.
+    
+    Atualizada incrementalmente a cada ingestão e persistida em disco, permite
+    ponderar a query por IDF sem reajustar nem revetorizar chunks antigos.
+    
+    Vários processos podem compartilhar o mesmo arquivo: cada update relê o
+    arquivo sob lock, soma só as frequências dos chunks novos e grava de
+    volta, e idf() recarrega o arquivo quando outro processo o alterou.
+    """
+    
+    def __init__(self, n_features: int, path: Optional[str] = None):
+        self.n_features = n_features
+        self.path = path
+        self.document_frequency = np.zeros(n_features, dtype=np.float64)
+        self.total_documents = 0
+        self._lock = threading.Lock()
+        self._loaded_mtime: Optional[int] = None
+        self.load()
+    
+    def _file_mtime(self) -> Optional[int]:
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except (OSError, TypeError):
+            return None
+    
+    def load(self):
+        """Carrega as estatísticas do disco, se existirem e forem compatíveis."""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            mtime = self._file_mtime()
+            with np.load(self.path) as stats:
+                document_frequency = stats['document_frequency']
+                if document_frequency.shape[0] != self.n_features:
+                    logger.warning(f"Estatísticas em {self.path} têm dimensão diferente; ignorando")
+                    return
+                self.document_frequency = document_frequency.astype(np.float64)
+                self.total_documents = int(stats['total_documents'])
+            self._loaded_mtime = mtime
+            logger.info(f"Estatísticas do corpus carregadas: {self.total_documents} chunks")
+        except Exception as e:
+            logger.warning(f"Erro ao carregar estatísticas do corpus: {str(e)}")
+    
+    def _reload_if_changed(self):
+        """Recarrega o arquivo se outro processo o gravou desde a última leitura."""
+        mtime = self._file_mtime()
+        if mtime is not None and mtime != self._loaded_mtime:
+            self.load()
+    
+    def save(self):
+        """Persiste as estatísticas (escrita atômica via arquivo temporário)."""
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, document_frequency=self.document_frequency,
+                 total_documents=np.array(self.total_documents))
+        os.replace(tmp_path, self.path)
+        self._loaded_mtime = self._file_mtime()
+    
+    def update(self, vectors: spmatrix):
+        """
+        Soma a frequência de documentos dos novos chunks. Custo O(chunks novos)
+        mais uma releitura do arquivo, se outro processo o alterou.
+        """
+        presence = csr_matrix(vectors, copy=True)
+        presence.data[:] = 1
+        delta = np.asarray(presence.sum(axis=0)).ravel()
+        with self._lock:
+            if not self.path:
+                self.document_frequency += delta
+                self.total_documents += presence.shape[0]
+                return
+            with file_lock(f"{self.path}.lock"):
+                self._reload_if_changed()
+                self.document_frequency += delta
+                self.total_documents += presence.shape[0]
+                self.save()
+    
+    def idf(self) -> np.ndarray:
+        """IDF suavizado, no mesmo formato do TfidfVectorizer."""
+        with self._lock:
+            if self.path:
+                self._reload_if_changed()
+            return np.log((1 + self.total_documents) / (1 + self.document_frequency)) + 1
+
 class URLProcessor:
-    def __init__(self, chunk_size: Optional[int] = None, overlap: Optional[int] = None):
+    def __init__(self, chunk_size: Optional[int] = None, overlap: Optional[int] = None,
+                 vectorizer_mode: Optional[str] = None, embedder: Optional[OllamaEmbedder] = None):
         """
         Inicializa o processador de URLs.
         
         Args:
             chunk_size: Tamanho máximo de cada chunk em caracteres
             overlap: Quantidade de caracteres de sobreposição entre chunks
+            vectorizer_mode: 'hashing' (espaço vetorial fixo para todo o corpus),
+                'tfidf' (vocabulário reajustado a cada upload) ou 'ollama'
+                (embeddings densos gerados pelo Ollama)
+            embedder: OllamaEmbedder usado no modo 'ollama' (padrão: configurado pelo .env)
         """
+        self.vectorizer_mode = vectorizer_mode or os.getenv('VECTORIZER_MODE', 'hashing')
+        if self.vectorizer_mode not in VECTORIZER_MODES:
+            raise ValueError(f"Modo de vetorização inválido: {self.vectorizer_mode}")
+        
         try:
             # Tenta carregar do .env ou usa valores padrão
             env_chunk_size = os.getenv('CHUNK_SIZE')
@@ -55,28 +159,52 @@ class URLProcessor:
             
             self.chunk_size = chunk_size or (int(env_chunk_size) if env_chunk_size else 1000)
             self.overlap = overlap or (int(env_overlap) if env_overlap else 100)
-            self.vectorizer = TfidfVectorizer()
+            self.n_features = int(os.getenv('HASHING_N_FEATURES', 2 ** 14))
             self.use_gpu = os.getenv('USE_GPU', 'false').lower() == 'true'
             
             logger.info(f"Inicializando URLProcessor com configurações:")
             logger.info(f"- chunk_size: {self.chunk_size}")
             logger.info(f"- overlap: {self.overlap}")
+            logger.info(f"- vectorizer_mode: {self.vectorizer_mode}")
             logger.info(f"- use_gpu: {self.use_gpu}")
         except ValueError as e:
             logger.warning(f"Erro ao carregar configurações do .env: {str(e)}")
             logger.info("Usando valores padrão")
             self.chunk_size = chunk_size or 1000
             self.overlap = overlap or 100
-            self.vectorizer = TfidfVectorizer()
+            self.n_features = 2 ** 14
             self.use_gpu = False
         
+        self.corpus_stats: Optional[CorpusStatistics] = None
+        self.embedder: Optional[OllamaEmbedder] = None
+        if self.vectorizer_mode == 'ollama':
+            self.embedder = embedder or OllamaEmbedder()
+            self.vectorizer = None
+        elif self.vectorizer_mode == 'hashing':
+            # Stateless: o mesmo texto sempre gera o mesmo vetor, em qualquer upload
+            self.vectorizer = HashingVectorizer(n_features=self.n_features, alternate_sign=False, norm='l2')
+            self.corpus_stats = CorpusStatistics(
+                self.n_features, os.getenv('VECTORIZER_STATS_FILE', 'vectorizer_stats.npz')
+            )
+        else:
+            self.vectorizer = TfidfVectorizer()
+        
+    @property
+    def vector_space(self) -> str:
+        """Identifica o espaço vetorial do processador (vetores de espaços diferentes não são comparáveis)."""
+        if self.embedder is not None:
+            return f"ollama:{self.embedder.model}"
+        if self.vectorizer_mode == 'hashing':
+            return f"hashing:{self.n_features}"
+        return self.vectorizer_mode
+
     def extract_content_from_url(self, url: str) -> str:
         """Extrai o conteúdo textual de uma URL."""
         try:
             logger.info(f"Extraindo conteúdo da URL: {url}")
             start_time = time.time()
             
-            response = requests.get(url)
+            response = get_http_client().get(url)
             response.raise_for_status()
             
             soup = BeautifulSoup(response.text, 'html.parser')
@@ -172,9 +300,14 @@ class URLProcessor:
             return sparse_matrix
         return np.array(sparse_matrix)
 
-    def vectorize_chunks(self, chunks: List[str]) -> Tuple[np.ndarray, List[float]]:
+    def vectorize_chunks(self, chunks: List[str]) -> Tuple[Union[np.ndarray, csr_matrix], List[float]]:
         """
         Vetoriza os chunks e calcula scores de relevância usando GPU se disponível.
+        
+        No modo 'hashing' os vetores vêm como matriz CSR float32 (uma linha por
+        chunk), que segue esparsa até a gravação no banco: memória O(tamanho do
+        documento), e não chunks x n_features. Nos modos 'tfidf' e 'ollama' a
+        matriz é densa.
         """
         if not chunks:
             return np.array([]), []
@@ -185,14 +318,17 @@ class URLProcessor:
         # Vetoriza os chunks
         with tqdm(total=len(chunks), desc="Vetorizando chunks", unit='chunk') as pbar:
             # Vetorização inicial
-            vectors = self.vectorizer.fit_transform(chunks)
-            dense_vectors = self.sparse_to_dense(vectors)
+            vectors = self._transform_chunks(chunks)
+            if self.corpus_stats is not None:
+                vectors = csr_matrix(vectors, dtype=np.float32)
+            else:
+                vectors = self.sparse_to_dense(vectors)
             pbar.update(len(chunks) // 3)
             
-            if self.use_gpu and cp is not None:
+            if self.use_gpu and cp is not None and not issparse(vectors):
                 try:
                     # Transfere para GPU
-                    vectors_gpu = cp.array(dense_vectors)
+                    vectors_gpu = cp.array(vectors)
                     logger.info("Dados transferidos para GPU")
                     pbar.update(len(chunks) // 3)
                     
@@ -229,7 +365,79 @@ class URLProcessor:
         logger.info(f"Vetorização concluída em {processing_time:.2f} segundos")
         logger.info(f"Usando {'GPU' if self.use_gpu else 'CPU'} para processamento")
         
-        return dense_vectors, scores
+        return vectors, scores
+
+    def _transform_chunks(self, chunks: List[str]) -> spmatrix:
+        """
+        Vetoriza chunks novos.
+        
+        No modo 'hashing' não há ajuste: apenas as estatísticas do corpus são
+        atualizadas, em O(tamanho do documento). No modo 'tfidf' o vocabulário
+        é reajustado aos chunks recebidos. No modo 'ollama' os embeddings vêm
+        do Ollama (ou do cache em disco).
+        """
+        if self.embedder is not None:
+            return self.embedder.embed(chunks)
+        if self.corpus_stats is None:
+            return self.vectorizer.fit_transform(chunks)
+        
+        vectors = self.vectorizer.transform(chunks)
+        self.corpus_stats.update(vectors)
+        return vectors
+
+    def vectorize_texts(self, texts: List[str]) -> Optional[np.ndarray]:
+        """
+        Vetoriza textos já ingeridos (ex.: chunks recuperados) sem alterar o
+        vetorizador nem as estatísticas do corpus.
+        
+        Returns:
+            Matriz densa (len(texts), dim), ou None se não for possível vetorizar
+        """
+        try:
+            if self.embedder is not None:
+                return self.embedder.embed(texts)
+            return self.sparse_to_dense(self.vectorizer.transform(texts))
+        except Exception as e:
+            logger.warning(f"Não foi possível vetorizar os textos: {str(e)}")
+            return None
+
+    def vectorize_query(self, query: str) -> Optional[np.ndarray]:
+        """
+        Vetoriza uma query no mesmo espaço dos chunks.
+        
+        No modo 'hashing' a query é ponderada pelo IDF do corpus, de forma que
+        termos raros pesem mais no cosseno sem alterar os vetores armazenados.
+
+        Returns:
+            Vetor denso 1D, ou None se o vetorizador ainda não foi ajustado
+        """
+        query_matrix = self.vectorize_queries([query])
+        return None if query_matrix is None else query_matrix[0]
+
+    def vectorize_queries(self, queries: List[str]) -> Optional[np.ndarray]:
+        """
+        Vetoriza várias queries em uma única chamada ao vetorizador (ou ao
+        servidor de embeddings), com a mesma ponderação de vectorize_query.
+
+        Returns:
+            Matriz densa (len(queries), dim), ou None se o vetorizador ainda
+            não foi ajustado
+        """
+        if self.embedder is not None:
+            try:
+                return self.embedder.embed(queries)
+            except Exception as e:
+                logger.warning(f"Erro ao gerar embedding da query: {str(e)}")
+                return None
+        try:
+            query_vectors = self.vectorizer.transform(queries)
+        except NotFittedError:
+            logger.warning("Vetorizador ainda não ajustado; não é possível vetorizar a query")
+            return None
+        query_dense = self.sparse_to_dense(query_vectors)
+        if self.corpus_stats is not None:
+            query_dense = query_dense * self.corpus_stats.idf()
+        return query_dense
 
     def process_url(self, url: str) -> Dict:
         """Processa uma URL completa: extrai, chunka e vetoriza o conteúdo."""
@@ -277,20 +485,22 @@ class URLProcessor:
         
         return result
 
-    def find_most_relevant_chunks(self, query: str, chunks: List[str], vectors: np.ndarray, 
+    def find_most_relevant_chunks(self, query: str, chunks: List[str], vectors: Union[np.ndarray, spmatrix],
                                 top_k: int = 3) -> List[Tuple[str, float]]:
-        """Encontra os chunks mais relevantes para uma query."""
-        if not chunks or vectors.size == 0:
+        """Encontra os chunks mais relevantes para uma query (vetores densos ou CSR)."""
+        if not chunks or vectors.shape[0] == 0:
             return []
             
         logger.info("Buscando chunks relevantes")
         start_time = time.time()
         
         # Vetoriza a query
-        query_vector = self.vectorizer.transform([query])
-        query_dense = self.sparse_to_dense(query_vector)
+        query_1d = self.vectorize_query(query)
+        if query_1d is None:
+            return []
+        query_dense = query_1d.reshape(1, -1)
         
-        if self.use_gpu and cp is not None:
+        if self.use_gpu and cp is not None and not issparse(vectors):
             try:
                 # Transfere para GPU
                 vectors_gpu = cp.array(vectors)
@@ -303,17 +513,17 @@ class URLProcessor:
                 logger.info("Similaridades calculadas na GPU")
             except Exception as e:
                 logger.warning(f"Erro ao usar GPU: {str(e)}. Usando CPU.")
-                similarities_cpu = np.dot(vectors, query_dense.T).flatten()
+                similarities_cpu = np.asarray(vectors @ query_dense.T).ravel()
         else:
             # Calcula similaridade na CPU
-            similarities_cpu = np.dot(vectors, query_dense.T).flatten()
+            similarities_cpu = np.asarray(vectors @ query_dense.T).ravel()
             logger.info("Similaridades calculadas na CPU")
         
         # Encontra os chunks mais relevantes
-        top_indices = similarities_cpu.argsort()[-top_k:][::-1]
+        top_indices = top_k_indices(similarities_cpu, top_k)
         
         processing_time = time.time() - start_time
         logger.info(f"Busca concluída em {processing_time:.2f} segundos")
-        logger.info(f"Encontrados {top_k} chunks mais relevantes")
+        logger.info(f"Encontrados {len(top_indices)} chunks mais relevantes")
         
         return [(chunks[i], float(similarities_cpu[i])) for i in top_indices]
@@ -0,0 +1,342 @@
+import json
+import logging
+import os
+import struct
+import threading
+from contextlib import contextmanager
+from typing import List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from scipy.sparse import csr_matrix, issparse
+
+from retrieval import (
+    normalize_queries, normalize_rows, ranked_lists, top_k_indices, top_k_indices_batch, vector_length
+)
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem lock entre processos
+    fcntl = None
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Formatos de serialização dos vetores na coluna chunks.vector
+FORMAT_JSON = 'json'            # legado: lista densa serializada como texto JSON
+FORMAT_CSR_F32 = 'csr-f32'      # esparso: dim, nnz, índices uint32 e valores float32
+FORMAT_DENSE_F32 = 'dense-f32'  # denso: bytes float32 (embeddings)
+FORMAT_DENSE_F16 = 'dense-f16'  # denso: bytes float16 (embeddings, metade do espaço)
+
+VECTOR_FORMATS = (FORMAT_JSON, FORMAT_CSR_F32, FORMAT_DENSE_F32, FORMAT_DENSE_F16)
+
+_CSR_HEADER = struct.Struct('<II')
+
+# Acima desta densidade o formato denso ocupa menos que o esparso
+_DENSE_THRESHOLD = 0.5
+
+
+@contextmanager
+def file_lock(lock_path: str):
+    """Lock exclusivo entre processos sobre lock_path (quando o SO oferece flock)."""
+    if fcntl is None:
+        yield
+        return
+    with open(lock_path, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def encode_vector(vector: Union[np.ndarray, Sequence[float], csr_matrix],
+                  vector_format: Optional[str] = None) -> Tuple[bytes, str]:
+    """
+    Serializa um vetor em bytes compactos.
+
+    Args:
+        vector: Vetor denso (array NumPy ou lista) ou linha esparsa (1, dim),
+            gravada em 'csr-f32' sem passar pela forma densa
+        vector_format: Formato desejado; se None, escolhe entre 'csr-f32' e
+            'dense-f32' conforme a densidade do vetor
+
+    Returns:
+        Tupla (blob, formato)
+    """
+    if issparse(vector):
+        row = csr_matrix(vector, dtype=np.float32)
+        dim = row.shape[1]
+        if vector_format is None:
+            vector_format = FORMAT_DENSE_F32 if dim and row.nnz / dim > _DENSE_THRESHOLD else FORMAT_CSR_F32
+        if vector_format == FORMAT_CSR_F32:
+            row.sum_duplicates()
+            row.eliminate_zeros()
+            return (_CSR_HEADER.pack(dim, row.nnz) + row.indices.astype('<u4').tobytes()
+                    + row.data.astype('<f4').tobytes()), vector_format
+        vector = row.toarray()
+
+    array = np.asarray(vector, dtype=np.float32).ravel()
+    if vector_format is None:
+        density = np.count_nonzero(array) / array.shape[0] if array.shape[0] else 0.0
+        vector_format = FORMAT_DENSE_F32 if density > _DENSE_THRESHOLD else FORMAT_CSR_F32
+
+    if vector_format == FORMAT_CSR_F32:
+        indices = np.flatnonzero(array).astype('<u4')
+        data = array[indices].astype('<f4')
+        blob = _CSR_HEADER.pack(array.shape[0], indices.shape[0]) + indices.tobytes() + data.tobytes()
+    elif vector_format == FORMAT_DENSE_F32:
+        blob = array.astype('<f4').tobytes()
+    elif vector_format == FORMAT_DENSE_F16:
+        blob = array.astype('<f2').tobytes()
+    elif vector_format == FORMAT_JSON:
+        blob = json.dumps(array.tolist()).encode('utf-8')
+    else:
+        raise ValueError(f"Formato de vetor desconhecido: {vector_format}")
+    return blob, vector_format
+
+
+def vector_dimension(blob: Union[bytes, str], vector_format: Optional[str]) -> int:
+    """Retorna a dimensão de um vetor serializado sem decodificá-lo por inteiro."""
+    if vector_format == FORMAT_CSR_F32:
+        return _CSR_HEADER.unpack_from(blob)[0]
+    if vector_format == FORMAT_DENSE_F32:
+        return len(blob) // 4
+    if vector_format == FORMAT_DENSE_F16:
+        return len(blob) // 2
+    return len(decode_vector(blob, vector_format))
+
+
+def decode_vector(blob: Union[bytes, str], vector_format: Optional[str]) -> np.ndarray:
+    """
+    Desserializa um vetor para um array float32 denso.
+
+    Linhas sem formato (anteriores à migração) são tratadas como JSON.
+    """
+    if blob is None:
+        return np.zeros(0, dtype=np.float32)
+
+    if vector_format == FORMAT_CSR_F32:
+        dim, nnz = _CSR_HEADER.unpack_from(blob)
+        offset = _CSR_HEADER.size
+        indices = np.frombuffer(blob, dtype='<u4', count=nnz, offset=offset)
+        data = np.frombuffer(blob, dtype='<f4', count=nnz, offset=offset + 4 * nnz)
+        array = np.zeros(dim, dtype=np.float32)
+        array[indices] = data
+        return array
+    if vector_format == FORMAT_DENSE_F32:
+        return np.frombuffer(blob, dtype='<f4').astype(np.float32)
+    if vector_format == FORMAT_DENSE_F16:
+        return np.frombuffer(blob, dtype='<f2').astype(np.float32)
+    if vector_format in (None, FORMAT_JSON):
+        if isinstance(blob, bytes):
+            blob = blob.decode('utf-8')
+        return np.asarray(json.loads(blob), dtype=np.float32)
+    raise ValueError(f"Formato de vetor desconhecido: {vector_format}")
+
+
+def decode_sparse_vector(blob: Union[bytes, str], vector_format: Optional[str]) -> Union[csr_matrix, np.ndarray]:
+    """
+    Desserializa um vetor 'csr-f32' como linha CSR (1, dim), sem densificar;
+    os demais formatos são decodificados como em decode_vector.
+    """
+    if vector_format != FORMAT_CSR_F32:
+        return decode_vector(blob, vector_format)
+    dim, nnz = _CSR_HEADER.unpack_from(blob)
+    offset = _CSR_HEADER.size
+    indices = np.frombuffer(blob, dtype='<u4', count=nnz, offset=offset).astype(np.int32)
+    data = np.frombuffer(blob, dtype='<f4', count=nnz, offset=offset + 4 * nnz).astype(np.float32)
+    return csr_matrix((data, indices, np.array([0, nnz], dtype=np.int32)), shape=(1, dim))
+
+
+class MemmapVectorStore:
+    """
+    Armazenamento de vetores em arquivo float32 append-only, lido via np.memmap.
+
+    Os vetores normalizados ficam em <path>.<dim>.f32 (uma linha por chunk) e
+    os ids correspondentes em <path>.<dim>.ids (int64, mesma ordem). Como os
+    dados são mapeados em memória, vários processos de workers compartilham as
+    mesmas páginas do page cache, abrir o store não copia nada, e linhas
+    acrescentadas por um processo ficam visíveis aos demais no próximo
+    refresh(), sem recarga completa.
+
+    Linhas removidas (chunks apagados) são registradas pelo número da linha
+    em <path>.<dim>.deleted (int64, append-only) e ignoradas nas buscas; um
+    id removido pode ser gravado de novo em uma nova linha.
+    """
+
+    def __init__(self, path: str, dim: int):
+        self.dim = dim
+        self.vectors_path = f"{path}.{dim}.f32"
+        self.ids_path = f"{path}.{dim}.ids"
+        self.deleted_path = f"{path}.{dim}.deleted"
+        self.lock_path = f"{path}.{dim}.lock"
+        self._row_bytes = dim * 4
+        self._lock = threading.RLock()
+        self._matrix = np.zeros((0, dim), dtype=np.float32)
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._deleted = np.zeros(0, dtype=bool)
+        self._deleted_read = 0
+        self._id_to_row = {}
+        self.refresh()
+
+    def __len__(self) -> int:
+        """Número de chunks armazenados (sem as linhas removidas)."""
+        return len(self._id_to_row)
+
+    @property
+    def max_id(self) -> int:
+        """Maior id armazenado."""
+        return max(self._id_to_row, default=0)
+
+    def stored_ids(self) -> np.ndarray:
+        """Ids dos chunks armazenados (sem os removidos), incluindo os gravados por outros processos."""
+        self.refresh()
+        with self._lock:
+            return np.fromiter(self._id_to_row, dtype=np.int64, count=len(self._id_to_row))
+
+    def _file_lock(self):
+        """Serializa escritas entre processos."""
+        return file_lock(self.lock_path)
+
+    def refresh(self) -> int:
+        """
+        Mapeia as linhas acrescentadas desde a última leitura.
+
+        Returns:
+            Número de linhas novas
+        """
+        with self._lock:
+            # As remoções são gravadas depois das linhas a que se referem: lendo o
+            # tamanho do arquivo de remoções antes, todas as linhas citadas já existem
+            deleted_size = os.path.getsize(self.deleted_path) if os.path.exists(self.deleted_path) else 0
+            vectors_size = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+            ids_size = os.path.getsize(self.ids_path) if os.path.exists(self.ids_path) else 0
+            # Os vetores são gravados antes dos ids: só linhas com ambos estão completas
+            n_rows = min(vectors_size // self._row_bytes, ids_size // 8)
+            previous = self._ids.shape[0]
+            added = 0
+            if n_rows > previous:
+                self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(n_rows, self.dim))
+                new_ids = np.fromfile(self.ids_path, dtype=np.int64, count=n_rows - previous, offset=previous * 8)
+                self._ids = np.concatenate([self._ids, new_ids])
+                self._deleted = np.concatenate([self._deleted, np.zeros(n_rows - previous, dtype=bool)])
+                for row, chunk_id in enumerate(new_ids.tolist(), start=previous):
+                    self._id_to_row[chunk_id] = row
+                added = n_rows - previous
+
+            n_deleted = deleted_size // 8
+            if n_deleted > self._deleted_read:
+                rows = np.fromfile(self.deleted_path, dtype=np.int64, count=n_deleted - self._deleted_read,
+                                   offset=self._deleted_read * 8)
+                self._deleted[rows] = True
+                for row in rows.tolist():
+                    chunk_id = int(self._ids[row])
+                    if self._id_to_row.get(chunk_id) == row:
+                        del self._id_to_row[chunk_id]
+                self._deleted_read = n_deleted
+            return added
+
+    def add(self, ids: Sequence[int], vectors: Sequence[Sequence[float]]) -> int:
+        """
+        Acrescenta vetores ao final do arquivo.
+
+        Vetores de outra dimensão e ids já armazenados são ignorados.
+
+        Returns:
+            Número de vetores gravados
+        """
+        with self._lock, self._file_lock():
+            self.refresh()
+            kept = [
+                (chunk_id, vector) for chunk_id, vector in zip(ids, vectors)
+                if vector_length(vector) == self.dim and int(chunk_id) not in self._id_to_row
+            ]
+            if not kept:
+                return 0
+
+            # O arquivo guarda linhas densas: linhas esparsas são densificadas só aqui
+            block = normalize_rows(np.asarray([
+                vector.toarray().ravel() if issparse(vector) else vector for _, vector in kept
+            ], dtype=np.float32))
+            with open(self.vectors_path, 'ab') as vectors_file:
+                vectors_file.write(block.astype('<f4').tobytes())
+            with open(self.ids_path, 'ab') as ids_file:
+                ids_file.write(np.asarray([chunk_id for chunk_id, _ in kept], dtype='<i8').tobytes())
+            self.refresh()
+        return len(kept)
+
+    def remove(self, ids: Sequence[int]) -> int:
+        """
+        Marca como removidas as linhas dos ids dados (os dados continuam no
+        arquivo, mas deixam de aparecer nas buscas de todos os processos).
+
+        Returns:
+            Número de linhas removidas
+        """
+        with self._lock, self._file_lock():
+            self.refresh()
+            rows = sorted({self._id_to_row[chunk_id] for chunk_id in map(int, ids) if chunk_id in self._id_to_row})
+            if not rows:
+                return 0
+            with open(self.deleted_path, 'ab') as deleted_file:
+                deleted_file.write(np.asarray(rows, dtype='<i8').tobytes())
+            self.refresh()
+        return len(rows)
+
+    def vector(self, chunk_id: int) -> Optional[np.ndarray]:
+        """Retorna o vetor normalizado de um chunk, ou None se não estiver no store."""
+        self.refresh()
+        row = self._id_to_row.get(chunk_id)
+        return None if row is None else np.array(self._matrix[row])
+
+    def search(self, query_vector: np.ndarray, top_k: int = 3,
+               allowed_ids: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """
+        Busca por similaridade de cosseno, incluindo linhas gravadas por outros processos.
+
+        Args:
+            allowed_ids: Se informado, só as linhas destes ids são lidas e pontuadas
+        """
+        query = np.asarray(query_vector, dtype=np.float32).ravel()
+        if query.shape[0] != self.dim:
+            logger.warning(f"Dimensão da query ({query.shape[0]}) difere do store ({self.dim})")
+            return []
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            return []
+
+        self.refresh()
+        with self._lock:
+            matrix, ids, deleted = self._matrix, self._ids, self._deleted.copy()
+            if allowed_ids is not None:
+                rows = self._rows_for(allowed_ids)
+                matrix, ids, deleted = matrix[rows], ids[rows], deleted[rows]
+        scores = matrix @ (query / norm)
+        scores[deleted] = -np.inf
+        indices = top_k_indices(scores, top_k)
+        return [(int(ids[i]), float(scores[i])) for i in indices if scores[i] > 0]
+
+    def search_many(self, query_matrix: np.ndarray, top_k: int = 3,
+                    allowed_ids: Optional[np.ndarray] = None) -> List[List[Tuple[int, float]]]:
+        """Busca várias queries de uma vez com um único produto matriz-matriz."""
+        queries = normalize_queries(query_matrix, self.dim)
+        if queries is None:
+            return [[] for _ in range(len(query_matrix))]
+
+        self.refresh()
+        with self._lock:
+            matrix, ids, deleted = self._matrix, self._ids, self._deleted.copy()
+            if allowed_ids is not None:
+                rows = self._rows_for(allowed_ids)
+                matrix, ids, deleted = matrix[rows], ids[rows], deleted[rows]
+        scores = queries @ matrix.T
+        scores[:, deleted] = -np.inf
+        indices = top_k_indices_batch(scores, top_k)
+        return ranked_lists(ids[indices], np.take_along_axis(scores, indices, axis=1))
+
+    def _rows_for(self, allowed_ids: np.ndarray) -> np.ndarray:
+        """Linhas do arquivo correspondentes aos ids permitidos, em ordem."""
+        return np.asarray(sorted(
+            self._id_to_row[chunk_id] for chunk_id in np.asarray(allowed_ids).tolist()
+            if chunk_id in self._id_to_row
+        ), dtype=np.int64)
@@ -1,73 +1,965 @@
-import requests
 from sklearn.feature_extraction.text import TfidfVectorizer
+import contextvars
+import hashlib
+import heapq
+import itertools
 import json
 import logging
+import os
+import sqlite3
+import threading
 import time
-from typing import List, Dict, Optional, Any
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import List, Dict, Optional, Any, Callable, Iterator, Tuple
+import numpy as np
+from dotenv import load_dotenv
 from tqdm import tqdm
 
+from http_client import HTTPClient, get_http_client
+from vector_store import FORMAT_DENSE_F32, encode_vector, decode_vector
+
+# Carrega variáveis de ambiente (a instância ollama_api é criada na importação)
+load_dotenv()
+
 # Configuração de logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class EmbeddingCache:
+    """
+    Cache em disco (SQLite) de embeddings, indexado por (modelo, sha256 do texto).
+    
+    Reingerir ou re-chunkar texto inalterado reaproveita os vetores já calculados.
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT,
+                    content_hash TEXT,
+                    vector BLOB,
+                    PRIMARY KEY (model, content_hash)
+                )
+            """)
+    
+    def get_many(self, model: str, hashes: List[str]) -> Dict[str, np.ndarray]:
+        """Retorna os embeddings em cache para os hashes informados."""
+        found = {}
+        with self._lock:
+            # Consulta em lotes para respeitar o limite de parâmetros do SQLite
+            for start in range(0, len(hashes), 500):
+                batch = hashes[start:start + 500]
+                placeholders = ",".join("?" for _ in batch)
+                rows = self._conn.execute(
+                    f"SELECT content_hash, vector FROM embeddings WHERE model = ? AND content_hash IN ({placeholders})",
+                    [model, *batch]
+                ).fetchall()
+                for content_hash, blob in rows:
+                    found[content_hash] = decode_vector(blob, FORMAT_DENSE_F32)
+        return found
+    
+    def put_many(self, model: str, items: List[tuple]):
+        """Armazena pares (hash, embedding)."""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, content_hash, vector) VALUES (?, ?, ?)",
+                [(model, content_hash, encode_vector(vector, FORMAT_DENSE_F32)[0]) for content_hash, vector in items]
+            )
+
+class ResponseCache:
+    """
+    Cache persistente (SQLite) de respostas do modelo.
+    
+    A chave é o sha256 de (modelo, system prompt, prompt, opções de geração).
+    Entradas expiram após ttl segundos e, quando o tamanho total das
+    respostas passa de max_bytes, as menos usadas recentemente são removidas.
+    Gerações com amostragem (temperatura > 0 sem seed fixa) não são
+    determinísticas e só são armazenadas com allow_nondeterministic.
+    """
+    
+    def __init__(self, path: str, ttl: float = 86400, max_bytes: int = 64 * 1024 * 1024,
+                 allow_nondeterministic: bool = False):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.allow_nondeterministic = allow_nondeterministic
+        self._lock = threading.Lock()
+        self._conn = None
+        self.stats = {'hits': 0, 'misses': 0, 'bypassed': 0, 'expired': 0, 'evictions': 0}
+    
+    def _connection(self) -> sqlite3.Connection:
+        """Abre o banco no primeiro uso (requisições não cacheáveis não criam o arquivo)."""
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            with self._conn:
+                self._conn.execute("""
+                    CREATE TABLE IF NOT EXISTS responses (
+                        key TEXT PRIMARY KEY,
+                        model TEXT,
+                        response TEXT,
+                        size INTEGER,
+                        created_at REAL,
+                        last_access REAL
+                    )
+                """)
+                self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses (last_access)")
+        return self._conn
+    
+    @staticmethod
+    def make_key(model: str, system_prompt: str, prompt: str, options: Optional[Dict[str, Any]],
+                 context_tokens: Optional[List[int]] = None) -> str:
+        """Hash estável da requisição de geração (incluindo o contexto de sessão, se houver)."""
+        material = json.dumps([model, system_prompt or "", prompt, options or {}], sort_keys=True, ensure_ascii=False)
+        digest = hashlib.sha256(material.encode('utf-8'))
+        if context_tokens:
+            digest.update(np.asarray(context_tokens, dtype=np.int64).tobytes())
+        return digest.hexdigest()
+    
+    def cacheable(self, options: Optional[Dict[str, Any]]) -> bool:
+        """Indica se a geração é determinística (ou se o cache de amostragens foi habilitado)."""
+        if self.allow_nondeterministic:
+            return True
+        options = options or {}
+        # Sem temperatura explícita o Ollama usa a do modelo, que normalmente amostra
+        temperature = options.get('temperature')
+        return temperature is not None and (float(temperature) == 0 or 'seed' in options)
+    
+    def get(self, key: str) -> Optional[str]:
+        """Retorna a resposta em cache, ou None se ausente ou expirada."""
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.stats['misses'] += 1
+                return None
+            response, created_at = row
+            with conn:
+                if now - created_at > self.ttl:
+                    conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self.stats['expired'] += 1
+                    self.stats['misses'] += 1
+                    return None
+                conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self.stats['hits'] += 1
+            return response
+    
+    def put(self, key: str, model: str, response: str):
+        """Armazena uma resposta e remove as menos usadas se o limite de tamanho for excedido."""
+        now = time.time()
+        size = len(response.encode('utf-8'))
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, model, response, size, created_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, model, response, size, now, now)
+                )
+                total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+                if total <= self.max_bytes:
+                    return
+                excess = total - self.max_bytes
+                victims = []
+                for victim_key, victim_size in conn.execute(
+                        "SELECT key, size FROM responses ORDER BY last_access"):
+                    if excess <= 0:
+                        break
+                    victims.append((victim_key,))
+                    excess -= victim_size
+                conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+                self.stats['evictions'] += len(victims)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Contadores do cache e ocupação atual."""
+        with self._lock:
+            stats = dict(self.stats)
+            if self._conn is not None:
+                stats['entries'], stats['bytes'] = self._conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+                ).fetchone()
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+class SummaryCache:
+    """
+    Cache persistente (SQLite) dos resumos de documentos usados por
+    train_model em modo map-reduce, indexado por (modelo, sha256 do texto).
+    
+    Documentos inalterados não são resumidos de novo ao repetir o treino.
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self.stats = {'hits': 0, 'misses': 0}
+    
+    def _connection(self) -> sqlite3.Connection:
+        """Abre o banco no primeiro uso."""
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            with self._conn:
+                self._conn.execute("""
+                    CREATE TABLE IF NOT EXISTS summaries (
+                        model TEXT,
+                        content_hash TEXT,
+                        summary TEXT,
+                        PRIMARY KEY (model, content_hash)
+                    )
+                """)
+        return self._conn
+    
+    def get(self, model: str, content_hash: str) -> Optional[str]:
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT summary FROM summaries WHERE model = ? AND content_hash = ?", (model, content_hash)
+            ).fetchone()
+            self.stats['hits' if row else 'misses'] += 1
+        return row[0] if row else None
+    
+    def put(self, model: str, content_hash: str, summary: str):
+        with self._lock, self._connection():
+            self._conn.execute(
+                "INSERT OR REPLACE INTO summaries (model, content_hash, summary) VALUES (?, ?, ?)",
+                (model, content_hash, summary)
+            )
+    
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.stats)
+
+class ContextSessionStore:
+    """
+    Contextos do Ollama (tokens já avaliados) por (modelo, versão do corpus).
+    
+    O /api/generate devolve em 'context' os tokens do prompt e da resposta;
+    reenviá-los numa próxima requisição faz o modelo continuar a partir desse
+    prefixo, sem que os documentos precisem ser enviados e processados de
+    novo. Os tokens ficam em arrays int32 e, quando o total passa de
+    max_tokens, as sessões menos usadas recentemente são descartadas.
+    """
+    
+    def __init__(self, max_tokens: int = 1_000_000):
+        self.max_tokens = max_tokens
+        self._sessions: "OrderedDict[Tuple[str, Any], np.ndarray]" = OrderedDict()
+        self._tokens = 0
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+    
+    def get(self, model: str, corpus_version: Any) -> Optional[List[int]]:
+        """Tokens da sessão, ou None se não houver sessão para esta versão do corpus."""
+        key = (model, corpus_version)
+        with self._lock:
+            tokens = self._sessions.get(key)
+            if tokens is None:
+                self.stats['misses'] += 1
+                return None
+            self._sessions.move_to_end(key)
+            self.stats['hits'] += 1
+            return tokens.tolist()
+    
+    def put(self, model: str, corpus_version: Any, tokens: List[int]):
+        """Armazena a sessão, substituindo as de versões anteriores do corpus para o modelo."""
+        array = np.asarray(tokens, dtype=np.int32)
+        with self._lock:
+            for key in [key for key in self._sessions if key[0] == model]:
+                self._tokens -= len(self._sessions.pop(key))
+            if len(array) > self.max_tokens:
+                logger.warning(f"Contexto de {len(array)} tokens excede o limite de sessões ({self.max_tokens})")
+                return
+            self._sessions[(model, corpus_version)] = array
+            self._tokens += len(array)
+            while self._tokens > self.max_tokens:
+                _, evicted = self._sessions.popitem(last=False)
+                self._tokens -= len(evicted)
+                self.stats['evictions'] += 1
+    
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.stats, sessions=len(self._sessions), tokens=self._tokens,
+                        max_tokens=self.max_tokens)
+
+# Classe de prioridade das gerações da thread atual (ver OllamaAPI.priority)
+_generation_priority: contextvars.ContextVar = contextvars.ContextVar('generation_priority', default='interactive')
+
+class GenerationScheduler:
+    """
+    Fila de prioridades na frente do Ollama.
+    
+    No máximo max_workers gerações são enviadas ao mesmo tempo; as demais
+    aguardam uma vaga, liberada na ordem das classes de PRIORITIES
+    (interativas antes de lotes, lotes antes de treino) e, dentro da mesma
+    classe, por ordem de chegada. Cada chamada roda na própria thread: o
+    escalonador só decide quando ela pode começar. Requisições idênticas em
+    andamento (mesma chave) são coalescidas em uma única geração.
+    """
+    
+    PRIORITIES = ('interactive', 'batch', 'train')
+    
+    def __init__(self, max_workers: int = 2):
+        self.max_workers = max_workers
+        self._cond = threading.Condition()
+        self._queue: List[Tuple[int, int]] = []
+        self._seq = itertools.count()
+        self._active = 0
+        self._inflight: Dict[str, Future] = {}
+        self.stats = {'executed': 0, 'coalesced': 0, 'abandoned': 0, 'peak_queued': 0}
+        self._waits = {name: {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0} for name in self.PRIORITIES}
+    
+    @contextmanager
+    def slot(self, priority: str, cancel: Optional[threading.Event] = None):
+        """
+        Bloqueia até haver uma vaga para esta classe de prioridade e a ocupa durante o bloco.
+        
+        Devolve True ao obter a vaga. Se cancel for sinalizado enquanto a
+        chamada ainda está na fila, ela sai da fila sem ocupar vaga e devolve
+        False.
+        """
+        entry = (self.PRIORITIES.index(priority), next(self._seq))
+        start_time = time.time()
+        acquired = False
+        with self._cond:
+            heapq.heappush(self._queue, entry)
+            self.stats['peak_queued'] = max(self.stats['peak_queued'], len(self._queue))
+            while cancel is None or not cancel.is_set():
+                if self._active < self.max_workers and self._queue[0] == entry:
+                    heapq.heappop(self._queue)
+                    self._active += 1
+                    wait_ms = (time.time() - start_time) * 1000
+                    waits = self._waits[priority]
+                    waits['count'] += 1
+                    waits['total_ms'] += wait_ms
+                    waits['max_ms'] = max(waits['max_ms'], wait_ms)
+                    acquired = True
+                    break
+                # Com cancel, acorda periodicamente para verificá-lo
+                self._cond.wait(0.05 if cancel is not None else None)
+            else:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                self.stats['abandoned'] += 1
+            # Pode haver outra vaga livre para o próximo da fila
+            self._cond.notify_all()
+        if not acquired:
+            yield False
+            return
+        if wait_ms >= 1000:
+            logger.info(f"Geração ({priority}) aguardou {wait_ms / 1000:.2f} segundos na fila")
+        try:
+            yield True
+        finally:
+            with self._cond:
+                self._active -= 1
+                self.stats['executed'] += 1
+                self._cond.notify_all()
+    
+    def run(self, key: Optional[str], priority: str, fn):
+        """
+        Executa fn() numa vaga da fila e devolve seu resultado.
+        
+        Se outra thread já está executando a mesma chave, aguarda e devolve o
+        resultado dela em vez de gerar de novo (key None desativa a coalescência).
+        """
+        if key is None:
+            with self.slot(priority):
+                return fn()
+        with self._cond:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+            else:
+                self.stats['coalesced'] += 1
+        if not leader:
+            logger.info("Requisição idêntica já em andamento; aguardando o resultado dela")
+            return future.result()
+        try:
+            with self.slot(priority):
+                result = fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._cond:
+                self._inflight.pop(key, None)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Gerações ativas, fila por prioridade, coalescências e tempo de espera na fila."""
+        with self._cond:
+            queued = {name: 0 for name in self.PRIORITIES}
+            for rank, _ in self._queue:
+                queued[self.PRIORITIES[rank]] += 1
+            wait = {
+                name: {'count': w['count'], 'avg_ms': w['total_ms'] / w['count'] if w['count'] else 0.0,
+                       'max_ms': w['max_ms']}
+                for name, w in self._waits.items()
+            }
+            return dict(self.stats, max_workers=self.max_workers, active=self._active,
+                        queued=queued, in_flight=len(self._inflight), wait=wait)
+
+class OllamaEmbedder:
+    """
+    Gera embeddings densos pela API de embeddings do Ollama (/api/embed).
+    
+    Os textos são enviados em lotes configuráveis pelo cliente HTTP
+    compartilhado (conexões reaproveitadas), e só os textos ausentes do cache
+    são enviados.
+    """
+    
+    def __init__(self, model: Optional[str] = None, base_url: Optional[str] = None,
+                 batch_size: Optional[int] = None, cache_path: Optional[str] = None,
+                 timeout: float = 60, http_client: Optional[HTTPClient] = None):
+        self.model = model or os.getenv('EMBEDDING_MODEL', 'nomic-embed-text')
+        self.base_url = base_url or os.getenv('OLLAMA_BASE_URL', 'http://localhost:11434')
+        self.batch_size = batch_size or int(os.getenv('EMBEDDING_BATCH_SIZE', 32))
+        self.cache = EmbeddingCache(cache_path or os.getenv('EMBEDDING_CACHE_FILE', 'embeddings_cache.db'))
+        self.timeout = timeout
+        self.http = http_client or get_http_client()
+        self.stats = {'cache_hits': 0, 'cache_misses': 0, 'requests': 0}
+        logger.info(f"Inicializando embeddings do Ollama (modelo: {self.model}, lote: {self.batch_size})")
+    
+    def _request(self, texts: List[str]) -> List[List[float]]:
+        """Envia um lote de textos para o endpoint de embeddings."""
+        # Gerar embeddings não tem efeitos colaterais: o POST pode ser repetido
+        response = self.http.post(
+            f"{self.base_url}/api/embed",
+            json={"model": self.model, "input": texts},
+            timeout=self.timeout,
+            idempotent=True
+        )
+        self.stats['requests'] += 1
+        if response.status_code != 200:
+            raise RuntimeError(f"Erro na API de embeddings do Ollama: {response.status_code} - {response.text}")
+        embeddings = response.json().get('embeddings', [])
+        if len(embeddings) != len(texts):
+            raise RuntimeError(f"Ollama retornou {len(embeddings)} embeddings para {len(texts)} textos")
+        return embeddings
+    
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """
+        Retorna a matriz (len(texts), dim) de embeddings.
+        
+        Textos repetidos ou já presentes no cache não geram requisições.
+        """
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        
+        start_time = time.time()
+        hashes = [hashlib.sha256(text.encode('utf-8')).hexdigest() for text in texts]
+        unique = dict(zip(hashes, texts))
+        vectors = self.cache.get_many(self.model, list(unique))
+        missing = [(content_hash, text) for content_hash, text in unique.items() if content_hash not in vectors]
+        self.stats['cache_hits'] += len(unique) - len(missing)
+        self.stats['cache_misses'] += len(missing)
+        
+        for start in range(0, len(missing), self.batch_size):
+            batch = missing[start:start + self.batch_size]
+            embeddings = self._request([text for _, text in batch])
+            items = [(content_hash, np.asarray(embedding, dtype=np.float32))
+                     for (content_hash, _), embedding in zip(batch, embeddings)]
+            self.cache.put_many(self.model, items)
+            vectors.update(items)
+        
+        logger.info(f"{len(texts)} embeddings obtidos em {time.time() - start_time:.2f} segundos "
+                    f"({len(unique) - len(missing)} do cache, {len(missing)} gerados)")
+        return np.vstack([vectors[content_hash] for content_hash in hashes])
+
 class OllamaAPI:
-    def __init__(self, base_url="http://localhost:11434"):
-        self.base_url = base_url
-        logger.info(f"Inicializando API do Ollama em {base_url}")
+    def __init__(self, base_url=None, http_client: Optional[HTTPClient] = None,
+                 response_cache: Optional[ResponseCache] = None, summary_cache: Optional[SummaryCache] = None):
+        self.base_url = base_url or os.getenv('OLLAMA_BASE_URL', 'http://localhost:11434')
+        self.http = http_client or get_http_client()
+        # Geração pode levar minutos (carga do modelo, respostas longas): timeout de leitura próprio
+        self.generation_timeout = float(os.getenv('GENERATION_TIMEOUT', 300))
+        # Opções de geração enviadas ao Ollama (TEMPERATURE=0 torna as respostas cacheáveis)
+        self.options = {}
+        if os.getenv('TEMPERATURE'):
+            self.options['temperature'] = float(os.getenv('TEMPERATURE'))
+        if os.getenv('MAX_TOKENS'):
+            self.options['num_predict'] = int(os.getenv('MAX_TOKENS'))
+        self.response_cache = response_cache
+        if self.response_cache is None and os.getenv('RESPONSE_CACHE', 'true').lower() == 'true':
+            self.response_cache = ResponseCache(
+                os.getenv('RESPONSE_CACHE_FILE', 'response_cache.db'),
+                ttl=float(os.getenv('RESPONSE_CACHE_TTL', 86400)),
+                max_bytes=int(float(os.getenv('RESPONSE_CACHE_MAX_MB', 64)) * 1024 * 1024),
+                allow_nondeterministic=os.getenv('RESPONSE_CACHE_NONDETERMINISTIC', 'false').lower() == 'true'
+            )
+        # Cache da lista de modelos (servida mesmo vencida enquanto é atualizada em segundo plano)
+        self.models_ttl = float(os.getenv('MODELS_CACHE_TTL', 60))
+        self._models: Optional[List[str]] = None
+        self._models_fetched_at = 0.0
+        self._models_lock = threading.Lock()
+        self._models_loaded = threading.Condition(self._models_lock)
+        self._models_refreshing = False
+        self.models_stats = {'fresh': 0, 'stale': 0, 'waited': 0, 'refreshes': 0, 'changes': 0, 'errors': 0}
+        # Treino map-reduce: acima de train_max_chars, os documentos são resumidos antes de apresentados
+        self.train_max_chars = int(os.getenv('TRAIN_MAX_CONTEXT_CHARS', 24000))
+        self.train_map_workers = int(os.getenv('TRAIN_MAP_WORKERS', 4))
+        self.summary_cache = summary_cache or SummaryCache(os.getenv('SUMMARY_CACHE_FILE', 'summary_cache.db'))
+        # Sessões: contexto avaliado em train_model, reaproveitado nas perguntas seguintes
+        self.sessions = ContextSessionStore(int(os.getenv('CONTEXT_SESSION_MAX_TOKENS', 1_000_000)))
+        # Ciclo de vida dos modelos: keep_alive enviado nas gerações (-1 para modelos fixados)
+        self.keep_alive = self._keep_alive_value(os.getenv('OLLAMA_KEEP_ALIVE'))
+        self.pinned_models = set()
+        self.cold_threshold_ms = float(os.getenv('COLD_LOAD_THRESHOLD_MS', 250))
+        self._lifecycle_lock = threading.Lock()
+        self.latency_stats = {kind: {'count': 0, 'total_ms': 0.0, 'load_ms': 0.0} for kind in ('cold', 'warm')}
+        self.latency_stats['preloads'] = 0
+        # Fila na frente do Ollama: limita gerações simultâneas e prioriza perguntas interativas
+        self.scheduler = GenerationScheduler(int(os.getenv('OLLAMA_MAX_CONCURRENCY', 2)))
+        # Modo especulativo: gera a resposta geral em paralelo com a de contexto
+        self.speculative = os.getenv('SPECULATIVE_GENERAL', 'false').lower() == 'true'
+        self._speculation_executor = ThreadPoolExecutor(max_workers=int(os.getenv('MAX_WORKERS', 4)))
+        self._speculation_lock = threading.Lock()
+        self.speculation_stats = {'runs': 0, 'used': 0, 'cancelled': 0, 'saved_ms': 0.0, 'wasted_ms': 0.0}
+        # Corrida entre modelos: o preferido vence se responder dentro do prazo; senão, o primeiro aceitável
+        self.race_deadline_ms = float(os.getenv('RACE_PREFERRED_DEADLINE_MS', 2000))
+        self.race_min_chars = int(os.getenv('RACE_MIN_CHARS', 20))
+        self._race_executor = ThreadPoolExecutor(max_workers=int(os.getenv('MAX_WORKERS', 4)))
+        self._race_lock = threading.Lock()
+        self.race_stats: Dict[str, Dict[str, Any]] = {}
+        logger.info(f"Inicializando API do Ollama em {self.base_url}")
         
     def list_models(self) -> List[str]:
-        """Get list of available models from Ollama."""
+        """
+        Get list of available models from Ollama.
+        
+        A lista fica em cache por MODELS_CACHE_TTL segundos. Vencido o prazo,
+        a lista anterior continua sendo servida enquanto uma única atualização
+        roda em segundo plano. Com o cache vazio, uma única chamada consulta o
+        Ollama e as concorrentes aguardam o resultado dela. Se o Ollama estiver
+        fora do ar, 'mistral' é servido e nova tentativa é feita em segundo
+        plano na chamada seguinte.
+        """
+        with self._models_lock:
+            models = self._models
+            fresh = models is not None and time.time() - self._models_fetched_at < self.models_ttl
+            if fresh:
+                self.models_stats['fresh'] += 1
+            elif models is not None:
+                self.models_stats['stale'] += 1
+            else:
+                leader = not self._models_refreshing
+                if leader:
+                    self._models_refreshing = True
+                else:
+                    self.models_stats['waited'] += 1
+        
+        if models is None:
+            if leader:
+                self._refresh_models()
+            with self._models_lock:
+                self._models_loaded.wait_for(lambda: self._models is not None)
+                models = self._models
+        elif not fresh:
+            self._refresh_models_async()
+        return list(models)
+
+    def _fetch_models(self) -> Optional[List[str]]:
+        """Consulta /api/tags; retorna None se o Ollama não responder."""
         try:
             logger.info("Buscando modelos disponíveis no Ollama")
-            response = requests.get(f"{self.base_url}/api/tags")
+            response = self.http.get(f"{self.base_url}/api/tags")
             if response.status_code == 200:
                 models = response.json().get('models', [])
                 model_names = [model['name'] for model in models]
                 logger.info(f"Modelos encontrados: {', '.join(model_names)}")
                 return model_names
             logger.warning("Não foi possível obter lista de modelos, usando modelo padrão 'mistral'")
-            return ['mistral']
         except Exception as e:
             logger.error(f"Erro ao buscar modelos: {str(e)}")
-            return ['mistral']
+        return None
 
-    def process_with_model(self, text: str, model_name: str, system_prompt: Optional[str] = None) -> str:
-        """Processa texto com o modelo Ollama selecionado."""
-        url = f"{self.base_url}/api/generate"
+    def _refresh_models(self):
+        """Atualiza o cache de modelos, registrando se o conjunto mudou."""
+        models = self._fetch_models()
+        with self._models_lock:
+            self._models_refreshing = False
+            self.models_stats['refreshes'] += 1
+            if models is None:
+                self.models_stats['errors'] += 1
+                if self._models is None:
+                    self._models = ['mistral']
+                # Mantém o cache vencido: a próxima chamada tenta de novo em segundo plano
+                self._models_fetched_at = 0.0
+            else:
+                if self._models is not None and set(models) != set(self._models):
+                    self.models_stats['changes'] += 1
+                    logger.info(f"Conjunto de modelos alterado: {', '.join(models)}")
+                self._models = models
+                self._models_fetched_at = time.time()
+            self._models_loaded.notify_all()
+
+    def _refresh_models_async(self):
+        """Dispara uma atualização em segundo plano, se nenhuma estiver em andamento."""
+        with self._models_lock:
+            if self._models_refreshing:
+                return
+            self._models_refreshing = True
+        threading.Thread(target=self._refresh_models, daemon=True).start()
+
+    def invalidate_models(self):
+        """Descarta a validade do cache de modelos e o atualiza imediatamente em segundo plano."""
+        with self._models_lock:
+            self._models_fetched_at = 0.0
+        self._refresh_models_async()
+
+    @staticmethod
+    def _keep_alive_value(value: Optional[str]) -> Any:
+        """keep_alive do Ollama: segundos (ex.: -1 mantém carregado, 0 descarrega) ou duração ('30m')."""
+        if value is None or value == '':
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            return value
+
+    def _record_latency(self, body: Dict[str, Any], total_ms: float):
+        """Classifica a geração como fria (modelo carregado nela) ou quente, pelo load_duration do Ollama."""
+        load_ms = body.get('load_duration', 0) / 1e6
+        kind = 'cold' if load_ms >= self.cold_threshold_ms else 'warm'
+        if kind == 'cold':
+            logger.info(f"Modelo carregado na geração: {load_ms / 1000:.2f} segundos de carga")
+        with self._lifecycle_lock:
+            stats = self.latency_stats[kind]
+            stats['count'] += 1
+            stats['total_ms'] += total_ms
+            stats['load_ms'] += load_ms
+
+    def preload_model(self, model_name: str, keep_alive: Any = None) -> Dict[str, Any]:
+        """
+        Carrega o modelo na memória do Ollama sem gerar texto (requisição sem prompt).
+        
+        Args:
+            keep_alive: Por quanto tempo manter o modelo carregado (padrão:
+                -1 se fixado, senão OLLAMA_KEEP_ALIVE); 0 descarrega
         
+        Raises:
+            RuntimeError: Se o Ollama recusar a requisição
+        """
+        if keep_alive is None:
+            keep_alive = -1 if model_name in self.pinned_models else self.keep_alive
+        payload = {"model": model_name}
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
+        start_time = time.time()
+        response = self.http.post(f"{self.base_url}/api/generate", json=payload, timeout=self.generation_timeout)
+        self._check_model_known(model_name, response.status_code)
+        if response.status_code != 200:
+            raise RuntimeError(f"Erro na API do Ollama: {response.status_code} - {response.text}")
+        body = response.json()
+        result = {
+            'model': model_name,
+            'keep_alive': keep_alive,
+            'load_ms': body.get('load_duration', 0) / 1e6,
+            'total_ms': (time.time() - start_time) * 1000
+        }
+        if keep_alive != 0:
+            with self._lifecycle_lock:
+                self.latency_stats['preloads'] += 1
+            logger.info(f"Modelo {model_name} pré-carregado em {result['total_ms'] / 1000:.2f} segundos")
+        return result
+
+    def preload_model_async(self, model_name: str):
+        """Pré-carrega o modelo em segundo plano (aquecimento na inicialização)."""
+        def run():
+            try:
+                self.preload_model(model_name)
+            except Exception as e:
+                logger.error(f"Erro ao pré-carregar modelo {model_name}: {str(e)}")
+        threading.Thread(target=run, daemon=True).start()
+
+    def pin_model(self, model_name: str) -> Dict[str, Any]:
+        """Mantém o modelo carregado indefinidamente (keep_alive -1 em todas as gerações)."""
+        self.pinned_models.add(model_name)
+        return self.preload_model(model_name)
+
+    def unpin_model(self, model_name: str) -> Dict[str, Any]:
+        """Volta a usar o keep_alive padrão para o modelo (a contagem recomeça agora)."""
+        self.pinned_models.discard(model_name)
+        return self.preload_model(model_name)
+
+    def unload_model(self, model_name: str) -> Dict[str, Any]:
+        """Descarrega o modelo da memória do Ollama imediatamente."""
+        self.pinned_models.discard(model_name)
+        result = self.preload_model(model_name, keep_alive=0)
+        logger.info(f"Modelo {model_name} descarregado")
+        return result
+
+    def loaded_models(self) -> List[Dict[str, Any]]:
+        """Modelos carregados no Ollama agora (/api/ps), com o horário em que expiram."""
+        response = self.http.get(f"{self.base_url}/api/ps")
+        if response.status_code != 200:
+            raise RuntimeError(f"Erro na API do Ollama: {response.status_code} - {response.text}")
+        return [{'name': model['name'], 'expires_at': model.get('expires_at'), 'size_vram': model.get('size_vram')}
+                for model in response.json().get('models', [])]
+
+    def get_lifecycle_stats(self) -> Dict[str, Any]:
+        """
+        Latência das gerações separada em frias (o Ollama carregou o modelo,
+        load_duration >= cold_threshold_ms) e quentes, além da configuração
+        de keep_alive e dos modelos fixados.
+        """
+        with self._lifecycle_lock:
+            stats = {'preloads': self.latency_stats['preloads']}
+            for kind in ('cold', 'warm'):
+                kind_stats = self.latency_stats[kind]
+                count = kind_stats['count']
+                stats[kind] = dict(kind_stats,
+                                   avg_ms=kind_stats['total_ms'] / count if count else 0.0,
+                                   avg_load_ms=kind_stats['load_ms'] / count if count else 0.0)
+        stats['keep_alive'] = self.keep_alive
+        stats['pinned'] = sorted(self.pinned_models)
+        stats['cold_threshold_ms'] = self.cold_threshold_ms
+        return stats
+
+    def _check_model_known(self, model_name: str, status_code: int):
+        """
+        Invalida o cache de modelos quando uma geração revela que o conjunto
+        mudou: um modelo em cache não existe mais (404) ou um modelo fora da
+        lista respondeu.
+        """
+        with self._models_lock:
+            models = self._models
+        if models is None:
+            return
+        known = model_name in models or f"{model_name}:latest" in models
+        if (status_code == 404 and known) or (status_code == 200 and not known):
+            logger.info(f"Modelo {model_name} {'removido' if status_code == 404 else 'novo'}; "
+                        f"atualizando lista de modelos")
+            self.invalidate_models()
+
+    def get_models_cache_stats(self) -> Dict[str, Any]:
+        """Contadores do cache da lista de modelos e idade da lista atual."""
+        with self._models_lock:
+            stats = dict(self.models_stats)
+            stats['models'] = list(self._models) if self._models is not None else None
+            stats['age_s'] = time.time() - self._models_fetched_at if self._models_fetched_at else None
+        return stats
+
+    def _generate_payload(self, text: str, model_name: str, system_prompt: Optional[str],
+                          stream: bool, context_tokens: Optional[List[int]] = None) -> Dict[str, Any]:
         payload = {
             "model": model_name,
             "prompt": text,
             "system": system_prompt if system_prompt else "",
-            "stream": False
+            "stream": stream
         }
+        if self.options:
+            payload["options"] = self.options
+        if context_tokens:
+            payload["context"] = context_tokens
+        keep_alive = -1 if model_name in self.pinned_models else self.keep_alive
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
+        return payload
+
+    def _cache_key(self, payload: Dict[str, Any]) -> Optional[str]:
+        """Chave do cache de respostas, ou None se a requisição não deve ser cacheada."""
+        if self.response_cache is None:
+            return None
+        if not self.response_cache.cacheable(payload.get("options")):
+            self.response_cache.stats['bypassed'] += 1
+            return None
+        return ResponseCache.make_key(payload["model"], payload["system"], payload["prompt"],
+                                      payload.get("options"), payload.get("context"))
+
+    @staticmethod
+    @contextmanager
+    def priority(name: str):
+        """
+        Define a classe de prioridade das gerações feitas dentro do bloco
+        (na thread atual): 'interactive' (padrão), 'batch' ou 'train'.
+        """
+        if name not in GenerationScheduler.PRIORITIES:
+            raise ValueError(f"Prioridade desconhecida: {name}")
+        token = _generation_priority.set(name)
+        try:
+            yield
+        finally:
+            _generation_priority.reset(token)
+
+    def get_scheduler_stats(self) -> Dict[str, Any]:
+        return self.scheduler.get_stats()
+
+    def process_with_model(self, text: str, model_name: str, system_prompt: Optional[str] = None,
+                           context_tokens: Optional[List[int]] = None) -> str:
+        """
+        Processa texto com o modelo Ollama selecionado.
+        
+        Args:
+            context_tokens: Contexto devolvido por uma geração anterior (sessão);
+                o prompt continua a partir dele
+        """
+        return self._generate(text, model_name, system_prompt, context_tokens)[0]
+
+    def _generate(self, text: str, model_name: str, system_prompt: Optional[str] = None,
+                  context_tokens: Optional[List[int]] = None,
+                  want_context: bool = False) -> Tuple[str, Optional[List[int]]]:
+        """
+        Executa /api/generate sem streaming.
+        
+        Passa pela fila do escalonador com a prioridade atual (ver priority).
+        
+        Returns:
+            (resposta ou mensagem de erro, tokens de contexto devolvidos pelo
+            Ollama ou None). Com want_context o cache de respostas não é
+            consultado, pois ele não guarda os tokens.
+        """
+        url = f"{self.base_url}/api/generate"
+        payload = self._generate_payload(text, model_name, system_prompt, stream=False,
+                                         context_tokens=context_tokens)
+        
+        cache_key = self._cache_key(payload)
+        if cache_key is not None and not want_context:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"Resposta do modelo {model_name} obtida do cache ({len(cached)} caracteres)")
+                return cached, None
+        
+        def send() -> Tuple[str, Optional[List[int]]]:
+            try:
+                logger.info(f"\nEnviando requisição para o Ollama (modelo: {model_name})")
+                logger.info(f"Tamanho do prompt: {len(text)} caracteres")
+                logger.info(f"Primeiros 200 caracteres do prompt: {text[:200]}...")
+                
+                start_time = time.time()
+                response = self.http.post(url, json=payload, timeout=self.generation_timeout)
+                processing_time = time.time() - start_time
+                self._check_model_known(model_name, response.status_code)
+                
+                if response.status_code == 200:
+                    body = response.json()
+                    result = body['response']
+                    logger.info(f"Resposta recebida em {processing_time:.2f} segundos")
+                    logger.info(f"Tamanho da resposta: {len(result)} caracteres")
+                    if 'prompt_eval_count' in body:
+                        logger.info(f"Avaliação do prompt: {body['prompt_eval_count']} tokens em "
+                                    f"{body.get('prompt_eval_duration', 0) / 1e9:.2f} segundos")
+                    self._record_latency(body, processing_time * 1000)
+                    if cache_key is not None:
+                        self.response_cache.put(cache_key, model_name, result)
+                    return result, body.get('context')
+                else:
+                    error_msg = f"Erro na API do Ollama: {response.status_code} - {response.text}"
+                    logger.error(error_msg)
+                    return error_msg, None
+            except Exception as e:
+                error_msg = f"Erro ao conectar com Ollama: {str(e)}"
+                logger.error(error_msg)
+                return error_msg, None
+        
+        # Requisições idênticas simultâneas compartilham uma única geração
+        flight_key = ResponseCache.make_key(model_name, payload["system"], text, payload.get("options"), context_tokens)
+        return self.scheduler.run(flight_key, _generation_priority.get(), send)
+
+    def stream_with_model(self, text: str, model_name: str, system_prompt: Optional[str] = None,
+                          on_start: Optional[Callable[[], None]] = None,
+                          cancel: Optional[threading.Event] = None,
+                          on_finish: Optional[Callable[[str], None]] = None) -> Iterator[str]:
+        """
+        Versão em streaming de process_with_model.
+        
+        Lê o NDJSON de /api/generate à medida que o modelo gera e devolve cada
+        trecho de texto assim que chega, em vez de esperar a resposta completa.
+        Erros são devolvidos como texto, como em process_with_model. Respostas
+        em cache são devolvidas de uma vez; respostas geradas até o fim são
+        armazenadas.
+        
+        on_start é chamado quando a geração começa: ao obter a vaga na fila
+        do escalonador (ou ao encontrar a resposta em cache). Se cancel for
+        sinalizado antes disso, a chamada sai da fila sem enviar nada ao
+        Ollama; depois, a conexão é fechada na próxima linha recebida.
+        on_finish recebe a resposta completa quando a geração termina, ainda
+        com a vaga ocupada.
+        """
+        url = f"{self.base_url}/api/generate"
+        payload = self._generate_payload(text, model_name, system_prompt, stream=True)
+        
+        if cancel is not None and cancel.is_set():
+            return
+        cache_key = self._cache_key(payload)
+        if cache_key is not None:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"Resposta do modelo {model_name} obtida do cache ({len(cached)} caracteres)")
+                if on_start is not None:
+                    on_start()
+                yield cached
+                if on_finish is not None:
+                    on_finish(cached)
+                return
         
         try:
-            logger.info(f"\nEnviando requisição para o Ollama (modelo: {model_name})")
+            logger.info(f"\nEnviando requisição em streaming para o Ollama (modelo: {model_name})")
             logger.info(f"Tamanho do prompt: {len(text)} caracteres")
-            logger.info(f"Primeiros 200 caracteres do prompt: {text[:200]}...")
             
             start_time = time.time()
-            response = requests.post(url, json=payload)
-            processing_time = time.time() - start_time
+            first_token_time = None
+            pieces = []
+            # A vaga da fila fica ocupada até o fim do streaming (ou até o consumidor fechar o gerador)
+            with self.scheduler.slot(_generation_priority.get(), cancel) as acquired:
+                if not acquired or (cancel is not None and cancel.is_set()):
+                    logger.info(f"Geração do modelo {model_name} cancelada antes do envio")
+                    return
+                if on_start is not None:
+                    on_start()
+                with self.http.post(url, json=payload, stream=True, timeout=self.generation_timeout) as response:
+                    self._check_model_known(model_name, response.status_code)
+                    if response.status_code != 200:
+                        error_msg = f"Erro na API do Ollama: {response.status_code} - {response.text}"
+                        logger.error(error_msg)
+                        yield error_msg
+                        return
+                    
+                    for line in response.iter_lines():
+                        if cancel is not None and cancel.is_set():
+                            return
+                        if not line:
+                            continue
+                        body = json.loads(line)
+                        if 'error' in body:
+                            error_msg = f"Erro na API do Ollama: {body['error']}"
+                            logger.error(error_msg)
+                            yield error_msg
+                            return
+                        
+                        piece = body.get('response', '')
+                        if piece:
+                            if first_token_time is None:
+                                first_token_time = time.time() - start_time
+                                logger.info(f"Primeiro token em {first_token_time:.2f} segundos")
+                            pieces.append(piece)
+                            yield piece
+                        if body.get('done'):
+                            self._record_latency(body, (time.time() - start_time) * 1000)
+                            if cache_key is not None:
+                                self.response_cache.put(cache_key, model_name, "".join(pieces))
+                            if on_finish is not None:
+                                on_finish("".join(pieces))
+                            break
             
-            if response.status_code == 200:
-                result = response.json()['response']
-                logger.info(f"Resposta recebida em {processing_time:.2f} segundos")
-                logger.info(f"Tamanho da resposta: {len(result)} caracteres")
-                return result
-            else:
-                error_msg = f"Erro na API do Ollama: {response.status_code} - {response.text}"
-                logger.error(error_msg)
-                return error_msg
+            logger.info(f"Streaming concluído em {time.time() - start_time:.2f} segundos "
+                        f"({sum(len(piece) for piece in pieces)} caracteres)")
         except Exception as e:
             error_msg = f"Erro ao conectar com Ollama: {str(e)}"
             logger.error(error_msg)
-            return error_msg
+            yield error_msg
 
-    def ask_question_with_context(self, question: str, context: str, model_name: str) -> str:
-        """Tenta responder a pergunta usando apenas o contexto dos documentos."""
-        logger.info("Processando pergunta com contexto")
+    @staticmethod
+    def _context_prompt(question: str, context: str) -> Tuple[str, str]:
+        """Monta (prompt, system_prompt) da etapa que responde com o contexto dos documentos."""
         system_prompt = """Você é um assistente especializado. Primeiro, tente responder usando apenas 
         as informações do contexto fornecido. Se a informação necessária não estiver no contexto, 
         indique explicitamente que vai usar seu conhecimento geral para responder."""
@@ -83,16 +975,11 @@ class OllamaAPI:
         3. Se a resposta não estiver no contexto, indique explicitamente que vai usar seu conhecimento geral
         
         Resposta:"""
-        
-        return self.process_with_model(
-            text=prompt,
-            model_name=model_name,
-            system_prompt=system_prompt
-        )
+        return prompt, system_prompt
 
-    def ask_question_general(self, question: str, model_name: str) -> str:
-        """Faz uma pergunta usando apenas o conhecimento base do modelo."""
-        logger.info("Processando pergunta com conhecimento base")
+    @staticmethod
+    def _general_prompt(question: str) -> Tuple[str, str]:
+        """Monta (prompt, system_prompt) da etapa que usa o conhecimento base do modelo."""
         system_prompt = """Você é um assistente geral. Use seu conhecimento base para responder 
         à pergunta da melhor forma possível."""
         
@@ -101,37 +988,112 @@ class OllamaAPI:
         Por favor, use seu conhecimento geral para fornecer a melhor resposta possível.
         
         Resposta:"""
+        return prompt, system_prompt
+
+    @staticmethod
+    def _session_prompt(question: str, context: Optional[str] = None) -> Tuple[str, str]:
+        """
+        Monta (prompt, system_prompt) de uma pergunta feita sobre os documentos
+        já apresentados na sessão, com os trechos recuperados para a pergunta
+        (se houver) anexados ao prompt.
+        """
+        system_prompt = """Você é um assistente especializado. Responda usando as informações dos 
+        documentos apresentados anteriormente e dos trechos relevantes enviados com a pergunta. Se a 
+        informação necessária não estiver nos documentos, indique explicitamente que vai usar seu 
+        conhecimento geral para responder."""
         
+        excerpts = f"""Trechos mais relevantes dos documentos para esta pergunta:
+        {context}
+
+        """ if context else ""
+        prompt = f"""{excerpts}Pergunta sobre os documentos apresentados: {question}
+
+        Por favor:
+        1. Primeiro, verifique se a resposta está nos documentos
+        2. Se encontrar a resposta nos documentos, responda usando apenas essas informações
+        3. Se a resposta não estiver nos documentos, indique explicitamente que vai usar seu conhecimento geral
+        
+        Resposta:"""
+        return prompt, system_prompt
+
+    @staticmethod
+    def _needs_general_knowledge(response: str) -> bool:
+        """Indica se a resposta com contexto declarou que precisa do conhecimento geral."""
+        return "conhecimento geral" in response.lower()
+
+    @staticmethod
+    def _combine_answers(response: str, general_response: str) -> str:
+        """Junta a resposta baseada nos documentos e a complementação do conhecimento base."""
+        return f"""Baseado nos documentos fornecidos: {response}
+
+Complementando com o conhecimento base do modelo: {general_response}"""
+
+    def ask_question_with_context(self, question: str, context: str, model_name: str) -> str:
+        """Tenta responder a pergunta usando apenas o contexto dos documentos."""
+        logger.info("Processando pergunta com contexto")
+        prompt, system_prompt = self._context_prompt(question, context)
         return self.process_with_model(
             text=prompt,
             model_name=model_name,
             system_prompt=system_prompt
         )
 
-    def ask_question(self, question: str, model_name: str, context: Optional[str] = None) -> str:
+    def ask_question_general(self, question: str, model_name: str) -> str:
+        """Faz uma pergunta usando apenas o conhecimento base do modelo."""
+        logger.info("Processando pergunta com conhecimento base")
+        prompt, system_prompt = self._general_prompt(question)
+        return self.process_with_model(
+            text=prompt,
+            model_name=model_name,
+            system_prompt=system_prompt
+        )
+
+    def ask_question(self, question: str, model_name: str, context: Optional[str] = None,
+                     speculative: Optional[bool] = None, corpus_version: Any = None) -> str:
         """
         Processo de duas etapas para responder perguntas:
         1. Tenta responder usando o contexto dos documentos
         2. Se necessário, usa o conhecimento base do modelo
+        
+        Com speculative (padrão: SPECULATIVE_GENERAL), as duas etapas rodam em
+        paralelo; ver _ask_question_speculative. Com corpus_version, se houver
+        sessão de train_model para (modelo, versão), a primeira etapa continua
+        a partir dos documentos já avaliados, enviando junto o contexto
+        recuperado para a pergunta.
         """
         logger.info(f"\nProcessando pergunta: {question}")
         logger.info(f"Modelo selecionado: {model_name}")
         start_time = time.time()
         
+        session_tokens = self.sessions.get(model_name, corpus_version) if corpus_version is not None else None
+        if session_tokens:
+            logger.info(f"\nUsando sessão do modelo ({len(session_tokens)} tokens já avaliados)")
+            prompt, system_prompt = self._session_prompt(question, context)
+            response = self.process_with_model(prompt, model_name, system_prompt, context_tokens=session_tokens)
+            if self._needs_general_knowledge(response):
+                logger.info("\nResposta não encontrada nos documentos. Usando conhecimento base do modelo...")
+                response = self._combine_answers(response, self.ask_question_general(question, model_name))
+            logger.info(f"Resposta gerada em {time.time() - start_time:.2f} segundos")
+            return response
+        
+        if context and (self.speculative if speculative is None else speculative):
+            if self.scheduler.max_workers > 1:
+                return self._ask_question_speculative(question, model_name, context)
+            # Com uma única vaga a especulação só atrasaria a etapa de contexto
+            logger.info("\nEspeculação desativada: o escalonador tem uma única vaga")
+        
         if context:
             logger.info("\nTentando responder com o contexto dos documentos...")
             logger.info(f"Tamanho do contexto: {len(context)} caracteres")
             response = self.ask_question_with_context(question, context, model_name)
             
             # Verifica se a resposta indica que o conhecimento geral foi necessário
-            if "conhecimento geral" in response.lower():
+            if self._needs_general_knowledge(response):
                 logger.info("\nResposta não encontrada no contexto. Usando conhecimento base do modelo...")
                 general_response = self.ask_question_general(question, model_name)
                 
                 # Combina as respostas
-                final_response = f"""Baseado nos documentos fornecidos: {response}
-
-Complementando com o conhecimento base do modelo: {general_response}"""
+                final_response = self._combine_answers(response, general_response)
                 
                 processing_time = time.time() - start_time
                 logger.info(f"Resposta gerada em {processing_time:.2f} segundos")
@@ -148,21 +1110,298 @@ Complementando com o conhecimento base do modelo: {general_response}"""
             logger.info(f"Resposta gerada em {processing_time:.2f} segundos")
             return response
 
-    def train_model(self, documents: List[str], model_name: str, context: Optional[str] = None) -> str:
+    def _generate_until_cancelled(self, question: str, model_name: str,
+                                  cancel: threading.Event) -> Tuple[Optional[str], float]:
         """
-        Prepara o modelo para usar tanto os documentos fornecidos quanto seu conhecimento base.
+        Gera a resposta de conhecimento geral em streaming, parando assim que
+        cancel é sinalizado (a conexão é fechada e o Ollama interrompe a geração).
+        
+        Returns:
+            (resposta, ms gastos), com resposta None se cancelada
         """
-        logger.info(f"\nPreparando modelo {model_name} com documentos personalizados")
-        logger.info(f"Número de documentos: {len(documents)}")
+        prompt, system_prompt = self._general_prompt(question)
+        return self._stream_until_cancelled(prompt, model_name, system_prompt, cancel)
+
+    def _stream_until_cancelled(self, text: str, model_name: str, system_prompt: Optional[str],
+                                cancel: threading.Event,
+                                on_start: Optional[Callable[[], None]] = None,
+                                on_finish: Optional[Callable[[str], None]] = None) -> Tuple[Optional[str], float]:
+        """Gera em streaming até o fim ou até cancel ser sinalizado; devolve (resposta ou None, ms)."""
+        start_time = time.time()
+        pieces = []
+        completed = []
+        
+        def finish(response: str):
+            completed.append(response)
+            if on_finish is not None:
+                on_finish(response)
+        
+        stream = self.stream_with_model(text, model_name, system_prompt, on_start, cancel, finish)
+        try:
+            for piece in stream:
+                if cancel.is_set():
+                    break
+                pieces.append(piece)
+        finally:
+            stream.close()
+        if cancel.is_set() and not completed:
+            return None, (time.time() - start_time) * 1000
+        return "".join(pieces), (time.time() - start_time) * 1000
+
+    def _ask_question_speculative(self, question: str, model_name: str, context: str) -> str:
+        """
+        Executa as etapas de contexto e de conhecimento geral em paralelo.
+        
+        A geração geral começa junto com a de contexto; se a resposta com
+        contexto basta, a geral é cancelada. Quando a geral é necessária, a
+        latência cai de contexto + geral para aproximadamente o maior dos dois.
+        
+        A geração especulativa entra na fila como lote (ou com a prioridade da
+        pergunta, se menor), para não passar à frente de perguntas interativas;
+        se for cancelada ainda na fila, nunca chega ao Ollama.
+        """
+        start_time = time.time()
+        cancel = threading.Event()
+        priorities = GenerationScheduler.PRIORITIES
+        priority = priorities[max(priorities.index(_generation_priority.get()), priorities.index('batch'))]
+        
+        def speculate() -> Tuple[Optional[str], float]:
+            with self.priority(priority):
+                return self._generate_until_cancelled(question, model_name, cancel)
+        
+        general_future = self._speculation_executor.submit(speculate)
+        
+        context_start = time.time()
+        response = self.ask_question_with_context(question, context, model_name)
+        context_ms = (time.time() - context_start) * 1000
+        
+        if not self._needs_general_knowledge(response):
+            cancel.set()
+            # O custo desperdiçado é contabilizado quando a thread termina, sem bloquear a resposta
+            general_future.add_done_callback(
+                lambda future: self._record_speculation(used=False, cost_ms=future.result()[1])
+            )
+            logger.info(f"Resposta gerada em {time.time() - start_time:.2f} segundos "
+                        f"(especulação descartada)")
+            return response
+        
+        logger.info("\nResposta não encontrada no contexto. Usando a resposta geral especulativa...")
+        general_response, general_ms = general_future.result()
+        total_ms = (time.time() - start_time) * 1000
+        # Economia em relação à execução sequencial (contexto e depois geral)
+        self._record_speculation(used=True, cost_ms=max(context_ms + general_ms - total_ms, 0.0))
+        logger.info(f"Resposta gerada em {total_ms / 1000:.2f} segundos "
+                    f"(sequencial levaria ~{(context_ms + general_ms) / 1000:.2f})")
+        return self._combine_answers(response, general_response)
+
+    def _record_speculation(self, used: bool, cost_ms: float):
+        """Acumula o resultado de uma especulação: tempo economizado ou geração descartada."""
+        with self._speculation_lock:
+            self.speculation_stats['runs'] += 1
+            if used:
+                self.speculation_stats['used'] += 1
+                self.speculation_stats['saved_ms'] += cost_ms
+            else:
+                self.speculation_stats['cancelled'] += 1
+                self.speculation_stats['wasted_ms'] += cost_ms
+
+    def get_speculation_stats(self) -> Dict[str, Any]:
+        """
+        Efetividade do modo especulativo: quantas vezes a resposta geral foi
+        aproveitada (hit_rate), a latência economizada nesses casos e o tempo
+        de geração descartado nos demais.
+        """
+        with self._speculation_lock:
+            stats = dict(self.speculation_stats)
+        stats['hit_rate'] = stats['used'] / stats['runs'] if stats['runs'] else 0.0
+        stats['avg_saved_ms'] = stats['saved_ms'] / stats['used'] if stats['used'] else 0.0
+        stats['enabled'] = self.speculative
+        return stats
+
+    def _acceptable_answer(self, response: str) -> bool:
+        """Verificação padrão da corrida: não é erro e tem ao menos race_min_chars caracteres."""
+        return not self.is_error_response(response) and len(response.strip()) >= self.race_min_chars
+
+    def ask_question_race(self, question: str, models: List[str], context: Optional[str] = None,
+                          preferred: Optional[str] = None, deadline_ms: Optional[float] = None,
+                          check: Optional[Callable[[str], bool]] = None) -> Dict[str, Any]:
+        """
+        Envia a pergunta a vários modelos ao mesmo tempo e fica com uma resposta.
+        
+        O modelo preferido (padrão: o primeiro da lista) vence se sua resposta
+        chegar dentro de deadline_ms (padrão: RACE_PREFERRED_DEADLINE_MS) e
+        passar em check (padrão: _acceptable_answer). Depois do prazo, ou se
+        o preferido falhar, vence a primeira resposta aceitável a terminar.
+        As gerações dos perdedores são canceladas. Se a resposta vencedora
+        pedir conhecimento geral, a segunda etapa roda só no modelo vencedor.
+        
+        As gerações passam pelo escalonador como as demais: o preferido entra
+        primeiro na fila e seu prazo só começa a contar quando ele obtém a
+        vaga, para que a espera na fila não o tire da corrida. Perdedores
+        cancelados enquanto ainda aguardam vaga nunca são enviados.
+        
+        Returns:
+            {'answer', 'model', 'latency_ms', 'reason'}; reason é 'preferred',
+            'first_acceptable' ou 'none_acceptable' (nenhuma passou em check:
+            devolve a do preferido, se houver)
+        """
+        models = list(dict.fromkeys(models))
+        preferred = preferred or models[0]
+        if preferred not in models:
+            raise ValueError(f"O modelo preferido {preferred} não está na corrida")
+        deadline_ms = self.race_deadline_ms if deadline_ms is None else deadline_ms
+        check = check or self._acceptable_answer
+        if context:
+            prompt, system_prompt = self._context_prompt(question, context)
+        else:
+            prompt, system_prompt = self._general_prompt(question)
+        
+        logger.info(f"\nCorrida entre modelos {models} (preferido: {preferred}): {question}")
         start_time = time.time()
+        cancel = {model: threading.Event() for model in models}
+        preferred_started: List[float] = []
         
-        # Processa documentos com barra de progresso
-        with tqdm(total=len(documents), desc="Processando documentos") as pbar:
-            context_text = ""
-            for doc in documents:
-                context_text += doc + "\n\n"
-                pbar.update(1)
+        def deadline_passed() -> bool:
+            return bool(preferred_started) and (time.time() - preferred_started[0]) * 1000 >= deadline_ms
         
+        def settle(model: str) -> Callable[[str], None]:
+            # Roda ainda com a vaga ocupada: se esta resposta já decide a corrida, os demais são
+            # cancelados antes que um deles ocupe a vaga liberada e chegue a ser enviado
+            def finish(response: str):
+                if check(response) and (model == preferred or deadline_passed()):
+                    for other in models:
+                        if other != model:
+                            cancel[other].set()
+            return finish
+        
+        # copy_context por tarefa: as gerações herdam a prioridade da pergunta. O preferido é
+        # enviado primeiro, para ser o primeiro da corrida a obter vaga no escalonador
+        futures = {}
+        for model in sorted(models, key=lambda model: model != preferred):
+            on_start = (lambda: preferred_started.append(time.time())) if model == preferred else None
+            futures[self._race_executor.submit(contextvars.copy_context().run, self._stream_until_cancelled,
+                                               prompt, model, system_prompt, cancel[model], on_start,
+                                               settle(model))] = model
+        
+        finished: List[Tuple[str, str, float]] = []  # (modelo, resposta, ms) na ordem de término
+        winner = None
+        pending = set(futures)
+        while pending and winner is None:
+            if deadline_passed():
+                timeout = None
+            elif preferred_started:
+                timeout = max(deadline_ms / 1000 - (time.time() - preferred_started[0]), 0)
+            else:
+                # O prazo ainda não começou: vence no mínimo deadline_ms depois de agora
+                timeout = deadline_ms / 1000
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in sorted(done, key=lambda future: future.result()[1]):
+                response, latency_ms = future.result()
+                # None: cancelado porque outra resposta já decidiu a corrida
+                if response is not None:
+                    finished.append((futures[future], response, latency_ms))
+            
+            acceptable = [entry for entry in finished if check(entry[1])]
+            preferred_ok = [entry for entry in acceptable if entry[0] == preferred]
+            preferred_failed = any(entry[0] == preferred for entry in finished) and not preferred_ok
+            if preferred_ok:
+                winner = preferred_ok[0] + ('preferred',)
+            elif acceptable and (deadline_passed() or preferred_failed):
+                winner = acceptable[0] + ('first_acceptable',)
+        
+        if winner is None:
+            fallback = [entry for entry in finished if entry[0] == preferred] or finished
+            winner = fallback[0] + ('none_acceptable',)
+        model, response, latency_ms, reason = winner
+        
+        # Perdedores ainda na fila do escalonador (ou do executor) saem sem chegar ao Ollama;
+        # os que já geram fecham a conexão na próxima linha recebida
+        for loser in models:
+            if loser != model:
+                cancel[loser].set()
+        for future in pending:
+            future.cancel()
+        self._record_race(models, finished, model)
+        logger.info(f"Corrida vencida por {model} ({reason}) em {(time.time() - start_time):.2f} segundos")
+        
+        if context and self._needs_general_knowledge(response):
+            logger.info("\nResposta não encontrada no contexto. Usando conhecimento base do modelo vencedor...")
+            response = self._combine_answers(response, self.ask_question_general(question, model))
+        return {'answer': response, 'model': model, 'latency_ms': latency_ms, 'reason': reason}
+
+    def _record_race(self, models: List[str], finished: List[Tuple[str, str, float]], winner: str):
+        """Acumula participações, vitórias e latências (só das gerações concluídas) por modelo."""
+        with self._race_lock:
+            for model in models:
+                stats = self.race_stats.setdefault(
+                    model, {'races': 0, 'wins': 0, 'completed': 0, 'cancelled': 0, 'total_ms': 0.0}
+                )
+                stats['races'] += 1
+                stats['wins'] += model == winner
+            for model, response, latency_ms in finished:
+                self.race_stats[model]['completed'] += 1
+                self.race_stats[model]['total_ms'] += latency_ms
+            for model in set(models) - {entry[0] for entry in finished}:
+                self.race_stats[model]['cancelled'] += 1
+
+    def get_race_stats(self) -> Dict[str, Any]:
+        """Por modelo: taxa de vitória nas corridas e latência média das respostas concluídas."""
+        with self._race_lock:
+            return {
+                model: dict(stats,
+                            win_rate=stats['wins'] / stats['races'] if stats['races'] else 0.0,
+                            avg_ms=stats['total_ms'] / stats['completed'] if stats['completed'] else 0.0)
+                for model, stats in self.race_stats.items()
+            }
+
+    def ask_question_stream(self, question: str, model_name: str,
+                            context: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Versão em streaming de ask_question, com o mesmo processo de duas etapas.
+        
+        Gera eventos na ordem em que devem ser enviados ao cliente:
+        - {'event': 'stage', 'stage': 'context' | 'general'} ao iniciar cada etapa
+        - {'event': 'token', 'stage': ..., 'text': trecho} a cada trecho gerado
+        - {'event': 'done', 'first_token_ms': ..., 'total_ms': ...} ao final
+        
+        A etapa de conhecimento geral só começa depois que a resposta com
+        contexto termina e indica que ele foi necessário.
+        """
+        logger.info(f"\nProcessando pergunta (streaming): {question}")
+        logger.info(f"Modelo selecionado: {model_name}")
+        start_time = time.time()
+        first_token_ms = None
+        
+        stages = []
+        if context:
+            logger.info(f"Tamanho do contexto: {len(context)} caracteres")
+            stages.append(('context', self._context_prompt(question, context)))
+        stages.append(('general', self._general_prompt(question)))
+        
+        for stage, (prompt, system_prompt) in stages:
+            yield {'event': 'stage', 'stage': stage}
+            response = []
+            for piece in self.stream_with_model(prompt, model_name, system_prompt):
+                if first_token_ms is None:
+                    first_token_ms = (time.time() - start_time) * 1000
+                response.append(piece)
+                yield {'event': 'token', 'stage': stage, 'text': piece}
+            
+            # Verifica se a resposta indica que o conhecimento geral foi necessário
+            if stage == 'context':
+                if not self._needs_general_knowledge("".join(response)):
+                    break
+                logger.info("\nResposta não encontrada no contexto. Usando conhecimento base do modelo...")
+        
+        total_ms = (time.time() - start_time) * 1000
+        logger.info(f"Resposta gerada em {total_ms / 1000:.2f} segundos "
+                    f"(primeiro token em {(first_token_ms or 0) / 1000:.2f} segundos)")
+        yield {'event': 'done', 'first_token_ms': first_token_ms, 'total_ms': total_ms}
+
+    @staticmethod
+    def _training_prompt(documents: List[str]) -> Tuple[str, str]:
+        """Monta (prompt, system_prompt) que apresenta os documentos ao modelo."""
+        context_text = "".join(doc + "\n\n" for doc in documents)
         logger.info(f"Tamanho total do contexto: {len(context_text)} caracteres")
         
         system_prompt = """Você é um assistente especializado que combina conhecimento dos documentos 
@@ -182,13 +1421,171 @@ Complementando com o conhecimento base do modelo: {general_response}"""
         Confirme que você está pronto para:
         - Primeiro buscar respostas nos documentos fornecidos
         - Complementar com seu conhecimento base quando necessário"""
+        return training_prompt, system_prompt
+
+    @staticmethod
+    def _summary_prompt(text: str) -> Tuple[str, str]:
+        """Monta (prompt, system_prompt) que resume um documento (etapa map do treino)."""
+        system_prompt = """Você é um assistente que resume documentos de forma fiel e concisa, 
+        preservando fatos, nomes, números e definições."""
+        
+        prompt = f"""Resuma o documento abaixo, mantendo todas as informações que possam ser 
+        usadas para responder perguntas sobre ele.
+
+        Documento:
+        {text}
+
+        Resumo:"""
+        return prompt, system_prompt
+
+    @staticmethod
+    def _combine_summaries_prompt(summaries: List[str]) -> Tuple[str, str]:
+        """Monta (prompt, system_prompt) que funde vários resumos em um (etapa reduce do treino)."""
+        system_prompt = """Você é um assistente que resume documentos de forma fiel e concisa, 
+        preservando fatos, nomes, números e definições."""
+        
+        joined = "\n\n".join(f"Resumo {i + 1}:\n{summary}" for i, summary in enumerate(summaries))
+        prompt = f"""Combine os resumos abaixo em um único resumo, sem repetir informações 
+        e sem perder fatos relevantes.
+
+        {joined}
+
+        Resumo combinado:"""
+        return prompt, system_prompt
+
+    @staticmethod
+    def is_error_response(response: str) -> bool:
+        """Indica se process_with_model devolveu uma mensagem de erro em vez de uma geração."""
+        return response.startswith(("Erro na API do Ollama", "Erro ao conectar com Ollama"))
+
+    def _split_document(self, document: str) -> List[str]:
+        """Divide documentos maiores que train_max_chars em seções, de preferência entre parágrafos."""
+        sections = []
+        while len(document) > self.train_max_chars:
+            cut = document.rfind("\n\n", 0, self.train_max_chars)
+            if cut < self.train_max_chars // 2:
+                cut = document.rfind(" ", 0, self.train_max_chars)
+            if cut < self.train_max_chars // 2:
+                cut = self.train_max_chars
+            sections.append(document[:cut])
+            document = document[cut:].lstrip()
+        if document:
+            sections.append(document)
+        return sections
+
+    def _summarize(self, text: str, model_name: str) -> str:
+        """Resume uma seção, reaproveitando o resumo em cache se o conteúdo não mudou."""
+        content_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        cached = self.summary_cache.get(model_name, content_hash)
+        if cached is not None:
+            return cached
+        prompt, system_prompt = self._summary_prompt(text)
+        summary = self.process_with_model(prompt, model_name, system_prompt)
+        if self.is_error_response(summary):
+            raise RuntimeError(summary)
+        self.summary_cache.put(model_name, content_hash, summary)
+        return summary
+
+    def _combine_summaries(self, summaries: List[str], model_name: str) -> str:
+        if len(summaries) == 1:
+            return summaries[0]
+        prompt, system_prompt = self._combine_summaries_prompt(summaries)
+        combined = self.process_with_model(prompt, model_name, system_prompt)
+        if self.is_error_response(combined):
+            raise RuntimeError(combined)
+        return combined
+
+    def _group_summaries(self, summaries: List[str]) -> List[List[str]]:
+        """Agrupa resumos consecutivos em grupos de até train_max_chars (ao menos pares, para garantir progresso)."""
+        groups, size = [[]], 0
+        for summary in summaries:
+            if groups[-1] and size + len(summary) + 2 > self.train_max_chars:
+                groups.append([])
+                size = 0
+            groups[-1].append(summary)
+            size += len(summary) + 2
+        if len(groups) == len(summaries):
+            groups = [summaries[i:i + 2] for i in range(0, len(summaries), 2)]
+        return groups
+
+    def _map_reduce_documents(self, documents: List[str], model_name: str) -> List[str]:
+        """
+        Reduz o corpus a resumos que cabem em train_max_chars.
+        
+        Map: cada documento (ou seção, se maior que o limite) é resumido em
+        paralelo, com até train_map_workers gerações, e o resumo fica em
+        cache pelo hash do conteúdo. Reduce: enquanto os resumos não cabem
+        no limite, grupos consecutivos são fundidos, nível a nível.
+        
+        Raises:
+            RuntimeError: Se alguma geração falhar
+        """
+        sections = [section for document in documents for section in self._split_document(document)]
+        hits_before = self.summary_cache.stats['hits']
+        # copy_context por tarefa: as gerações herdam a prioridade do treino
+        with ThreadPoolExecutor(max_workers=self.train_map_workers) as executor:
+            futures = [executor.submit(contextvars.copy_context().run, self._summarize, section, model_name)
+                       for section in sections]
+            summaries = []
+            with tqdm(total=len(futures), desc="Resumindo documentos") as pbar:
+                for future in futures:
+                    summaries.append(future.result())
+                    pbar.update(1)
+            logger.info(f"{len(sections)} seções resumidas "
+                        f"({self.summary_cache.stats['hits'] - hits_before} do cache)")
+            
+            level = 0
+            while len(summaries) > 1 and sum(len(summary) + 2 for summary in summaries) > self.train_max_chars:
+                groups = self._group_summaries(summaries)
+                level += 1
+                logger.info(f"Redução nível {level}: {len(summaries)} resumos em {len(groups)} grupos")
+                futures = [executor.submit(contextvars.copy_context().run, self._combine_summaries, group, model_name)
+                           for group in groups]
+                summaries = [future.result() for future in futures]
+        return summaries
+
+    def train_model(self, documents: List[str], model_name: str, context: Optional[str] = None,
+                    corpus_version: Any = None, map_reduce: Optional[bool] = None) -> str:
+        """
+        Prepara o modelo para usar tanto os documentos fornecidos quanto seu conhecimento base.
+        
+        Com corpus_version, o contexto devolvido pelo Ollama (documentos já
+        avaliados) é guardado como sessão de (modelo, versão), reaproveitada
+        por ask_question enquanto o corpus não mudar.
+        
+        Com map_reduce (por padrão, quando os documentos passam de
+        train_max_chars), o modelo recebe resumos dos documentos em vez do
+        texto integral; ver _map_reduce_documents.
+        """
+        logger.info(f"\nPreparando modelo {model_name} com documentos personalizados")
+        logger.info(f"Número de documentos: {len(documents)}")
+        start_time = time.time()
+        
+        if map_reduce is None:
+            map_reduce = sum(len(doc) + 2 for doc in documents) > self.train_max_chars
+        if map_reduce:
+            logger.info("\nResumindo documentos (map-reduce)...")
+            try:
+                with self.priority('train'):
+                    documents = self._map_reduce_documents(documents, model_name)
+            except RuntimeError as e:
+                logger.error(f"Erro ao resumir documentos: {str(e)}")
+                return str(e)
+        
+        training_prompt, system_prompt = self._training_prompt(documents)
         
         logger.info("\nEnviando documentos para o modelo...")
-        response = self.process_with_model(
-            text=training_prompt,
-            model_name=model_name,
-            system_prompt=system_prompt
-        )
+        # Treino cede a vez às perguntas interativas na fila do Ollama
+        with self.priority('train'):
+            response, context_tokens = self._generate(
+                text=training_prompt,
+                model_name=model_name,
+                system_prompt=system_prompt,
+                want_context=corpus_version is not None
+            )
+        if context_tokens and corpus_version is not None:
+            self.sessions.put(model_name, corpus_version, context_tokens)
+            logger.info(f"Sessão criada: {len(context_tokens)} tokens de contexto para {model_name}")
         
         processing_time = time.time() - start_time
         logger.info(f"Treinamento concluído em {processing_time:.2f} segundos")